@@ -0,0 +1,264 @@
+"""Массовая рассылка: пачки против запроса на пользователя и возобновление после сбоя.
+
+Заполняет временную SQLite-базу пользователями с небольшими библиотеками
+(часть фильмов с рецензиями) и меряет:
+
+* сбор дайджеста «фильмы без рецензии» по запросу на пользователя и одним
+  запросом на пачку — время пачки и пользователей в секунду;
+* прогон BroadcastRunner с заглушкой очереди отправки: процесс «падает»
+  посреди рассылки, не снимая аренду, второй исполнитель дожидается её
+  окончания и доводит задание до конца. Отчёт — сколько чатов получили
+  сообщение дважды (должно быть 0) и сколько сообщений потеряно в пачке сбоя;
+* штатную остановку посреди пачки: объявление должно дойти до каждого
+  пользователя ровно один раз, иначе прогон завершается ошибкой.
+
+    python -m benchmarks.broadcast --users 100000 --batch-size 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+INSERT_BATCH = 10_000
+
+
+class Crash(BaseException):
+    """Падение процесса: не Exception и не отмена, поэтому исполнитель не успевает сохранить позицию."""
+
+
+class FakeOutbound:
+    """Заглушка OutboundQueue: считает сообщения по чатам и может «уронить» процесс."""
+
+    def __init__(self, crash_after: int = 0):
+        self.delivered = Counter()
+        self.crash_after = crash_after
+        self.sent = 0
+        self.crashed = asyncio.Event()
+
+    async def send(self, chat_id, text, **kwargs):
+        if self.crash_after and self.sent >= self.crash_after:
+            self.crashed.set()
+            raise Crash()
+        self.delivered[chat_id] += 1
+        self.sent += 1
+
+
+async def populate(users: int, movies_per_user: int, reviewed: float, seed: int):
+    from sqlalchemy import insert
+    from database.database import AsyncSessionLocal, engine
+    from database.migrations import migrate
+    from database.models import CatalogMovie, Movie, Review, User
+
+    await migrate()
+    rng = random.Random(seed)
+    async with AsyncSessionLocal() as session:
+        await session.execute(insert(CatalogMovie), [
+            {'id': catalog_id, 'title': f'Фильм {catalog_id}', 'normalized_title': f'фильм {catalog_id}'}
+            for catalog_id in range(1, 1001)])
+        movie_id = 0
+        for start in range(1, users + 1, INSERT_BATCH):
+            user_ids = range(start, min(users + 1, start + INSERT_BATCH))
+            movies, reviews = [], []
+            for user_id in user_ids:
+                for _ in range(rng.randint(0, movies_per_user * 2)):
+                    movie_id += 1
+                    movies.append({'id': movie_id, 'user_id': user_id, 'catalog_id': rng.randint(1, 1000)})
+                    if rng.random() < reviewed:
+                        reviews.append({'user_id': user_id, 'movie_id': movie_id, 'rating': rng.randint(1, 5)})
+            await session.execute(insert(User), [
+                {'id': user_id, 'telegram_id': 10 ** 9 + user_id, 'username': f'user{user_id}'}
+                for user_id in user_ids])
+            await session.execute(insert(Movie), movies)
+            if reviews:
+                await session.execute(insert(Review), reviews)
+        await session.commit()
+    async with engine.connect() as conn:
+        await conn.exec_driver_sql('ANALYZE')
+
+
+async def per_user_digests(session, after: int, limit: int):
+    """Наивный вариант: запрос пользователей и отдельный запрос на каждого."""
+    from sqlalchemy import select
+    from database.jobs import format_digest, user_batch
+    from database.models import CatalogMovie, Movie, Review
+
+    messages = []
+    for user_id, telegram_id in await user_batch(session, after, limit):
+        titles = (await session.scalars(
+            select(CatalogMovie.title).join(Movie, Movie.catalog_id == CatalogMovie.id)
+            .outerjoin(Review, Review.movie_id == Movie.id)
+            .where(Movie.user_id == user_id, Review.id.is_(None))
+            .order_by(Movie.id.desc()))).all()
+        if titles:
+            messages.append((user_id, telegram_id, format_digest(len(titles), titles[:5])))
+    return messages
+
+
+async def measure_batches(args):
+    from database.database import AsyncSessionLocal
+    from database.jobs import unreviewed_digests, user_batch
+    from benchmarks.load import percentile
+
+    naive_users = min(args.users, args.naive_users)
+    async with AsyncSessionLocal() as session:
+        started = time.perf_counter()
+        naive = await per_user_digests(session, 0, naive_users)
+        naive_elapsed = time.perf_counter() - started
+
+    timings = []
+    messages = 0
+    cursor = 0
+    started = time.perf_counter()
+    while True:
+        async with AsyncSessionLocal() as session:
+            batch_started = time.perf_counter()
+            users = await user_batch(session, cursor, args.batch_size)
+            if not users:
+                break
+            digests = await unreviewed_digests(session, cursor, users[-1][0])
+            timings.append((time.perf_counter() - batch_started) * 1000)
+        if cursor == 0:
+            first = {chat_id: text for _, chat_id, text in digests}
+            assert all(first.get(chat_id) == text for _, chat_id, text in naive if chat_id in first), \
+                'дайджесты пачкой и по одному пользователю расходятся'
+        messages += len(digests)
+        cursor = users[-1][0]
+    elapsed = time.perf_counter() - started
+
+    print(f'по запросу на пользователя: {naive_users / naive_elapsed:>10.0f} польз./с '
+          f'({naive_users} пользователей за {naive_elapsed:.2f} с)')
+    print(f'один запрос на пачку:       {args.users / elapsed:>10.0f} польз./с '
+          f'({args.users} пользователей за {elapsed:.2f} с, {messages} дайджестов)')
+    print(f'пачка {args.batch_size}: p50 {percentile(timings, 50):.1f} мс, p99 {percentile(timings, 99):.1f} мс')
+    return messages
+
+
+async def crash_and_resume(args, expected: int):
+    from sqlalchemy import select
+    from database.database import AsyncSessionLocal
+    from database.jobs import UNREVIEWED_DIGEST, create_job
+    from database.models import Job
+    from bot.broadcast import BroadcastRunner
+
+    async with AsyncSessionLocal() as session:
+        await create_job(session, UNREVIEWED_DIGEST, 'benchmark', {'titles': 5})
+        await session.commit()
+
+    first_outbound = FakeOutbound(crash_after=expected // 2)
+    first = BroadcastRunner(sender=first_outbound, rate=args.rate, batch_size=args.batch_size,
+                            poll_interval=0.05, lease_seconds=args.lease, digest_interval_days=0)
+    started = time.perf_counter()
+    await first.start()
+    await first_outbound.crashed.wait()
+    # Задача оборвалась на Crash, аренда осталась до lease_until.
+    await asyncio.gather(first.task, return_exceptions=True)
+
+    second_outbound = FakeOutbound()
+    second = BroadcastRunner(sender=second_outbound, rate=args.rate, batch_size=args.batch_size,
+                             poll_interval=0.05, lease_seconds=args.lease, digest_interval_days=0)
+    await second.start()
+    while True:
+        async with AsyncSessionLocal() as session:
+            job = await session.scalar(select(Job).where(Job.key == 'benchmark'))
+        if job.status == 'done':
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    await second.stop()
+
+    delivered = first_outbound.delivered + second_outbound.delivered
+    duplicates = sum(1 for count in delivered.values() if count > 1)
+    print(f'рассылка со сбоем после {first_outbound.sent} сообщений: '
+          f'{elapsed:.2f} с (из них ожидание аренды {args.lease} с)')
+    print(f'доставлено {sum(delivered.values())} из {expected}, потеряно в пачке сбоя '
+          f'{expected - len(delivered)}, повторов: {duplicates}, в задании sent={job.sent}')
+    print(f'1M пользователей при BROADCAST_RATE {args.production_rate:.0f}/с: '
+          f'≈{expected / args.users * 1_000_000 / args.production_rate / 3600:.1f} ч на отправку')
+
+
+async def stop_mid_batch(args):
+    from sqlalchemy import select
+    from database.database import AsyncSessionLocal
+    from database.jobs import ANNOUNCEMENT, create_job
+    from database.models import Job, User
+    from bot.broadcast import BroadcastRunner
+
+    users = min(args.users, args.stop_users)
+    async with AsyncSessionLocal() as session:
+        await create_job(session, ANNOUNCEMENT, 'stop', {'text': 'Объявление'})
+        await session.commit()
+        chat_ids = set((await session.scalars(select(User.telegram_id).order_by(User.id).limit(users))).all())
+        # Остальные пользователи объявление тоже получат: сверяем только первые users.
+        job_id = await session.scalar(select(Job.id).where(Job.key == 'stop'))
+
+    options = dict(rate=args.stop_rate, batch_size=args.stop_batch, poll_interval=0.05, lease_seconds=args.lease,
+                   digest_interval_days=0)
+    first_outbound, second_outbound = FakeOutbound(), FakeOutbound()
+    first = BroadcastRunner(sender=first_outbound, **options)
+    await first.start()
+    while first_outbound.sent < args.stop_batch * 1.5:
+        await asyncio.sleep(0.01)
+    await first.stop()
+    async with AsyncSessionLocal() as session:
+        stopped = await session.get(Job, job_id)
+        cursor, sent = stopped.cursor, stopped.sent
+
+    # Задание другой пачки пользователей не ждём: после остановки аренда снята.
+    second = BroadcastRunner(sender=second_outbound, **options)
+    started = time.perf_counter()
+    await second.start()
+    while second_outbound.sent + first_outbound.sent < users:
+        await asyncio.sleep(0.01)
+    await second.stop()
+
+    delivered = first_outbound.delivered + second_outbound.delivered
+    missing = [chat_id for chat_id in chat_ids if not delivered[chat_id]]
+    duplicates = [chat_id for chat_id in chat_ids if delivered[chat_id] > 1]
+    print(f'остановка посреди пачки {args.stop_batch}: поставлено {first_outbound.sent}, '
+          f'в задании cursor={cursor} sent={sent}; продолжение за {time.perf_counter() - started:.2f} с')
+    print(f'первые {users} пользователей: пропущено {len(missing)}, повторов {len(duplicates)}')
+    assert sent == first_outbound.sent, 'sent в задании не совпадает с поставленным в очередь'
+    assert not missing and not duplicates, 'остановка посреди пачки потеряла или повторила сообщения'
+
+
+async def run(args):
+    from database.database import engine
+
+    engine.echo = False
+    started = time.perf_counter()
+    await populate(args.users, args.movies_per_user, args.reviewed, args.seed)
+    print(f'база заполнена за {time.perf_counter() - started:.1f} с')
+    expected = await measure_batches(args)
+    await crash_and_resume(args, expected)
+    await stop_mid_batch(args)
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--movies-per-user', type=int, default=3, help='в среднем фильмов на пользователя')
+    parser.add_argument('--reviewed', type=float, default=0.5, help='доля фильмов с рецензией')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--naive-users', type=int, default=5000, help='пользователей для наивного варианта')
+    parser.add_argument('--rate', type=float, default=1e9, help='скорость рассылки в прогоне со сбоем, сообщ./с')
+    parser.add_argument('--production-rate', type=float, default=20, help='BROADCAST_RATE для оценки времени')
+    parser.add_argument('--lease', type=float, default=2, help='аренда задания, с')
+    parser.add_argument('--stop-users', type=int, default=600, help='пользователей в проверке остановки')
+    parser.add_argument('--stop-batch', type=int, default=150, help='пачка в проверке остановки')
+    parser.add_argument('--stop-rate', type=float, default=100, help='скорость в проверке остановки, сообщ./с')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f'sqlite+aiosqlite:///{os.path.join(directory, "broadcast.db")}'
+    os.environ.setdefault('TOKEN', '0:benchmark')
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
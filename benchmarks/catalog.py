@@ -0,0 +1,199 @@
+"""Каталог фильмов против копии названия у каждого пользователя: место и поиск.
+
+Строит две SQLite-базы с одинаковыми библиотеками: старую схему, где movies
+хранит title (индекс (user_id, title)), и текущую с catalog_movies. Названия
+берутся из закона Ципфа: немногие популярные фильмы есть почти у всех, плюс
+варианты написания («The Matrix», «the matrix!»), которые каталог склеивает.
+
+    python -m benchmarks.catalog --movies 200000 --titles 20000
+
+Поиск меряется двумя запросами: по библиотеке одного пользователя
+(search_movies) и по всем различным фильмам с подходящим названием.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+WORDS = ['matrix', 'star', 'wars', 'love', 'night', 'dark', 'knight', 'return', 'city', 'river',
+         'ghost', 'island', 'winter', 'summer', 'secret', 'garden', 'blue', 'red', 'last', 'first']
+QUERIES = ['matrix', 'dark kni', 'summer', 'ghost isl', 'red']
+MOVIES_PER_USER = 200
+BATCH_SIZE = 10_000
+
+
+def make_titles(rng: random.Random, count: int):
+    titles = set()
+    while len(titles) < count:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(1, 4))]
+        titles.add(' '.join(words + [str(rng.randint(1, 999))]).title())
+    return sorted(titles)
+
+
+def spelling(rng: random.Random, title: str) -> str:
+    """Так пользователи вводят одно и то же название по-разному."""
+    variant = rng.random()
+    if variant < 0.1:
+        return title.lower()
+    if variant < 0.15:
+        return title.upper()
+    if variant < 0.2:
+        return title + '!'
+    return title
+
+
+def library(movies: int, titles: int, zipf: float, seed: int):
+    """Список (user_id, title) для всех пользователей, по MOVIES_PER_USER фильмов на каждого."""
+    rng = random.Random(seed)
+    popular = make_titles(rng, titles)
+    weights = [1 / rank ** zipf for rank in range(1, titles + 1)]
+    picks = rng.choices(popular, weights=weights, k=movies)
+    return [(index // MOVIES_PER_USER + 1, spelling(rng, title)) for index, title in enumerate(picks)]
+
+
+def file_size(url: str) -> int:
+    return os.path.getsize(url.split('///', 1)[1])
+
+
+async def measure(session_factory, search, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        for query in QUERIES:
+            async with session_factory() as session:
+                started = time.perf_counter()
+                await search(session, query)
+                timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+async def build_legacy(url: str, rows):
+    from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, Text, func, insert
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    metadata = MetaData()
+    users = Table('users', metadata, Column('id', Integer, primary_key=True))
+    movies = Table(
+        'movies', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('title', String, nullable=False),
+        Column('description', Text),
+        Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+        Column('created_at', DateTime, server_default=func.now()),
+        Column('updated_at', DateTime, server_default=func.now()),
+        Index('ix_movies_user_id_title', 'user_id', 'title'),
+        Index('ix_movies_user_id_id', 'user_id', 'id'),
+    )
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+        await conn.execute(insert(users), [{'id': user_id} for user_id in sorted({user for user, _ in rows})])
+        for start in range(0, len(rows), BATCH_SIZE):
+            await conn.execute(insert(movies), [{'title': title, 'description': '', 'user_id': user_id}
+                                                for user_id, title in rows[start:start + BATCH_SIZE]])
+    async with engine.connect() as conn:
+        await conn.exec_driver_sql('VACUUM')
+    return engine, movies
+
+
+async def build_catalog(rows):
+    from sqlalchemy import insert
+    from database.catalog import get_catalog_ids
+    from database.database import AsyncSessionLocal, engine, init_db
+    from database.models import Movie, User
+
+    await init_db()
+    async with AsyncSessionLocal() as session:
+        await session.execute(insert(User), [{'id': user_id, 'telegram_id': user_id, 'username': f'user{user_id}'}
+                                             for user_id in sorted({user for user, _ in rows})])
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            catalog_ids = await get_catalog_ids(session, [title for _, title in batch])
+            await session.execute(insert(Movie), [{'catalog_id': catalog_id, 'description': '', 'user_id': user_id}
+                                                  for catalog_id, (user_id, _) in zip(catalog_ids, batch)])
+        await session.commit()
+    async with engine.connect() as conn:
+        await conn.exec_driver_sql('VACUUM')
+
+
+async def run(args, legacy_url: str, catalog_url: str):
+    from sqlalchemy import func, select
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from database.catalog import normalize_title
+    from database.database import AsyncSessionLocal, engine
+    from database.models import CatalogMovie
+    from database.search import escape_like, search_movies
+
+    engine.echo = False
+    rows = library(args.movies, args.titles, args.zipf, args.seed)
+
+    started = time.perf_counter()
+    legacy_engine, legacy_movies = await build_legacy(legacy_url, rows)
+    legacy_build = time.perf_counter() - started
+    started = time.perf_counter()
+    await build_catalog(rows)
+    catalog_build = time.perf_counter() - started
+    legacy_session = async_sessionmaker(legacy_engine)
+
+    async def legacy_library(session, query):
+        pattern = f'%{escape_like(query)}%'
+        return (await session.execute(
+            select(legacy_movies.c.id, legacy_movies.c.title)
+            .where(legacy_movies.c.user_id == 1)
+            .where(legacy_movies.c.title.ilike(pattern, escape='\\'))
+            .order_by(func.instr(func.lower(legacy_movies.c.title), query.lower()), legacy_movies.c.id)
+            .limit(10))).all()
+
+    async def catalog_library(session, query):
+        return await search_movies(session, 1, query)
+
+    async def legacy_global(session, query):
+        pattern = f'%{escape_like(query)}%'
+        return (await session.execute(
+            select(func.lower(legacy_movies.c.title)).distinct()
+            .where(legacy_movies.c.title.ilike(pattern, escape='\\')))).all()
+
+    async def catalog_global(session, query):
+        pattern = f'%{escape_like(normalize_title(query))}%'
+        return (await session.execute(
+            select(CatalogMovie.title).where(CatalogMovie.normalized_title.like(pattern, escape='\\')))).all()
+
+    async with AsyncSessionLocal() as session:
+        distinct = await session.scalar(select(func.count()).select_from(CatalogMovie))
+
+    print(f'{args.movies} фильмов в библиотеках, {distinct} записей в каталоге '
+          f'({args.movies / distinct:.1f} копий на фильм)')
+    print(f'{"":<28} {"title у каждого":>16} {"каталог":>12}')
+    print(f'{"размер базы, КБ":<28} {file_size(legacy_url) // 1024:>16} {file_size(catalog_url) // 1024:>12}')
+    print(f'{"загрузка, с":<28} {legacy_build:>16.2f} {catalog_build:>12.2f}')
+    print(f'{"поиск в библиотеке, мс":<28} {await measure(legacy_session, legacy_library, args.repeats):>16.2f} '
+          f'{await measure(AsyncSessionLocal, catalog_library, args.repeats):>12.2f}')
+    print(f'{"поиск по всем фильмам, мс":<28} {await measure(legacy_session, legacy_global, args.repeats):>16.2f} '
+          f'{await measure(AsyncSessionLocal, catalog_global, args.repeats):>12.2f}')
+
+    await legacy_engine.dispose()
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--movies', type=int, default=200_000, help='всего фильмов во всех библиотеках')
+    parser.add_argument('--titles', type=int, default=20_000, help='различных фильмов')
+    parser.add_argument('--zipf', type=float, default=1.1, help='показатель закона Ципфа для популярности')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    legacy_url = f'sqlite+aiosqlite:///{os.path.join(directory, "legacy.db")}'
+    catalog_url = f'sqlite+aiosqlite:///{os.path.join(directory, "catalog.db")}'
+    os.environ['DATABASE_URL'] = catalog_url
+    os.environ.setdefault('TOKEN', '0:benchmark')
+
+    asyncio.run(run(args, legacy_url, catalog_url))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Локальный Bot API с лимитами Telegram для проверки исходящей очереди.
+
+Отвечает на sendMessage и другие методы отправки, как настоящий сервер, и
+возвращает 429 с retry_after, если бот превышает общий лимит или лимит чата.
+Дополнительно может отдавать случайные 429 с вероятностью --error-rate.
+
+    python -m benchmarks.fake_bot_api --port 8081
+    TELEGRAM_API_URL=http://localhost:8081 python main.py
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import defaultdict
+from typing import Any, Dict
+from aiohttp import web
+
+SEND_METHODS = {'sendmessage', 'senddocument', 'editmessagetext', 'editmessagereplymarkup', 'sendphoto'}
+
+
+class Bucket:
+    """Серверный token bucket: запрос без токена получает 429."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class FakeBotAPI:
+    def __init__(self, global_limit: int = 30, chat_limit: int = 1, chat_burst: int = 3, retry_after: int = 1,
+                 error_rate: float = 0.0, latency: float = 0.0):
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.chat_burst = chat_burst
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.latency = latency
+        self.global_bucket = Bucket(global_limit, global_limit)
+        self.chat_buckets: Dict[str, Bucket] = {}
+        self.message_ids = itertools.count(1)
+        self.stats = {'requests': 0, 'delivered': 0, 'too_many_requests': 0}
+        self.delivered: Dict[str, list] = defaultdict(list)
+
+    def too_many_requests(self) -> web.Response:
+        self.stats['too_many_requests'] += 1
+        return web.json_response({
+            'ok': False, 'error_code': 429,
+            'description': f'Too Many Requests: retry after {self.retry_after}',
+            'parameters': {'retry_after': self.retry_after},
+        }, status=429)
+
+    def ok(self, result: Any) -> web.Response:
+        return web.json_response({'ok': True, 'result': result})
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        params = dict(await request.post()) if request.can_read_body else {}
+        self.stats['requests'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == 'getme':
+            return self.ok({'id': 42, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'})
+        if method == 'getupdates':
+            await asyncio.sleep(min(float(params.get('timeout', 0) or 0), 1))
+            return self.ok([])
+        if method not in SEND_METHODS:
+            return self.ok(True)
+
+        chat_id = str(params.get('chat_id'))
+        now = time.monotonic()
+        if random.random() < self.error_rate:
+            return self.too_many_requests()
+        if self.global_limit and not self.global_bucket.take(now):
+            return self.too_many_requests()
+        if self.chat_limit:
+            bucket = self.chat_buckets.setdefault(chat_id, Bucket(self.chat_limit, self.chat_burst))
+            if not bucket.take(now):
+                return self.too_many_requests()
+
+        self.stats['delivered'] += 1
+        text = params.get('text') or params.get('caption') or ''
+        self.delivered[chat_id].append(text)
+        return self.ok({
+            'message_id': next(self.message_ids), 'date': int(time.time()), 'text': text,
+            'chat': {'id': int(chat_id), 'type': 'private'},
+        })
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/stats', self.handle_stats)
+        return app
+
+
+async def start_fake_bot_api(api: FakeBotAPI, host: str = '127.0.0.1', port: int = 0):
+    """Запускает сервер и возвращает (runner, base_url); port = 0 — любой свободный."""
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f'http://{host}:{port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--global-limit', type=int, default=30, help='сообщений в секунду на бота')
+    parser.add_argument('--chat-limit', type=int, default=1, help='сообщений в секунду на чат')
+    parser.add_argument('--chat-burst', type=int, default=3)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля случайных 429')
+    args = parser.parse_args()
+
+    api = FakeBotAPI(global_limit=args.global_limit, chat_limit=args.chat_limit, chat_burst=args.chat_burst,
+                     retry_after=args.retry_after, error_rate=args.error_rate)
+    web.run_app(api.app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,461 @@
+"""Нагрузочный прогон настоящих обработчиков без сети.
+
+Синтетические апдейты идут через настоящие Dispatcher и router, ответы Bot API
+подменяет FakeSession. Каждый виртуальный пользователь проходит сценарии
+добавления фильма и рецензии, просмотра списка, редактирования и удаления.
+
+Запуск:
+    python -m benchmarks.load --users 2000 --concurrency 200 --output load.json
+    python -m benchmarks.load --database-url postgresql+asyncpg://localhost/bench --reset
+    python -m benchmarks.load --compare old.json new.json
+    python -m benchmarks.load --database-url sqlite+aiosqlite:///primary.db \
+        --replica-url sqlite+aiosqlite:///replica.db --replica-lag 0.5 --reset
+
+Отчёт: пропускная способность, p50/p95/p99 по обработчикам, число SQL-запросов
+на апдейт и ошибки. Ошибкой считается исключение из обработчика и запись в лог
+уровня ERROR во время апдейта (обработчики сами ловят ошибки базы и только
+логируют их); апдейты, которые не дошли ни до одного обработчика, считаются
+отдельно. Если есть ошибки или необработанные апдейты, прогон завершается с
+кодом 1. --reset удаляет и заново создаёт все таблицы, используйте только с
+отдельной базой для замеров.
+
+На SQLite записи идут по одной (очередь писателей в database.database),
+поэтому рост --concurrency увеличивает задержку, а не пропускную
+способность. На одном ядре это примерно 220 апдейтов/с и p99 около 4 с при
+--concurrency 100 (значения по умолчанию) и около 8 с при 200. Задержка
+записи дольше DB_SQLITE_BUSY_TIMEOUT_MS станет ошибкой. Для большей
+конкурентности нужен PostgreSQL.
+
+С --replica-url чтения обработчиков идут на реплику. Для двух SQLite-файлов
+репликацию изображает копирование основной базы в реплику раз в
+--replica-lag секунд. Отчёт показывает долю запросов на реплике и число
+шагов, которым не нашлось кнопки в клавиатуре: так проявилось бы чтение
+собственных изменений с отставшей реплики.
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+current_update: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar('current_update',
+                                                                                         default=None)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+class ErrorLog(logging.Handler):
+    """Считает записи лога уровня ERROR и приписывает их текущему апдейту."""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.messages = Counter()
+
+    def emit(self, record: logging.LogRecord):
+        message = record.getMessage().splitlines()[0][:200]
+        self.messages[re.sub(r'\b\d+\b', 'N', message)] += 1
+        sample = current_update.get()
+        if sample is not None:
+            sample.setdefault('error', message)
+
+
+def build_fake_session():
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import EditMessageReplyMarkup, EditMessageText, SendDocument, SendMessage
+    from aiogram.types import Chat, Message
+
+    class FakeSession(BaseSession):
+        """Отвечает на методы Bot API без сети и запоминает последние клавиатуры."""
+
+        def __init__(self):
+            super().__init__()
+            self.requests = 0
+            self.message_ids = itertools.count(1)
+            self.last_markup: Dict[int, Any] = {}
+
+        async def make_request(self, bot, method, timeout=None):
+            self.requests += 1
+            if isinstance(method, (SendMessage, EditMessageText, EditMessageReplyMarkup, SendDocument)):
+                chat_id = method.chat_id
+                if getattr(method, 'reply_markup', None) is not None:
+                    self.last_markup[chat_id] = method.reply_markup
+                return Message(message_id=next(self.message_ids), date=datetime.now(),
+                               chat=Chat(id=chat_id, type='private'), text=getattr(method, 'text', None))
+            return True
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b''
+
+        async def close(self):
+            pass
+
+    return FakeSession()
+
+
+class UpdateFactory:
+    def __init__(self):
+        self.ids = itertools.count(1)
+
+    def message(self, user_id: int, text: str):
+        from aiogram.types import Chat, Message, Update, User
+
+        return Update(update_id=next(self.ids), message=Message(
+            message_id=next(self.ids), date=datetime.now(), text=text,
+            chat=Chat(id=user_id, type='private'),
+            from_user=User(id=user_id, is_bot=False, first_name=f'User {user_id}', username=f'user{user_id}'),
+        ))
+
+    def callback(self, user_id: int, data: str):
+        from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+        return Update(update_id=next(self.ids), callback_query=CallbackQuery(
+            id=str(next(self.ids)), chat_instance=str(user_id), data=data,
+            from_user=User(id=user_id, is_bot=False, first_name=f'User {user_id}'),
+            message=Message(message_id=1, date=datetime.now(), chat=Chat(id=user_id, type='private'), text='…'),
+        ))
+
+
+def pick_button(markup, predicate) -> Optional[str]:
+    for row in getattr(markup, 'inline_keyboard', None) or []:
+        for button in row:
+            if button.callback_data and predicate(button):
+                return button.callback_data
+    return None
+
+
+def pick_movie(title: str):
+    return lambda markup: pick_button(markup, lambda button: button.text == title)
+
+
+def scenario(user_id: int, movies: int):
+    """Шаги одного пользователя: ('text', str) или ('callback', функция от последней клавиатуры)."""
+    first, second = f'Movie {user_id}-0', f'Movie {user_id}-1'
+    steps = [('text', '/start')]
+    for index in range(movies):
+        steps += [('text', '🎥 Добавить фильм'), ('text', f'Movie {user_id}-{index}'), ('text', 'Описание')]
+    steps += [('text', '🗒️ Добавить рецензию'), ('text', first), ('callback', pick_movie(first)), ('text', '4'),
+              ('text', 'Хорошо')]
+    steps += [('text', '🧡 Просмотреть список фильмов'),
+              ('callback', lambda markup: pick_button(markup, lambda button: ':next:' in button.callback_data)),
+              ('text', '🧡 Просмотреть список фильмов')]
+    steps += [('text', '✏️ Редактировать рецензию'), ('text', first), ('callback', pick_movie(first)), ('text', '5'),
+              ('text', 'Отлично')]
+    steps += [('text', '❌ Удалить фильм'), ('callback', pick_movie(second)), ('text', 'Да')]
+    return steps
+
+
+async def run_user(user_id: int, movies: int, dp, bot, factory: UpdateFactory, samples: List[Dict[str, Any]],
+                   counters: Optional[Dict[str, int]] = None):
+    from bot.sender import outbound
+
+    for kind, payload in scenario(user_id, movies):
+        if kind == 'text':
+            update = factory.message(user_id, payload)
+        else:
+            data = payload(bot.session.last_markup.get(user_id))
+            if data is None:
+                if counters is not None:
+                    counters['missing_buttons'] += 1
+                continue
+            update = factory.callback(user_id, data)
+
+        sample = {'handler': 'unhandled', 'statements': 0}
+        token = current_update.set(sample)
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            sample['error'] = type(e).__name__
+        sample['latency'] = time.perf_counter() - started
+        current_update.reset(token)
+        samples.append(sample)
+        await outbound.flush(user_id)
+
+
+def install_probes(router, engine, counters: Dict[str, int]):
+    from sqlalchemy import event
+
+    async def handler_probe(handler, event_, data):
+        sample = current_update.get()
+        if sample is not None:
+            sample['handler'] = data['handler'].callback.__name__
+        return await handler(event_, data)
+
+    router.message.middleware(handler_probe)
+    router.callback_query.middleware(handler_probe)
+
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        sample = current_update.get()
+        if sample is not None:
+            sample['statements'] += 1
+        if statement.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.info['writes'] = True
+
+    @event.listens_for(engine.sync_engine, 'commit')
+    def count_commit(conn):
+        if conn.info.pop('writes', False):
+            counters['write_commits'] += 1
+
+    @event.listens_for(engine.sync_engine, 'rollback')
+    def forget_writes(conn):
+        conn.info.pop('writes', None)
+
+
+def install_replica_probe(replica_engine, counters: Dict[str, int]):
+    from sqlalchemy import event
+
+    @event.listens_for(replica_engine.sync_engine, 'before_cursor_execute')
+    def count_replica_statement(conn, cursor, statement, parameters, context, executemany):
+        counters['replica_statements'] += 1
+        sample = current_update.get()
+        if sample is not None:
+            sample['statements'] += 1
+
+
+def sqlite_path(url: str) -> str:
+    from sqlalchemy.engine import make_url
+
+    return make_url(url).database
+
+
+def copy_sqlite(source: str, target: str):
+    import sqlite3
+
+    source_connection, target_connection = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        source_connection.backup(target_connection)
+    finally:
+        source_connection.close()
+        target_connection.close()
+
+
+async def replicate(source: str, target: str, lag: float):
+    """Изображает асинхронную реплику: раз в lag секунд копирует основную базу."""
+    while True:
+        await asyncio.sleep(lag)
+        await asyncio.to_thread(copy_sqlite, source, target)
+
+
+def summarize(samples: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    by_handler = defaultdict(list)
+    for sample in samples:
+        by_handler[sample['handler']].append(sample)
+
+    def stats(group):
+        latencies = [sample['latency'] * 1000 for sample in group]
+        return {
+            'count': len(group),
+            'errors': sum(1 for sample in group if 'error' in sample),
+            'unhandled': sum(1 for sample in group if sample['handler'] == 'unhandled' and 'error' not in sample),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'statements_per_update': round(statistics.mean(sample['statements'] for sample in group), 3),
+        }
+
+    return {
+        'updates': len(samples),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_ups': round(len(samples) / elapsed, 1) if elapsed else 0,
+        'total': stats(samples),
+        'handlers': {name: stats(group) for name, group in sorted(by_handler.items())},
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result: Dict[str, Any]):
+    print(f'{result["updates"]} апдейтов за {result["elapsed_s"]} с, {result["throughput_ups"]} апдейтов/с')
+    if 'write_commits' in result:
+        print(f'коммитов с записью: {result["write_commits"]}')
+    if result.get('replica_statements') is not None:
+        total = sum(row['statements_per_update'] * row['count'] for row in result['handlers'].values())
+        print(f'запросов на реплике: {result["replica_statements"]} '
+              f'({result["replica_statements"] / total:.1%} от всех)' if total else '')
+    if result.get('missing_buttons'):
+        print(f'шагов без нужной кнопки: {result["missing_buttons"]}')
+    if 'page_cache' in result:
+        print(f'кэш страниц: {result["page_cache"]["hit_rate"]:.1%} попаданий, {result["page_cache"]["bytes"]} байт')
+    print(f'{"обработчик":<34} {"кол-во":>7} {"ошибок":>7} {"p50":>8} {"p95":>8} {"p99":>8} {"SQL/апд":>8}')
+    for name, row in [('ВСЕГО', result['total'])] + list(result['handlers'].items()):
+        errors = row.get('errors', 0) + row.get('unhandled', 0)
+        print(f'{name:<34} {row["count"]:>7} {errors:>7} {row["p50_ms"]:>8.2f} {row["p95_ms"]:>8.2f} '
+              f'{row["p99_ms"]:>8.2f} {row["statements_per_update"]:>8.2f}')
+    if failed(result):
+        print(f'ОШИБКИ: {result["total"]["errors"]} апдейтов с ошибкой, '
+              f'{result["total"].get("unhandled", 0)} не обработано')
+        for message, count in result.get('error_messages', {}).items():
+            print(f'  {count} × {message}')
+
+
+def failed(result: Dict[str, Any]) -> bool:
+    return bool(result['total'].get('errors') or result['total'].get('unhandled'))
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    print(f'{old.get("commit")} -> {new.get("commit")}: '
+          f'{old["throughput_ups"]} -> {new["throughput_ups"]} апдейтов/с')
+    print(f'{"обработчик":<34} {"p95 было":>9} {"p95 стало":>10} {"SQL было":>9} {"SQL стало":>10}')
+    for name in sorted(set(old['handlers']) | set(new['handlers'])):
+        before, after = old['handlers'].get(name, {}), new['handlers'].get(name, {})
+        print(f'{name:<34} {before.get("p95_ms", "-"):>9} {after.get("p95_ms", "-"):>10} '
+              f'{before.get("statements_per_update", "-"):>9} {after.get("statements_per_update", "-"):>10}')
+
+
+async def check_redis(url: str):
+    from redis.asyncio import Redis
+
+    client = Redis.from_url(url)
+    try:
+        await client.ping()
+    except Exception as e:
+        raise SystemExit(f'Redis {url} недоступен ({e}): --fsm-storage redis требует запущенный сервер')
+    finally:
+        await client.aclose()
+
+
+async def run(args, error_log: ErrorLog) -> Dict[str, Any]:
+    from bot.create_bot import bot, dp, setup_dispatcher
+    from bot.handlers import router
+    from database.cache import page_cache
+    from database.database import Base, engine, init_db, replica_engine
+    from database.migrations import schema_migrations
+
+    if args.reset:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(schema_migrations.drop, checkfirst=True)
+    await init_db()
+
+    from database.group_commit import group_commit
+
+    replication = None
+    if replica_engine is not None and engine.dialect.name == 'sqlite' and args.replica_lag is not None:
+        primary_path, replica_path = sqlite_path(str(engine.url)), sqlite_path(str(replica_engine.url))
+        copy_sqlite(primary_path, replica_path)
+        replication = asyncio.create_task(replicate(primary_path, replica_path, args.replica_lag))
+
+    setup_dispatcher()
+    counters = {'write_commits': 0, 'replica_statements': 0, 'missing_buttons': 0}
+    install_probes(router, engine, counters)
+    if replica_engine is not None:
+        install_replica_probe(replica_engine, counters)
+    bot.session = build_fake_session()
+    await dp.emit_startup(bot=bot)
+    factory = UpdateFactory()
+    samples: List[Dict[str, Any]] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(user_id):
+        async with semaphore:
+            await run_user(user_id, args.movies, dp, bot, factory, samples, counters)
+
+    first_user = args.first_user_id
+    started = time.perf_counter()
+    await asyncio.gather(*(limited(user_id) for user_id in range(first_user, first_user + args.users)))
+    elapsed = time.perf_counter() - started
+    if replication is not None:
+        replication.cancel()
+        await asyncio.gather(replication, return_exceptions=True)
+    if group_commit is not None:
+        await group_commit.close()
+    await dp.emit_shutdown(bot=bot)
+    await dp.storage.close()
+    await engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
+
+    result = summarize(samples, elapsed)
+    result.update(commit=git_commit(), created_at=datetime.now().isoformat(timespec='seconds'),
+                  dialect=engine.dialect.name, users=args.users, concurrency=args.concurrency, movies=args.movies,
+                  page_cache=page_cache.stats(), write_commits=counters['write_commits'],
+                  group_commit=group_commit.stats() if group_commit is not None else None,
+                  missing_buttons=counters['missing_buttons'],
+                  error_messages=dict(error_log.messages.most_common(5)))
+    if replica_engine is not None:
+        result['replica_statements'] = counters['replica_statements']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--movies', type=int, default=12, help='фильмов на пользователя')
+    parser.add_argument('--first-user-id', type=int, default=1_000_000)
+    parser.add_argument('--database-url', help='по умолчанию временная SQLite-база')
+    parser.add_argument('--fsm-storage', default='memory', choices=['memory', 'sql', 'redis'])
+    parser.add_argument('--group-commit', action='store_true', help='включить групповой коммит вставок')
+    parser.add_argument('--replica-url', help='реплика для чтения обработчиков')
+    parser.add_argument('--replica-lag', type=float,
+                        help='для SQLite: копировать основную базу в реплику раз в столько секунд')
+    parser.add_argument('--sticky-seconds', type=float, help='окно чтения с основной базы после записи')
+    parser.add_argument('--reset', action='store_true', help='пересоздать таблицы перед прогоном')
+    parser.add_argument('--output', help='куда сохранить результат в JSON')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='сравнить два сохранённых прогона')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        os.environ['DATABASE_URL'] = f'sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), "load.db")}'
+    os.environ['FSM_STORAGE'] = args.fsm_storage
+    os.environ['DB_GROUP_COMMIT'] = 'true' if args.group_commit else 'false'
+    if args.replica_url:
+        os.environ['DATABASE_REPLICA_URL'] = args.replica_url
+    if args.sticky_seconds is not None:
+        os.environ['REPLICA_STICKY_SECONDS'] = str(args.sticky_seconds)
+    os.environ['TOKEN'] = '42:benchmark'
+    os.environ['DB_ECHO'] = 'false'
+
+    if args.fsm_storage == 'redis':
+        from config import REDIS_URL
+        asyncio.run(check_redis(REDIS_URL))
+
+    # Лог не печатается, но ошибки попадают в отчёт; basicConfig в bot.create_bot
+    # ничего не добавит, раз у корневого логгера уже есть обработчик.
+    error_log = ErrorLog()
+    logging.getLogger().handlers = [error_log]
+    logging.getLogger().setLevel(logging.ERROR)
+
+    result = asyncio.run(run(args, error_log))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+    print_report(result)
+    if failed(result):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
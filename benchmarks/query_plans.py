@@ -0,0 +1,134 @@
+"""Регрессионная проверка планов запросов CRUD-слоя.
+
+Выполняет функции из database.crud, database.search и FSM-хранилища на
+небольшой базе, перехватывает выданные SQL-запросы и прогоняет их через
+EXPLAIN. Если какой-либо запрос читает таблицу целиком (SCAN в SQLite,
+Seq Scan в PostgreSQL при enable_seqscan = off), выходит с кодом 1.
+
+    python -m benchmarks.query_plans
+    python -m benchmarks.query_plans --database-url postgresql+asyncpg://localhost/plans --reset
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+SKIPPED_PREFIXES = ('INSERT', 'PRAGMA', 'CREATE', 'SAVEPOINT', 'RELEASE', 'ROLLBACK', 'SELECT PG_', 'SELECT 1')
+
+
+async def exercise(session_pool):
+    from aiogram.fsm.storage.base import StorageKey
+    from database.cache import identity_cache
+    from database.crud import (add_movie, add_review, delete_movie, delete_user, get_movies_and_reviews,
+                               get_top_rated, get_user_id, get_user_stats, set_user, update_review)
+    from database.fsm_storage import SQLStorage
+    from database.search import search_movies
+
+    async with session_pool() as session:
+        for telegram_id in (101, 102):
+            await set_user(session, telegram_id, f'plan{telegram_id}', 'Plan')
+            for index in range(15):
+                movie = await add_movie(session, f'Plan movie {index}', '', telegram_id)
+                await add_review(session, telegram_id, movie.id, 4, 'ok')
+        await session.commit()
+
+    identity_cache.clear()
+    async with session_pool() as session:
+        await get_user_id(session, 101)
+        rows, _, _ = await get_movies_and_reviews(session, 101)
+        await get_movies_and_reviews(session, 101, after_id=rows[-1].id)
+        await get_movies_and_reviews(session, 101, before_id=rows[-1].id)
+        await search_movies(session, 101, 'movie 1')
+        await update_review(session, 101, rows[0].id, 5, 'better')
+        await delete_movie(session, 101, rows[1].id)
+        await get_user_stats(session, 101)
+        await get_top_rated(session, min_reviews=1)
+        await delete_user(session, 102)
+        await session.commit()
+
+    storage = SQLStorage(session_pool)
+    key = StorageKey(bot_id=1, chat_id=101, user_id=101)
+    await storage.set_state(key, 'PlanStates:waiting')
+    await storage.flush()
+    storage.cache.clear()
+    await storage.get_state(key)
+    await storage.set_state(key, None)
+    await storage.flush()
+    await storage.sweep()
+    await storage.close()
+
+
+def full_scans(dialect: str, plan_rows) -> list:
+    if dialect == 'sqlite':
+        details = [row[-1] for row in plan_rows]
+        return [detail for detail in details if detail.startswith('SCAN ') and detail != 'SCAN CONSTANT ROW']
+    return [row[0].strip() for row in plan_rows if 'Seq Scan' in row[0]]
+
+
+async def run(reset: bool) -> int:
+    from sqlalchemy import event
+    from database.database import AsyncSessionLocal, Base, engine, init_db
+    from database.migrations import schema_migrations
+
+    if reset:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(schema_migrations.drop, checkfirst=True)
+    await init_db()
+
+    captured = []
+
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and not statement.lstrip().upper().startswith(SKIPPED_PREFIXES):
+            captured.append((statement, parameters))
+
+    await exercise(AsyncSessionLocal)
+    event.remove(engine.sync_engine, 'before_cursor_execute', capture)
+
+    dialect = engine.dialect.name
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+    failures = 0
+    seen = set()
+    async with engine.connect() as conn:
+        if dialect == 'postgresql':
+            await conn.exec_driver_sql('SET enable_seqscan = off')
+        for statement, parameters in captured:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            plan = (await conn.exec_driver_sql(prefix + statement, parameters)).all()
+            scans = full_scans(dialect, plan)
+            status = 'SEQ SCAN' if scans else 'ok'
+            print(f'[{status}] {" ".join(statement.split())[:160]}')
+            for scan in scans:
+                print(f'          {scan}')
+            failures += bool(scans)
+        await conn.rollback()
+    await engine.dispose()
+
+    print(f'{len(seen)} запросов, с полным сканированием: {failures}')
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='по умолчанию временная SQLite-база')
+    parser.add_argument('--reset', action='store_true', help='пересоздать таблицы перед проверкой')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        os.environ['DATABASE_URL'] = f'sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), "plans.db")}'
+    os.environ.setdefault('TOKEN', '0:plans')
+    os.environ['DB_ECHO'] = 'false'
+
+    import logging
+    logging.disable(logging.CRITICAL)
+    sys.exit(asyncio.run(run(args.reset)))
+
+
+if __name__ == '__main__':
+    main()
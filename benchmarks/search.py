@@ -0,0 +1,105 @@
+"""Сравнение поиска по названию: старый ILIKE по всей таблице против search_movies.
+
+Запуск: python -m benchmarks.search --sizes 10000 100000 1000000
+По умолчанию используется временная SQLite-база, для PostgreSQL задайте --database-url.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+WORDS = ['matrix', 'star', 'wars', 'love', 'night', 'dark', 'knight', 'return', 'city', 'river',
+         'ghost', 'island', 'winter', 'summer', 'secret', 'garden', 'blue', 'red', 'last', 'first']
+MOVIES_PER_USER = 200
+QUERIES = ['matrix', 'dark kni', 'summer', 'ghost isl', 'red']
+BATCH_SIZE = 10_000
+
+
+def random_title(rng: random.Random) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+
+
+async def populate(engine, size: int, start: int):
+    from sqlalchemy import insert
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from database.catalog import get_catalog_ids
+    from database.models import Movie, User
+
+    rng = random.Random(start)
+    async with engine.begin() as conn:
+        first_user = start // MOVIES_PER_USER
+        last_user = (size - 1) // MOVIES_PER_USER
+        users = [dict(id=i + 1, telegram_id=i + 1, username=f'user{i + 1}')
+                 for i in range(first_user, last_user + 1)
+                 if i * MOVIES_PER_USER >= start]
+        if users:
+            await conn.execute(insert(User), users)
+        async with AsyncSession(bind=conn) as session:
+            for batch_start in range(start, size, BATCH_SIZE):
+                batch_end = min(batch_start + BATCH_SIZE, size)
+                catalog_ids = await get_catalog_ids(session, [random_title(rng) for _ in range(batch_start, batch_end)])
+                await conn.execute(insert(Movie), [
+                    dict(catalog_id=catalog_id, description='', user_id=i // MOVIES_PER_USER + 1)
+                    for i, catalog_id in zip(range(batch_start, batch_end), catalog_ids)
+                ])
+
+
+async def measure(session_factory, search, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        for query in QUERIES:
+            async with session_factory() as session:
+                started = time.perf_counter()
+                await search(session, query)
+                timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+async def run(sizes, repeats: int):
+    from sqlalchemy import select
+    from database.database import AsyncSessionLocal, engine, init_db
+    from database.models import CatalogMovie, Movie
+    from database.search import search_movies
+
+    engine.echo = False
+    await init_db()
+
+    async def legacy(session, query):
+        return (await session.scalars(select(Movie).join(Movie.catalog).filter(CatalogMovie.title.ilike(f'%{query}%')))).all()
+
+    async def indexed(session, query):
+        return await search_movies(session, 1, query)
+
+    print(f'{"movies":>10} {"ILIKE, мс":>12} {"search_movies, мс":>18}')
+    populated = 0
+    for size in sorted(sizes):
+        await populate(engine, size, populated)
+        populated = size
+        legacy_ms = await measure(AsyncSessionLocal, legacy, repeats)
+        indexed_ms = await measure(AsyncSessionLocal, indexed, repeats)
+        print(f'{size:>10} {legacy_ms:>12.2f} {indexed_ms:>18.2f}')
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--database-url', help='пустая база для замеров')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'search_bench.db')
+        os.environ['DATABASE_URL'] = f'sqlite+aiosqlite:///{path}'
+    os.environ.setdefault('TOKEN', '0:benchmark')
+
+    asyncio.run(run(args.sizes, args.repeats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Прогон исходящей очереди против локального Bot API с лимитами Telegram.
+
+Каждый «апдейт» ставит в очередь несколько ответов в свой чат, как обработчик
+списка фильмов («Получаю список...» и сам список). Отчёт: время постановки в
+очередь (обработчик не ждёт Telegram), время доставки, число 429 и склеенных
+сообщений.
+
+    python -m benchmarks.sender --chats 200 --updates 5
+    python -m benchmarks.sender --no-limiter --error-rate 0.05
+"""
+import argparse
+import asyncio
+import os
+import time
+
+
+async def run(args):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from bot.metrics import registry
+    from bot.sender import OutboundQueue, RateLimiter, RateLimitMiddleware
+    from benchmarks.fake_bot_api import FakeBotAPI, start_fake_bot_api
+    from benchmarks.load import percentile
+
+    api = FakeBotAPI(global_limit=args.global_limit, chat_limit=args.chat_limit, chat_burst=args.chat_burst,
+                     retry_after=args.retry_after, error_rate=args.error_rate)
+    runner, base_url = await start_fake_bot_api(api)
+    bot = Bot(token='42:fake', session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    limiter = RateLimiter(global_rate=args.global_limit, chat_rate=args.chat_limit, chat_burst=args.chat_burst)
+    if args.no_limiter:
+        limiter = RateLimiter(global_rate=0, chat_rate=0)
+    bot.session.middleware(RateLimitMiddleware(limiter, max_retries=args.max_retries))
+    outbound = OutboundQueue(workers=args.workers, max_retries=args.max_retries)
+    await outbound.start(bot)
+
+    enqueue_latencies = []
+
+    async def handler(chat_id: int, update: int):
+        started = time.perf_counter()
+        await outbound.send(chat_id, 'Получаю список ваших фильмов и отзывов...')
+        await outbound.send(chat_id, f'Фильм: {update}\nРейтинг: 5')
+        enqueue_latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    for update in range(args.updates):
+        await asyncio.gather(*(handler(chat_id, update) for chat_id in range(1, args.chats + 1)))
+        await asyncio.sleep(args.interval)
+    enqueued = time.perf_counter() - started
+    await outbound.flush()
+    delivered = time.perf_counter() - started
+    await outbound.stop()
+    await bot.session.close()
+    await runner.cleanup()
+
+    counters = {metric.name: sum(metric.values.values()) for metric in registry.metrics
+                if metric.name.startswith(('bot_outbound', 'bot_telegram'))}
+    print(f'апдейтов: {args.chats * args.updates}, сообщений поставлено: {args.chats * args.updates * 2}')
+    print(f'постановка в очередь: p50 {percentile(enqueue_latencies, 50):.3f} мс, '
+          f'p99 {percentile(enqueue_latencies, 99):.3f} мс, все апдейты за {enqueued:.2f} с')
+    print(f'доставка завершена за {delivered:.2f} с')
+    print(f'Bot API: запросов {api.stats["requests"]}, доставлено {api.stats["delivered"]}, '
+          f'429: {api.stats["too_many_requests"]}')
+    print(f'очередь: отправлено {counters["bot_outbound_sent_total"]:.0f}, '
+          f'склеено {counters["bot_outbound_coalesced_total"]:.0f}, '
+          f'ошибок {counters["bot_outbound_failed_total"]:.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--updates', type=int, default=3, help='апдейтов на чат')
+    parser.add_argument('--interval', type=float, default=0.2, help='пауза между волнами апдейтов, с')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--global-limit', type=int, default=30)
+    parser.add_argument('--chat-limit', type=int, default=1)
+    parser.add_argument('--chat-burst', type=int, default=3)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля случайных 429 от сервера')
+    parser.add_argument('--max-retries', type=int, default=5)
+    parser.add_argument('--no-limiter', action='store_true', help='без token bucket, только повторы после 429')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TOKEN', '42:fake')
+    import logging
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
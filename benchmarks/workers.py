@@ -0,0 +1,129 @@
+"""Пропускная способность режима супервизора при разном числе воркеров.
+
+Для каждого N из --workers поднимает настоящий Supervisor с N процессами,
+локальный Bot API (fake_bot_api, без лимитов) и временную SQLite-базу с
+заранее созданными пользователями и фильмами. Апдейты — просмотр списка
+фильмов и статистики — кладутся прямо в очереди супервизора, как это делает
+poll_updates. Отчёт: апдейтов в секунду от первого апдейта до последнего
+обработанного и число ответов, дошедших до Bot API. Логи воркеров идут в
+stderr.
+
+    python -m benchmarks.workers --workers 1 2 4 --users 400 --updates 20 2>/dev/null
+
+Ускорение ограничено числом ядер: на машине с одним ядром N процессов
+делят его между собой.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
+
+TEXTS = ['🧡 Просмотреть список фильмов', '📊 Статистика']
+
+
+def make_update(update_id: int, user_id: int, text: str):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(datetime.now().timestamp()), 'text': text,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'},
+    }}
+
+
+async def populate(users: int, movies: int):
+    from sqlalchemy import insert
+    from database.database import AsyncSessionLocal, engine
+    from database.migrations import migrate
+    from database.models import CatalogMovie, Movie, User
+
+    await migrate()
+    async with AsyncSessionLocal() as session:
+        await session.execute(insert(CatalogMovie), [
+            {'id': index, 'title': f'Movie {index}', 'normalized_title': f'movie {index}'}
+            for index in range(1, movies + 1)])
+        await session.execute(insert(User), [
+            {'id': user_id, 'telegram_id': user_id, 'username': f'user{user_id}'}
+            for user_id in range(1, users + 1)])
+        await session.execute(insert(Movie), [
+            {'user_id': user_id, 'catalog_id': index, 'description': ''}
+            for user_id in range(1, users + 1) for index in range(1, movies + 1)])
+        await session.commit()
+    await engine.dispose()
+
+
+async def measure(workers: int, args, api) -> dict:
+    from bot.workers import Supervisor
+
+    supervisor = Supervisor(workers=workers, queue_size=args.users * args.updates, health_interval=0.2)
+    supervisor.start()
+    while len([entry for entry in supervisor.report().values() if entry.get('state') == 'running']) < workers:
+        await asyncio.sleep(0.1)
+
+    delivered_before = api.stats['delivered']
+    total = args.users * args.updates
+    updates = [make_update(round_ * args.users + user_id, user_id, TEXTS[round_ % len(TEXTS)])
+               for round_ in range(args.updates) for user_id in range(1, args.users + 1)]
+    started = time.perf_counter()
+    for update in updates:
+        await supervisor.put(update)
+
+    while True:
+        health = supervisor.report()
+        done = sum(entry.get('processed', 0) + entry.get('failed', 0) for entry in health.values())
+        if done >= total:
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    failed = sum(entry.get('failed', 0) for entry in health.values())
+    # Ответы из очередей отправки воркеров досылаются при остановке.
+    await supervisor.stop()
+    return {'workers': workers, 'elapsed': elapsed, 'ups': total / elapsed, 'failed': failed,
+            'delivered': api.stats['delivered'] - delivered_before}
+
+
+async def run(args):
+    from benchmarks.fake_bot_api import FakeBotAPI, start_fake_bot_api
+
+    api = FakeBotAPI(global_limit=0, chat_limit=0, latency=args.api_latency)
+    runner, base_url = await start_fake_bot_api(api)
+    os.environ['TELEGRAM_API_URL'] = base_url
+
+    await populate(args.users, args.movies)
+    # Нагрузка только читает, поэтому все прогоны идут по одной базе; кэши у каждого воркера свои.
+    results = [await measure(workers, args, api) for workers in args.workers]
+    await runner.cleanup()
+
+    print(f'ядер: {os.cpu_count()}, апдейтов: {args.users * args.updates}, задержка Bot API {args.api_latency} с')
+    print(f'{"воркеров":>8} {"время, с":>9} {"апдейтов/с":>11} {"ускорение":>10} {"ошибок":>7} {"ответов":>8}')
+    for result in results:
+        print(f'{result["workers"]:>8} {result["elapsed"]:>9.2f} {result["ups"]:>11.1f} '
+              f'{result["ups"] / results[0]["ups"]:>10.2f} {result["failed"]:>7} {result["delivered"]:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--users', type=int, default=400)
+    parser.add_argument('--updates', type=int, default=20, help='апдейтов на пользователя')
+    parser.add_argument('--movies', type=int, default=30, help='фильмов у каждого пользователя')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа Bot API, с')
+    args = parser.parse_args()
+
+    os.environ['TOKEN'] = '42:benchmark'
+    os.environ['FSM_STORAGE'] = 'memory'
+    os.environ['DB_ECHO'] = 'false'
+    os.environ['METRICS_PORT'] = '0'
+    # Лимиты отправки меряются в benchmarks.sender; здесь они ограничили бы всё 30 сообщениями в секунду.
+    os.environ['SENDER_GLOBAL_RATE'] = '0'
+    os.environ['SENDER_CHAT_RATE'] = '0'
+
+    import logging
+    logging.disable(logging.WARNING)
+
+    os.environ['DATABASE_URL'] = f'sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), "workers.db")}'
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Исполнитель массовых рассылок из database.jobs.
+
+Каждый процесс бота опрашивает jobs раз в JOB_POLL_INTERVAL, при включённом
+дайджесте создаёт задание текущего периода и берёт в аренду незавершённое
+задание. Сообщения уходят в общую очередь outbound со скоростью
+BROADCAST_RATE — ниже общего лимита отправки, чтобы ответам на апдейты
+оставался запас; по-чатовые лимиты и 429 обрабатывает RateLimitMiddleware.
+В режиме супервизора задание исполняет один воркер с долей общего лимита
+SENDER_GLOBAL_RATE / WORKER_PROCESSES, поэтому скорость рассылки
+ограничивается BROADCAST_MAX_SHARE от доли воркера, сколько бы ни было
+указано в BROADCAST_RATE.
+Аренда продлевается на каждой пачке, поэтому JOB_LEASE_SECONDS должен
+заметно превышать BROADCAST_BATCH_SIZE / BROADCAST_RATE. При остановке
+бота исполнитель сохраняет позицию и снимает аренду до остановки очереди.
+"""
+import asyncio
+import logging
+import uuid
+from typing import Optional
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from config import (BROADCAST_RATE, BROADCAST_MAX_SHARE, BROADCAST_BATCH_SIZE, JOB_POLL_INTERVAL,
+                    JOB_LEASE_SECONDS, DIGEST_INTERVAL_DAYS, DIGEST_TITLES, SENDER_GLOBAL_RATE)
+from database.database import AsyncSessionLocal
+from database.jobs import (UNREVIEWED_DIGEST, batch_messages, checkpoint, claim_job, create_job, digest_key,
+                           finish_job, release_job)
+from database.models import Job
+from database.routing import RoutedSessionLocal
+from .metrics import Counter, registry
+from .sender import OutboundQueue, TokenBucket, outbound
+
+logger = logging.getLogger(__name__)
+
+broadcast_sent = registry.register(Counter(
+    'bot_broadcast_messages_total', 'Сообщения рассылок, поставленные в очередь', ['kind']))
+
+
+def broadcast_rate(rate: float = BROADCAST_RATE, workers: int = 1, global_rate: float = SENDER_GLOBAL_RATE,
+                   share: float = BROADCAST_MAX_SHARE) -> float:
+    """rate, но не больше share от доли одного воркера в общем лимите отправки."""
+    if not global_rate:
+        return rate
+    limit = global_rate / workers * share
+    if rate > limit:
+        logger.warning('BROADCAST_RATE %s выше %.0f%% доли воркера (%s / %s), рассылаю со скоростью %.1f',
+                       rate, share * 100, global_rate, workers, limit)
+        return limit
+    return rate
+
+
+class BroadcastRunner:
+    def __init__(self, session_pool: async_sessionmaker = AsyncSessionLocal,
+                 read_pool: async_sessionmaker = RoutedSessionLocal, sender: OutboundQueue = outbound,
+                 rate: float = BROADCAST_RATE, batch_size: int = BROADCAST_BATCH_SIZE,
+                 poll_interval: float = JOB_POLL_INTERVAL, lease_seconds: float = JOB_LEASE_SECONDS,
+                 digest_interval_days: float = DIGEST_INTERVAL_DAYS):
+        self.session_pool = session_pool
+        self.read_pool = read_pool
+        self.sender = sender
+        self.rate = rate
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.digest_interval_days = digest_interval_days
+        self.owner = uuid.uuid4().hex
+        self.job_id: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.schedule_digest()
+                job = await self.claim()
+                if job is not None:
+                    await self.run(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Ошибка исполнителя рассылок')
+            await asyncio.sleep(self.poll_interval)
+
+    async def schedule_digest(self):
+        if self.digest_interval_days <= 0:
+            return
+        async with self.session_pool() as session:
+            key = digest_key(self.digest_interval_days)
+            if await create_job(session, UNREVIEWED_DIGEST, key, {'titles': DIGEST_TITLES}):
+                logger.info('Создано задание %s', key)
+            await session.commit()
+
+    async def claim(self) -> Optional[Job]:
+        async with self.session_pool() as session:
+            job = await claim_job(session, self.owner, self.lease_seconds)
+            await session.commit()
+        return job
+
+    async def run(self, job: Job):
+        """Проходит задание с сохранённого курсора до конца или до потери аренды.
+
+        Курсор пачки фиксируется до отправки, поэтому после падения её
+        сообщения не повторяются. При отмене задачи (остановка бота) курсор и
+        sent возвращаются к последнему поставленному в очередь сообщению.
+        """
+        self.job_id = job.id
+        cursor, sent = job.cursor, job.sent
+        pacer = TokenBucket(self.rate, self.rate)
+        logger.info('Рассылка %s: продолжаю с id %s, уже отправлено %s', job.key, cursor, sent)
+        try:
+            while True:
+                async with self.read_pool() as session:
+                    messages, next_cursor = await batch_messages(session, job, cursor, self.batch_size)
+                async with self.session_pool() as session:
+                    if next_cursor is None:
+                        await finish_job(session, job.id, self.owner, sent)
+                    elif not await checkpoint(session, job.id, self.owner, next_cursor, sent, self.lease_seconds):
+                        logger.warning('Рассылка %s: аренду перехватил другой процесс', job.key)
+                        return
+                    await session.commit()
+                if next_cursor is None:
+                    logger.info('Рассылка %s завершена, отправлено %s', job.key, sent)
+                    return
+                for user_id, chat_id, text in messages:
+                    delay = pacer.reserve()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    await self.sender.send(chat_id, text)
+                    broadcast_sent.inc(job.kind)
+                    cursor, sent = user_id, sent + 1
+                cursor = next_cursor
+        except asyncio.CancelledError:
+            await self.save_position(job, cursor, sent)
+            raise
+        finally:
+            self.job_id = None
+
+    async def save_position(self, job: Job, cursor: int, sent: int):
+        async with self.session_pool() as session:
+            if await checkpoint(session, job.id, self.owner, cursor, sent, self.lease_seconds):
+                logger.info('Рассылка %s остановлена на id %s, отправлено %s', job.key, cursor, sent)
+            await session.commit()
+
+    async def stop(self):
+        if self.task is None:
+            return
+        job_id = self.job_id
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        if job_id is not None:
+            async with self.session_pool() as session:
+                await release_job(session, job_id, self.owner)
+                await session.commit()
+
+
+def setup_broadcast(dp, runner: Optional[BroadcastRunner] = None, workers: int = 1):
+    """Регистрируется до setup_sender: останавливается раньше очереди, в которую пишет.
+
+    workers — сколько процессов делят общий лимит бота.
+    """
+    runner = runner or BroadcastRunner(rate=broadcast_rate(workers=workers))
+    dp.startup.register(runner.start)
+    dp.shutdown.register(runner.stop)
+    return runner
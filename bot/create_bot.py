@@ -1,20 +1,54 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import API_TOKEN
-from .handlers import register_handlers
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import API_TOKEN, BOT_MODE, WORKER_PROCESSES, TELEGRAM_API_URL
+from database.database import engine, replica_engine
+from database.fsm_storage import create_fsm_storage
+from database.group_commit import group_commit
+from database.routing import RoutedSessionLocal
+from .broadcast import setup_broadcast
+from .handlers import register_handlers, router
+from .metrics import instrument_engine, setup_metrics, start_metrics_server
+from .middlewares import DbSessionMiddleware
+from .sender import setup_sender
+from .webhook import run_webhook
+from .workers import run_supervisor
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-bot = Bot(token=API_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+bot = Bot(token=API_TOKEN,
+          session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None)
+dp = Dispatcher(storage=create_fsm_storage())
 
-async def main():
+
+def setup_dispatcher(workers: int = 1):
     register_handlers(dp)
+    setup_metrics(dp, router, engine)
+    if replica_engine is not None:
+        instrument_engine(replica_engine)
+    dp.update.outer_middleware(DbSessionMiddleware(RoutedSessionLocal))
+    setup_broadcast(dp, workers=workers)
+    setup_sender(dp, bot, workers=workers)
+
+
+async def main(mode: str = BOT_MODE, workers: int = WORKER_PROCESSES):
+    setup_dispatcher(workers)
+    metrics_runner = None if workers > 1 else await start_metrics_server()
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if workers > 1:
+            await run_supervisor(dp, bot, mode, workers)
+        elif mode == 'webhook':
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        if group_commit is not None:
+            await group_commit.close()
+        await dp.storage.close()
         await bot.session.close()
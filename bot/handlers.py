@@ -1,15 +1,23 @@
-from aiogram import types, Router
-from aiogram.filters import Command
+import os
+import tempfile
+from aiogram import F, types, Router
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from sqlalchemy import delete
+from aiogram.types import FSInputFile
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.crud import *
-from database.database import AsyncSessionLocal
+from database.bulk import export_movies, import_movies, iter_records
+from database.search import search_movies
 from .keyboards import *
+from .sender import outbound
 
 router = Router()
 
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+
 
 class MovieStates(StatesGroup):
     waiting_for_title = State()
@@ -18,7 +26,6 @@ class MovieStates(StatesGroup):
 
 class ReviewStates(StatesGroup):
     waiting_for_movie = State()
-    waiting_for_selected_movie = State()
     waiting_for_rating = State()
     waiting_for_comment = State()
 
@@ -26,49 +33,82 @@ class ReviewStates(StatesGroup):
 class DeleteMovieStates(StatesGroup):
     waiting_for_movie_to_delete = State()
     waiting_for_confirmation = State()
-    waiting_for_selected_movie = State()
+
+
+class ImportStates(StatesGroup):
+    waiting_for_file = State()
 
 
 class UpdateReviewStates(StatesGroup):
     waiting_for_movie_edit = State()
     waiting_for_new_rating = State()
     waiting_for_new_comment = State()
-    waiting_for_selected_movie = State()
 
 
-async def find_and_send_movies(session, message: types.Message, partial_title: str, state: FSMContext):
-    movies = await session.scalars(select(Movie).filter(Movie.title.ilike(f'%{partial_title}%')))
-    movie_titles = [movie.title for movie in movies]
+async def start_movie_selection(session, message: types.Message, state: FSMContext, action: str, waiting_state):
+    rows, has_prev, has_next = await get_movie_titles(session, message.from_user.id)
+    if not rows:
+        await outbound.answer(message, 'У вас нет добавленных фильмов.', reply_markup=main_menu_keyboard)
+        await state.clear()
+        return
+    await outbound.answer(message, 'Выберите фильм или введите часть названия:',
+                          reply_markup=movie_select_keyboard(action, rows, has_prev, has_next))
+    await state.set_state(waiting_state)
+
 
-    if movie_titles:
-        movies_message = f'Найдены следующие фильмы:\n' + '\n'.join(
-            movie_titles) + '\nПожалуйста, выберите фильм из списка:'
-        await message.answer(movies_message)
-        await state.update_data(movie_titles=movie_titles)
+async def find_and_send_movies(session, message: types.Message, partial_title: str, state: FSMContext, action: str):
+    movies = await search_movies(session, message.from_user.id, partial_title)
+
+    if movies:
+        await outbound.answer(message, 'Найдены следующие фильмы, выберите один:',
+                              reply_markup=movie_select_keyboard(action, movies))
         return True
     else:
-        await message.answer('Фильмы не найдены. Пожалуйста, попробуйте снова.',
-                             reply_markup=main_menu_keyboard)
+        await outbound.answer(message, 'Фильмы не найдены. Пожалуйста, попробуйте снова.',
+                              reply_markup=main_menu_keyboard)
+        await state.clear()
         return False
 
 
+async def select_movie(callback: types.CallbackQuery, callback_data: MovieSelectCallback, state: FSMContext,
+                       session: AsyncSession):
+    movie = await get_user_movie(session, callback.from_user.id, callback_data.movie_id)
+    if movie is None:
+        await callback.answer('Фильм не найден.', show_alert=True)
+        return None
+    await state.set_data({'movie_id': movie.id})
+    await callback.answer()
+    return movie
+
+
+@router.callback_query(MovieListCallback.filter())
+async def movie_list_callback(callback: types.CallbackQuery, callback_data: MovieListCallback,
+                              session: AsyncSession):
+    telegram_id = callback.from_user.id
+    if callback_data.direction == 'prev':
+        page = await get_movie_titles(session, telegram_id, before_id=callback_data.cursor)
+    else:
+        page = await get_movie_titles(session, telegram_id, after_id=callback_data.cursor)
+    await callback.message.edit_reply_markup(reply_markup=movie_select_keyboard(callback_data.action, *page))
+    await callback.answer()
+
+
 @router.message(lambda message: message.text == '⚙️ Ещё...')
 async def show_additional_menu(message: types.Message):
-    await message.answer('Выберите опцию:', reply_markup=additional_menu_keyboard)
+    await outbound.answer(message, 'Выберите опцию:', reply_markup=additional_menu_keyboard)
 
 
 @router.message(lambda message: message.text == '🔙 Назад')
 async def go_back_to_main_menu(message: types.Message):
-    await message.answer('Вы вернулись в основное меню:', reply_markup=main_menu_keyboard)
+    await outbound.answer(message, 'Вы вернулись в основное меню:', reply_markup=main_menu_keyboard)
 
 
 @router.message(Command(commands=['start']))
-async def start(message: types.Message):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            user = await set_user(session, message.from_user.id, message.from_user.username,
-                                  message.from_user.full_name)
-    await message.answer(
+async def start(message: types.Message, session: AsyncSession):
+    user = await set_user(session, message.from_user.id, message.from_user.username,
+                          message.from_user.full_name)
+    await outbound.answer(
+        message,
         'Привет! Я помогу тебе хранить заметки о просмотренных фильмах и оставлять к ним отзывы',
         reply_markup=main_menu_keyboard
     )
@@ -76,7 +116,7 @@ async def start(message: types.Message):
 
 @router.message(lambda message: message.text == '🎥 Добавить фильм')
 async def add_movie_handler(message: types.Message, state: FSMContext):
-    await message.answer('Введите название фильма:')
+    await outbound.answer(message, 'Введите название фильма:')
     await state.set_state(MovieStates.waiting_for_title)
 
 
@@ -84,199 +124,275 @@ async def add_movie_handler(message: types.Message, state: FSMContext):
 async def process_title(message: types.Message, state: FSMContext):
     title = message.text
     await state.update_data(title=title)
-    await message.answer('Введите описание фильма:')
+    await outbound.answer(message, 'Введите описание фильма:')
     await state.set_state(MovieStates.waiting_for_description)
 
 
 @router.message(MovieStates.waiting_for_description)
-async def process_description(message: types.Message, state: FSMContext):
+async def process_description(message: types.Message, state: FSMContext, session: AsyncSession):
     description = message.text
     user_data = await state.get_data()
     title = user_data.get('title')
 
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            telegram_id = message.from_user.id
-            movie = await add_movie(session, title, description, telegram_id)
+    telegram_id = message.from_user.id
+    movie = await add_movie(session, title, description, telegram_id)
 
     if movie:
-        await message.answer(f"Фильм '{title}' успешно добавлен!", reply_markup=main_menu_keyboard)
+        await outbound.answer(message, f"Фильм '{title}' успешно добавлен!", reply_markup=main_menu_keyboard)
     else:
-        await message.answer('Произошла ошибка при добавлении фильма. Попробуйте снова.',
-                             reply_markup=main_menu_keyboard)
+        await outbound.answer(message, 'Произошла ошибка при добавлении фильма. Попробуйте снова.',
+                              reply_markup=main_menu_keyboard)
 
     await state.clear()
 
 
 @router.message(lambda message: message.text == '🗒️ Добавить рецензию')
-async def add_review_handler(message: types.Message, state: FSMContext):
-    await message.answer('Введите название фильма:')
-    await state.set_state(ReviewStates.waiting_for_movie)
+async def add_review_handler(message: types.Message, state: FSMContext, session: AsyncSession):
+    await start_movie_selection(session, message, state, 'review', ReviewStates.waiting_for_movie)
 
 
 @router.message(ReviewStates.waiting_for_movie)
-async def process_movie(message: types.Message, state: FSMContext):
-    movie_title = message.text
-    async with AsyncSessionLocal() as session:
-        found = await find_and_send_movies(session, message, movie_title, state)
+async def process_movie(message: types.Message, state: FSMContext, session: AsyncSession):
+    await find_and_send_movies(session, message, message.text, state, 'review')
 
-    if found:
-        await state.set_state(ReviewStates.waiting_for_selected_movie)
-    else:
-        await state.clear()
-
-
-@router.message(ReviewStates.waiting_for_selected_movie)
-async def process_selected_movie(message: types.Message, state: FSMContext):
-    user_data = await state.get_data()
-    movie_titles = user_data.get('movie_titles', [])
-    selected_title = message.text
 
-    if selected_title in movie_titles:
-        await state.update_data(selected_title=selected_title)
-        await message.answer('Пожалуйста, введите ваш рейтинг (от 1 до 5):')
+@router.callback_query(MovieSelectCallback.filter(F.action == 'review'))
+async def process_selected_movie(callback: types.CallbackQuery, callback_data: MovieSelectCallback,
+                                 state: FSMContext, session: AsyncSession):
+    movie = await select_movie(callback, callback_data, state, session)
+    if movie:
+        await outbound.answer(callback.message, f'Фильм "{movie.catalog.title}". Пожалуйста, введите ваш рейтинг (от 1 до 5):')
         await state.set_state(ReviewStates.waiting_for_rating)
-    else:
-        await message.answer('Ошибка: выбранный фильм не найден в списке. Пожалуйста, попробуйте снова.',
-                             reply_markup=main_menu_keyboard)
-        await state.clear()
 
 
 @router.message(ReviewStates.waiting_for_rating)
 async def process_rating(message: types.Message, state: FSMContext):
     rating = message.text
-    user_data = await state.get_data()
-    selected_title = user_data.get('selected_title')
 
     if rating.isdigit() and 1 <= int(rating) <= 5:
         await state.update_data(rating=int(rating))
-        await message.answer('Пожалуйста, введите ваш комментарий к фильму:')
+        await outbound.answer(message, 'Пожалуйста, введите ваш комментарий к фильму:')
         await state.set_state(ReviewStates.waiting_for_comment)
     else:
-        await message.answer('Пожалуйста, введите корректный рейтинг (от 1 до 5).', reply_markup=main_menu_keyboard)
+        await outbound.answer(message, 'Пожалуйста, введите корректный рейтинг (от 1 до 5).',
+                              reply_markup=main_menu_keyboard)
 
 
 @router.message(ReviewStates.waiting_for_comment)
-async def process_comment(message: types.Message, state: FSMContext):
+async def process_comment(message: types.Message, state: FSMContext, session: AsyncSession):
     comment = message.text
     user_data = await state.get_data()
-    selected_title = user_data.get('selected_title')
-    rating = user_data.get('rating')
-
-    async with AsyncSessionLocal() as session:
-        movie = await session.scalar(select(Movie).filter_by(title=selected_title))
-        if movie:
-            review = await add_review(session, message.from_user.id, movie.id, rating, comment)
-            if review:
-                await message.answer('Ваш отзыв успешно добавлен! 🎉', reply_markup=main_menu_keyboard)
-            else:
-                await message.answer('Произошла ошибка при добавлении отзыва. Попробуйте снова.',
-                                     reply_markup=main_menu_keyboard)
-        else:
-            await message.answer('Ошибка: фильм не найден.', reply_markup=main_menu_keyboard)
+
+    review = await add_review(session, message.from_user.id, user_data.get('movie_id'), user_data.get('rating'),
+                              comment)
+    if review:
+        await outbound.answer(message, 'Ваш отзыв успешно добавлен! 🎉', reply_markup=main_menu_keyboard)
+    else:
+        await outbound.answer(message, 'Произошла ошибка при добавлении отзыва. Если у фильма уже есть рецензия, '
+                              'отредактируйте её.', reply_markup=main_menu_keyboard)
 
     await state.clear()
 
 
+async def render_movies_page(session, telegram_id: int, after_id=None, before_id=None):
+    movies_info, first_id, last_id, has_prev, has_next = await get_movies_page(
+        session, telegram_id, after_id=after_id, before_id=before_id)
+    return movies_info, movies_page_keyboard(first_id, last_id, has_prev, has_next)
+
+
 @router.message(lambda message: message.text == '🧡 Просмотреть список фильмов')
-async def get_my_movies_handler(message: types.Message):
-    await message.answer('Получаю список ваших фильмов и отзывов...')
+async def get_my_movies_handler(message: types.Message, session: AsyncSession):
+    await outbound.answer(message, 'Получаю список ваших фильмов и отзывов...')
     telegram_id = message.from_user.id
-    async with AsyncSessionLocal() as session:
-        result, user = await get_movies_and_reviews(session, telegram_id)
-    movies_info = await format_movies_info(result)
-    await message.answer(movies_info, reply_markup=main_menu_keyboard)
+    movies_info, keyboard = await render_movies_page(session, telegram_id)
+    await outbound.answer(message, movies_info, reply_markup=keyboard or main_menu_keyboard)
+
+
+@router.callback_query(MoviesPageCallback.filter())
+async def movies_page_callback(callback: types.CallbackQuery, callback_data: MoviesPageCallback,
+                               session: AsyncSession):
+    telegram_id = callback.from_user.id
+    if callback_data.direction == 'prev':
+        movies_info, keyboard = await render_movies_page(session, telegram_id, before_id=callback_data.cursor)
+    else:
+        movies_info, keyboard = await render_movies_page(session, telegram_id, after_id=callback_data.cursor)
+    await callback.message.edit_text(movies_info, reply_markup=keyboard)
+    await callback.answer()
 
 
 @router.message(lambda message: message.text == '❌ Удалить фильм')
-async def delete_movie_handler(message: types.Message, state: FSMContext):
-    await message.answer('Введите название фильма для удаления:')
-    await state.set_state(DeleteMovieStates.waiting_for_movie_to_delete)
+async def delete_movie_handler(message: types.Message, state: FSMContext, session: AsyncSession):
+    await start_movie_selection(session, message, state, 'delete', DeleteMovieStates.waiting_for_movie_to_delete)
 
 
 @router.message(DeleteMovieStates.waiting_for_movie_to_delete)
-async def process_movie_deletion(message: types.Message, state: FSMContext):
-    movie_title = message.text
-    async with AsyncSessionLocal() as session:
-        await find_and_send_movies(session, message, movie_title, state)
-        data = await state.get_data()
-        movie_titles = data.get('movie_titles', [])
-        if movie_titles:
-            await state.set_state(DeleteMovieStates.waiting_for_selected_movie)
-        else:
-            await message.answer('Фильмы не найдены для удаления. Попробуйте снова.', reply_markup=main_menu_keyboard)
-            await state.clear()
-            return
+async def process_movie_deletion(message: types.Message, state: FSMContext, session: AsyncSession):
+    await find_and_send_movies(session, message, message.text, state, 'delete')
 
 
-@router.message(DeleteMovieStates.waiting_for_selected_movie)
-async def process_movie_selected(message: types.Message, state: FSMContext):
-    user_data = await state.get_data()
-    movie_titles = user_data.get('movie_titles', [])
-
-    if message.text in movie_titles:
-        selected_movie_title = message.text
-        await message.answer(f'Вы уверены, что хотите удалить фильм "{selected_movie_title}"? (Да/Нет)')
-        await state.update_data(movie_title=selected_movie_title)
+@router.callback_query(MovieSelectCallback.filter(F.action == 'delete'))
+async def process_movie_selected(callback: types.CallbackQuery, callback_data: MovieSelectCallback,
+                                 state: FSMContext, session: AsyncSession):
+    movie = await select_movie(callback, callback_data, state, session)
+    if movie:
+        await outbound.answer(callback.message, f'Вы уверены, что хотите удалить фильм "{movie.catalog.title}"? (Да/Нет)')
         await state.set_state(DeleteMovieStates.waiting_for_confirmation)
-    else:
-        await message.answer('Фильм не найден в списке. Пожалуйста, выберите фильм из предложенного списка.',
-                             reply_markup=main_menu_keyboard)
-        await state.clear()
 
 
 @router.message(DeleteMovieStates.waiting_for_confirmation)
-async def process_movie_confirmation(message: types.Message, state: FSMContext):
+async def process_movie_confirmation(message: types.Message, state: FSMContext, session: AsyncSession):
     answer = message.text
     user_data = await state.get_data()
-    movie_title = user_data.get('movie_title')
 
     if answer.lower() == 'да':
-        async with AsyncSessionLocal() as session:
-            await session.execute(delete(Movie).where(Movie.title == movie_title))
-            await session.commit()
-        answer = 'Фильм успешно удален.'
+        if await delete_movie(session, message.from_user.id, user_data.get('movie_id')):
+            answer = 'Фильм успешно удален.'
+        else:
+            answer = 'Ошибка: фильм не найден.'
         await state.clear()
     elif answer.lower() == 'нет':
         answer = 'Удаление отменено.'
         await state.clear()
     else:
         answer = 'Пожалуйста, ответьте "Да" или "Нет".'
-    await message.answer(answer, reply_markup=main_menu_keyboard)
+    await outbound.answer(message, answer, reply_markup=main_menu_keyboard)
 
 
 @router.message(lambda message: message.text == '✏️ Редактировать рецензию')
-async def update_review_handler(message: types.Message, state: FSMContext):
-    await message.answer('Введите название фильма для редактирования рецензии:')
-    await state.set_state(UpdateReviewStates.waiting_for_movie_edit)
+async def update_review_handler(message: types.Message, state: FSMContext, session: AsyncSession):
+    await start_movie_selection(session, message, state, 'edit', UpdateReviewStates.waiting_for_movie_edit)
 
 
 @router.message(UpdateReviewStates.waiting_for_movie_edit)
-async def process_movie_updating(message: types.Message, state: FSMContext):
-    movie_title = message.text
-    async with AsyncSessionLocal() as session:
-        await find_and_send_movies(session, message, movie_title, state)
-        data = await state.get_data()
-        movie_titles = data.get('movie_titles', [])
-        if movie_titles:
-            await state.set_state(UpdateReviewStates.waiting_for_selected_movie)
-        else:
-            await message.answer('Фильмы не найдены для редактирования рецензии. Попробуйте снова.')
-            await state.clear()
-
-
-@router.message(UpdateReviewStates.waiting_for_selected_movie)
-async def process_selected_movie_updating(message: types.Message, state: FSMContext):
-    selected_movie = message.text
-    async with AsyncSessionLocal() as session:
-        movie = await session.scalar(select(Movie).filter_by(title=selected_movie))
-        if movie:
-            review = await session.scalar(select(Review).filter_by(movie_id=movie.id))
-            if review:
-                await message.answer(
-                    f'Ваш текущий рейтинг: {review.rating}\nВаш комментарий: {review.comment}\nВведите новый рейтинг:')
-                await state.update_data(review_id=review.id)
-                await state.set_state(UpdateReviewStates.waiting_for_new_rating)
+async def process_movie_updating(message: types.Message, state: FSMContext, session: AsyncSession):
+    await find_and_send_movies(session, message, message.text, state, 'edit')
+
+
+@router.callback_query(MovieSelectCallback.filter(F.action == 'edit'))
+async def process_selected_movie_updating(callback: types.CallbackQuery, callback_data: MovieSelectCallback,
+                                          state: FSMContext, session: AsyncSession):
+    review = await get_movie_review(session, callback.from_user.id, callback_data.movie_id)
+    if review is None:
+        await callback.answer('У этого фильма нет вашей рецензии.', show_alert=True)
+        return
+    await state.set_data({'movie_id': review.movie_id})
+    await callback.answer()
+    await outbound.answer(
+        callback.message,
+        f'Ваш текущий рейтинг: {review.rating}\nВаш комментарий: {review.comment}\nВведите новый рейтинг:')
+    await state.set_state(UpdateReviewStates.waiting_for_new_rating)
+
+
+@router.message(UpdateReviewStates.waiting_for_new_rating)
+async def process_new_rating(message: types.Message, state: FSMContext):
+    rating = message.text
+
+    if rating.isdigit() and 1 <= int(rating) <= 5:
+        await state.update_data(rating=int(rating))
+        await outbound.answer(message, 'Введите новый комментарий:')
+        await state.set_state(UpdateReviewStates.waiting_for_new_comment)
+    else:
+        await outbound.answer(message, 'Пожалуйста, введите корректный рейтинг (от 1 до 5).')
+
+
+@router.message(UpdateReviewStates.waiting_for_new_comment)
+async def process_new_comment(message: types.Message, state: FSMContext, session: AsyncSession):
+    user_data = await state.get_data()
+
+    if await update_review(session, message.from_user.id, user_data.get('movie_id'), user_data.get('rating'),
+                           message.text):
+        await outbound.answer(message, 'Рецензия обновлена! ✏️', reply_markup=main_menu_keyboard)
+    else:
+        await outbound.answer(message, 'Ошибка: рецензия не найдена.', reply_markup=main_menu_keyboard)
+
+    await state.clear()
+
+
+@router.message(lambda message: message.text == '📥 Импорт')
+async def import_handler(message: types.Message, state: FSMContext):
+    await outbound.answer(message, 'Отправьте файл CSV или JSON с фильмами. Подойдут выгрузки Letterboxd и IMDb, '
+                          'а также файл экспорта этого бота.')
+    await state.set_state(ImportStates.waiting_for_file)
+
+
+@router.message(ImportStates.waiting_for_file, F.document)
+async def process_import_file(message: types.Message, state: FSMContext, session: AsyncSession):
+    document = message.document
+    await state.clear()
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await outbound.answer(message, 'Файл слишком большой, максимум 20 МБ.', reply_markup=main_menu_keyboard)
+        return
+
+    status = await message.answer('Загружаю файл...')
+    progress = {'text': status.text}
+
+    async def report_progress(result):
+        text = (f'Обработано строк: {result.movies + result.duplicates + result.skipped}, '
+                f'импортировано фильмов: {result.movies}...')
+        if text == progress['text']:
+            return
+        progress['text'] = text
+        try:
+            await status.edit_text(text)
+        except TelegramBadRequest:
+            # Прогресс не важен для импорта: сообщение могли удалить или уже изменить.
+            pass
+
+    with tempfile.TemporaryFile() as file:
+        await message.bot.download(document, destination=file)
+        file.seek(0)
+        try:
+            result = await import_movies(session, message.from_user.id,
+                                         iter_records(file, document.file_name or ''), progress=report_progress)
+        except (ValueError, UnicodeError) as e:
+            await outbound.answer(message, f'Не удалось прочитать файл: {e}. Уже обработанные пачки сохранены.',
+                                  reply_markup=main_menu_keyboard)
+            return
+
+    if result is None:
+        await outbound.answer(message, 'Сначала отправьте /start.', reply_markup=main_menu_keyboard)
+        return
+    summary = f'Импорт завершён: {result.movies} фильмов, {result.reviews} рецензий.'
+    if result.duplicates:
+        summary += f'\nУже были в библиотеке: {result.duplicates}'
+    if result.skipped:
+        summary += f'\nПропущено строк: {result.skipped}\n' + '\n'.join(result.errors)
+    await outbound.answer(message, summary, reply_markup=main_menu_keyboard)
+
+
+@router.message(ImportStates.waiting_for_file)
+async def process_import_not_file(message: types.Message, state: FSMContext):
+    await outbound.answer(message, 'Это не файл. Импорт отменён.', reply_markup=main_menu_keyboard)
+    await state.clear()
+
+
+@router.message(lambda message: message.text == '📤 Экспорт')
+@router.message(Command(commands=['export']))
+async def export_handler(message: types.Message, session: AsyncSession, command: Optional[CommandObject] = None):
+    fmt = 'json' if command and command.args and command.args.strip().lower() == 'json' else 'csv'
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f'movies.{fmt}')
+        with open(path, 'wb') as file:
+            count = await export_movies(session, message.from_user.id, file, fmt)
+        if not count:
+            await outbound.answer(message, 'У вас нет добавленных фильмов.', reply_markup=main_menu_keyboard)
+            return
+        await message.answer_document(FSInputFile(path), caption=f'Фильмов: {count}. '
+                                                                   f'Файл можно загрузить обратно через импорт.')
+
+
+@router.message(lambda message: message.text == '📊 Статистика')
+@router.message(Command(commands=['stats']))
+async def stats_handler(message: types.Message, session: AsyncSession):
+    stats = await get_user_stats(session, message.from_user.id)
+    await outbound.answer(message, format_user_stats(stats))
+
+
+@router.message(lambda message: message.text == '🏆 Лучшие фильмы')
+@router.message(Command(commands=['top']))
+async def top_rated_handler(message: types.Message, session: AsyncSession):
+    rows = await get_top_rated(session)
+    await outbound.answer(message, format_top_rated(rows))
 
 
 def register_handlers(dp):
@@ -1,4 +1,6 @@
-from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
+from typing import Optional
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
 
 add_movie_button = KeyboardButton(text='🎥 Добавить фильм')
 add_review_button = KeyboardButton(text='🗒️ Добавить рецензию')
@@ -6,6 +8,10 @@ get_movies_button = KeyboardButton(text='🧡 Просмотреть списо
 delete_movie_button = KeyboardButton(text='❌ Удалить фильм')
 update_review_button = KeyboardButton(text='✏️ Редактировать рецензию')
 other_button = KeyboardButton(text='⚙️ Ещё...')
+import_button = KeyboardButton(text='📥 Импорт')
+export_button = KeyboardButton(text='📤 Экспорт')
+stats_button = KeyboardButton(text='📊 Статистика')
+top_rated_button = KeyboardButton(text='🏆 Лучшие фильмы')
 
 main_menu_keyboard = ReplyKeyboardMarkup(
     keyboard=[
@@ -19,8 +25,58 @@ main_menu_keyboard = ReplyKeyboardMarkup(
 additional_menu_keyboard = ReplyKeyboardMarkup(
 keyboard=[
         [delete_movie_button, update_review_button],
+        [import_button, export_button],
+        [stats_button, top_rated_button],
         [KeyboardButton(text='🔙 Назад')]
     ],
     resize_keyboard=True,
     input_field_placeholder='Воспользуйся меню 👇'
-)
\ No newline at end of file
+)
+
+
+class MoviesPageCallback(CallbackData, prefix='movies'):
+    direction: str
+    cursor: int
+
+
+def movies_page_keyboard(first_id: Optional[int], last_id: Optional[int],
+                         has_prev: bool, has_next: bool) -> Optional[InlineKeyboardMarkup]:
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(
+            text='⬅️ Назад', callback_data=MoviesPageCallback(direction='prev', cursor=first_id).pack()))
+    if has_next:
+        buttons.append(InlineKeyboardButton(
+            text='Вперёд ➡️', callback_data=MoviesPageCallback(direction='next', cursor=last_id).pack()))
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+
+class MovieSelectCallback(CallbackData, prefix='movie'):
+    action: str
+    movie_id: int
+
+
+class MovieListCallback(CallbackData, prefix='pick'):
+    action: str
+    direction: str
+    cursor: int
+
+
+def movie_select_keyboard(action: str, rows, has_prev: bool = False,
+                          has_next: bool = False) -> InlineKeyboardMarkup:
+    """Кнопка на каждый фильм из rows (id, title); callback_data несёт только id."""
+    keyboard = [[InlineKeyboardButton(
+        text=title, callback_data=MovieSelectCallback(action=action, movie_id=movie_id).pack())]
+        for movie_id, title in rows]
+    navigation = []
+    if has_prev and rows:
+        navigation.append(InlineKeyboardButton(text='⬅️ Назад', callback_data=MovieListCallback(
+            action=action, direction='prev', cursor=rows[0][0]).pack()))
+    if has_next and rows:
+        navigation.append(InlineKeyboardButton(text='Вперёд ➡️', callback_data=MovieListCallback(
+            action=action, direction='next', cursor=rows[-1][0]).pack()))
+    if navigation:
+        keyboard.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -0,0 +1,253 @@
+"""Метрики обработчиков и SQL-запросов в формате Prometheus.
+
+Время обработчиков и счётчики собираются для каждого апдейта. Подробная
+статистика запросов (время каждого запроса, число запросов на апдейт, поиск
+N+1) собирается только для доли апдейтов METRICS_SAMPLE_RATE, остальные
+апдейты платят за хуки одной проверкой contextvar.
+"""
+import contextvars
+import logging
+import random
+import time
+from bisect import bisect_left
+from collections import Counter as StatementCounter, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+from sqlalchemy import event as sqlalchemy_event
+from database.cache import identity_cache, page_cache
+from config import (METRICS_HOST, METRICS_PORT, METRICS_SAMPLE_RATE, METRICS_SLOW_QUERY_MS,
+                    METRICS_N_PLUS_ONE_THRESHOLD)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def format_labels(names: Sequence[str], values: Sequence[Any], extra: str = '') -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape_label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple, float] = defaultdict(float)
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] += amount
+
+    def expose(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(self.values.items()):
+            yield f'{self.name}{format_labels(self.labels, labels)} {value}'
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.counts: Dict[Tuple, list] = {}
+        self.sums: Dict[Tuple, float] = defaultdict(float)
+
+    def observe(self, value: float, *labels):
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def expose(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                bucket = format_labels(self.labels, labels, f'le="{le}"')
+                yield f'{self.name}_bucket{bucket} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, labels)} {self.sums[labels]}'
+            yield f'{self.name}_count{format_labels(self.labels, labels)} {cumulative}'
+
+
+class CacheMetrics:
+    """Снимает статистику LRU-кэшей в момент экспорта."""
+
+    def __init__(self, name: str, caches: Dict[str, Any]):
+        self.name = name
+        self.caches = caches
+
+    def expose(self):
+        stats = {cache_name: cache.stats() for cache_name, cache in sorted(self.caches.items())}
+        for suffix, field, kind in (('hits_total', 'hits', 'counter'), ('misses_total', 'misses', 'counter'),
+                                    ('entries', 'size', 'gauge'), ('hit_rate', 'hit_rate', 'gauge')):
+            yield f'# HELP {self.name}_{suffix} Кэш: {field}'
+            yield f'# TYPE {self.name}_{suffix} {kind}'
+            for cache_name, values in stats.items():
+                yield f'{self.name}_{suffix}{format_labels(["cache"], [cache_name])} {values[field]}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.expose()) + '\n'
+
+
+registry = Registry()
+updates_total = registry.register(Counter(
+    'bot_updates_total', 'Обработанные апдейты', ['type']))
+handler_duration = registry.register(Histogram(
+    'bot_handler_duration_seconds', 'Время работы обработчика', ['handler', 'state']))
+handler_errors = registry.register(Counter(
+    'bot_handler_errors_total', 'Исключения в обработчиках', ['handler']))
+queries_per_update = registry.register(Histogram(
+    'bot_db_queries_per_update', 'SQL-запросов на апдейт (выборка)', ['handler'], QUERY_COUNT_BUCKETS))
+db_time_per_update = registry.register(Histogram(
+    'bot_db_time_per_update_seconds', 'Время в базе на апдейт (выборка)', ['handler']))
+query_duration = registry.register(Histogram(
+    'bot_db_query_duration_seconds', 'Время одного SQL-запроса (выборка)'))
+slow_queries = registry.register(Counter(
+    'bot_db_slow_queries_total', 'Запросы дольше METRICS_SLOW_QUERY_MS (выборка)', ['handler']))
+n_plus_one = registry.register(Counter(
+    'bot_db_n_plus_one_total', 'Апдейты с повторяющимся запросом (выборка)', ['handler']))
+cache_metrics = registry.register(CacheMetrics('bot_cache', {'identity': identity_cache, 'pages': page_cache}))
+
+
+class QueryStats:
+    __slots__ = ('handler', 'count', 'duration', 'statements')
+
+    def __init__(self):
+        self.handler = 'unhandled'
+        self.count = 0
+        self.duration = 0.0
+        self.statements = StatementCounter()
+
+
+current_stats: contextvars.ContextVar[Optional[QueryStats]] = contextvars.ContextVar('current_stats', default=None)
+
+
+def instrument_engine(engine, slow_query_ms: float = METRICS_SLOW_QUERY_MS):
+    sync_engine = getattr(engine, 'sync_engine', engine)
+    slow_query_seconds = slow_query_ms / 1000
+
+    @sqlalchemy_event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current_stats.get() is not None:
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @sqlalchemy_event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = current_stats.get()
+        if stats is None or not conn.info.get('query_started'):
+            return
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        stats.count += 1
+        stats.duration += elapsed
+        stats.statements[statement] += 1
+        query_duration.observe(elapsed)
+        if elapsed > slow_query_seconds:
+            slow_queries.inc(stats.handler)
+            logger.warning('Медленный запрос (%.1f мс) в %s: %s', elapsed * 1000, stats.handler, statement[:200])
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: решает, попадает ли апдейт в выборку запросов."""
+
+    def __init__(self, sample_rate: float = METRICS_SAMPLE_RATE,
+                 n_plus_one_threshold: int = METRICS_N_PLUS_ONE_THRESHOLD):
+        self.sample_rate = sample_rate
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        updates_total.inc(event.event_type)
+        if random.random() >= self.sample_rate:
+            return await handler(event, data)
+
+        stats = QueryStats()
+        token = current_stats.set(stats)
+        try:
+            return await handler(event, data)
+        finally:
+            current_stats.reset(token)
+            queries_per_update.observe(stats.count, stats.handler)
+            db_time_per_update.observe(stats.duration, stats.handler)
+            if stats.statements:
+                statement, repeats = stats.statements.most_common(1)[0]
+                if repeats >= self.n_plus_one_threshold:
+                    n_plus_one.inc(stats.handler)
+                    logger.warning('Возможный N+1 в %s: запрос выполнен %d раз: %s',
+                                   stats.handler, repeats, statement[:200])
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware router: время обработчика по имени и состоянию FSM."""
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        name = data['handler'].callback.__name__
+        state = data.get('raw_state') or 'none'
+        stats = current_stats.get()
+        if stats is not None:
+            stats.handler = name
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, name, state)
+
+
+def setup_metrics(dp, router, engine):
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    for observer in (router.message, router.callback_query):
+        observer.middleware(HandlerMetricsMiddleware())
+    instrument_engine(engine)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=registry.expose(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[web.AppRunner]:
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info('Метрики доступны на %s:%d/metrics', host, port)
+    return runner
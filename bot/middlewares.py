@@ -0,0 +1,50 @@
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database.routing import pin_recent_writer
+from .sender import outbound
+
+COMMIT_FAILED_TEXT = 'Не удалось сохранить изменения, попробуйте ещё раз.'
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Одна сессия на апдейт: коммит после обработчика, откат при исключении.
+
+    AsyncSession берёт соединение из пула только при первом запросе,
+    поэтому апдейты без обращения к базе соединение не занимают. Если
+    пользователь только что что-то записал, сессия сразу читает с основной
+    базы, а не с реплики. Ответы обработчика уходят только после коммита;
+    если коммит не прошёл, пользователь получает сообщение об ошибке.
+    """
+
+    def __init__(self, session_pool: async_sessionmaker):
+        self.session_pool = session_pool
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        async with self.session_pool() as session:
+            user = data.get('event_from_user')
+            if user is not None:
+                pin_recent_writer(session, user.id)
+            data['session'] = session
+            try:
+                async with outbound.hold():
+                    result = await handler(event, data)
+                    if session.in_transaction():
+                        await session.commit()
+            except SQLAlchemyError:
+                await session.rollback()
+                chat = data.get('event_chat')
+                if chat is not None:
+                    await outbound.send(chat.id, COMMIT_FAILED_TEXT)
+                raise
+            except Exception:
+                await session.rollback()
+                raise
+            return result
@@ -0,0 +1,267 @@
+"""Исходящие сообщения: очередь с ограничением скорости.
+
+Обработчик кладёт ответ в очередь через outbound.answer() и сразу возвращается,
+не удерживая сессию базы на время ожидания Telegram. Ответы апдейта
+придерживаются до коммита его сессии (outbound.hold() в DbSessionMiddleware),
+чтобы «добавлено» не ушло раньше неудачного коммита. Несколько сообщений
+подряд в один чат склеиваются в одно. Все запросы к Bot API с chat_id проходят через
+RateLimitMiddleware: общий и по-чатовый token bucket, а на 429 — пауза чата на
+retry_after и повтор.
+
+Лимиты живут в памяти процесса. В режиме супервизора каждый из N воркеров
+получает SENDER_GLOBAL_RATE / N общего лимита: так весь бот не превышает лимит
+Telegram без общего хранилища, ценой того, что простаивающий воркер не
+отдаёт свою долю занятому. По-чатовый лимит не делится: апдейты одного
+пользователя, а значит и его чат, обслуживает один воркер.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.types import Message
+from config import (SENDER_GLOBAL_RATE, SENDER_CHAT_RATE, SENDER_CHAT_BURST, SENDER_WORKERS, SENDER_QUEUE_SIZE,
+                    SENDER_MAX_RETRIES, SENDER_CHAT_BUCKETS)
+from database.cache import LRUCache
+from .metrics import Counter, registry
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+
+outbound_sent = registry.register(Counter(
+    'bot_outbound_sent_total', 'Отправленные из очереди сообщения'))
+outbound_coalesced = registry.register(Counter(
+    'bot_outbound_coalesced_total', 'Сообщения, склеенные с соседними'))
+outbound_failed = registry.register(Counter(
+    'bot_outbound_failed_total', 'Сообщения, которые не удалось отправить', ['error']))
+retry_after_total = registry.register(Counter(
+    'bot_telegram_retry_after_total', 'Ответы 429 от Bot API'))
+
+held_messages: ContextVar[Optional[List[Tuple[Any, str, Dict[str, Any]]]]] = ContextVar('held_messages',
+                                                                                          default=None)
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Забирает токен и возвращает, сколько секунд ждать до его появления."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """Общий лимит бота и лимит на чат; rate = 0 отключает соответствующий лимит."""
+
+    def __init__(self, global_rate: float = SENDER_GLOBAL_RATE, chat_rate: float = SENDER_CHAT_RATE,
+                 chat_burst: float = SENDER_CHAT_BURST, max_chats: int = SENDER_CHAT_BUCKETS):
+        self.global_bucket = TokenBucket(global_rate, global_rate) if global_rate else None
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = LRUCache(maxsize=max_chats)
+        self.paused_until = LRUCache(maxsize=max_chats)
+
+    def delay(self, chat_id: Any) -> float:
+        delay = self.global_bucket.reserve() if self.global_bucket else 0.0
+        if self.chat_rate:
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                self.chat_buckets.set(chat_id, bucket)
+            delay = max(delay, bucket.reserve())
+        paused_until = self.paused_until.get(chat_id)
+        if paused_until is not None:
+            delay = max(delay, paused_until - time.monotonic())
+        return delay
+
+    async def acquire(self, chat_id: Any):
+        delay = self.delay(chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, chat_id: Any, seconds: float):
+        self.paused_until.set(chat_id, time.monotonic() + seconds)
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Ограничивает методы Bot API с chat_id и повторяет их после 429."""
+
+    def __init__(self, limiter: RateLimiter, max_retries: int = SENDER_MAX_RETRIES):
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                retry_after_total.inc()
+                if attempt == self.max_retries:
+                    raise
+                logger.warning('429 для чата %s, жду %s с', chat_id, e.retry_after)
+                self.limiter.pause(chat_id, e.retry_after)
+
+
+class OutboundQueue:
+    """Очередь сообщений по чатам: один чат обслуживает один воркер, порядок сохраняется."""
+
+    def __init__(self, workers: int = SENDER_WORKERS, maxsize: int = SENDER_QUEUE_SIZE,
+                 max_retries: int = SENDER_MAX_RETRIES):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.bot: Optional[Bot] = None
+        self.pending: Dict[Any, Deque[Dict[str, Any]]] = {}
+        self.idle: Dict[Any, asyncio.Event] = {}
+        self.ready: Optional[asyncio.Queue] = None
+        self.slots = asyncio.Semaphore(maxsize)
+        self.tasks = []
+
+    async def start(self, bot: Bot):
+        self.bot = bot
+        self.ready = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def send(self, chat_id: Any, text: str, **kwargs):
+        """Ставит сообщение в очередь; ждёт, только если очередь переполнена."""
+        if self.bot is None:
+            raise RuntimeError('OutboundQueue не запущена')
+        held = held_messages.get()
+        if held is not None:
+            held.append((chat_id, text, kwargs))
+            return
+        await self.slots.acquire()
+        messages = self.pending.get(chat_id)
+        if messages is None:
+            messages = self.pending[chat_id] = deque()
+            self.idle[chat_id] = asyncio.Event()
+            self.ready.put_nowait(chat_id)
+        messages.append({'text': text, **kwargs})
+
+    async def answer(self, message: Message, text: str, **kwargs):
+        await self.send(message.chat.id, text, **kwargs)
+
+    @asynccontextmanager
+    async def hold(self):
+        """Сообщения, поставленные внутри блока, уходят в очередь только при выходе из него без исключения."""
+        messages = []
+        token = held_messages.set(messages)
+        try:
+            yield
+        finally:
+            held_messages.reset(token)
+        for chat_id, text, kwargs in messages:
+            await self.send(chat_id, text, **kwargs)
+
+    async def flush(self, chat_id: Any = None):
+        """Ждёт отправки всего, что уже стоит в очереди чата (или всех чатов)."""
+        if chat_id is None:
+            events = list(self.idle.values())
+        else:
+            events = [self.idle[chat_id]] if chat_id in self.idle else []
+        for event in events:
+            await event.wait()
+
+    @staticmethod
+    def options(message: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in message.items() if key not in ('text', 'reply_markup')}
+
+    def coalesce(self, messages: Deque[Dict[str, Any]]) -> Tuple[Dict[str, Any], int]:
+        """Забирает из начала очереди сообщение и склеивает с ним следующие.
+
+        Склеивать можно, пока у накопленного сообщения нет клавиатуры и прочие
+        параметры совпадают; клавиатура берётся у последнего. Возвращает
+        (сообщение, сколько исходных сообщений в него вошло).
+        """
+        merged = messages.popleft()
+        count = 1
+        while messages:
+            following = messages[0]
+            length = len(merged['text']) + 2 + len(following['text'])
+            if (merged.get('reply_markup') is not None or self.options(merged) != self.options(following)
+                    or length > MAX_MESSAGE_LENGTH):
+                break
+            messages.popleft()
+            merged = {**following, 'text': merged['text'] + '\n\n' + following['text']}
+            count += 1
+        return merged, count
+
+    async def _worker(self):
+        while True:
+            chat_id = await self.ready.get()
+            messages = self.pending[chat_id]
+            message, count = self.coalesce(messages)
+            if count > 1:
+                outbound_coalesced.inc(amount=count - 1)
+            await self._deliver(chat_id, message)
+            for _ in range(count):
+                self.slots.release()
+            if messages:
+                self.ready.put_nowait(chat_id)
+            else:
+                del self.pending[chat_id]
+                self.idle.pop(chat_id).set()
+
+    async def _deliver(self, chat_id: Any, message: Dict[str, Any]):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.bot.send_message(chat_id=chat_id, **message)
+                outbound_sent.inc()
+                return
+            except TelegramNetworkError as e:
+                if attempt == self.max_retries:
+                    outbound_failed.inc(type(e).__name__)
+                    logger.error('Не удалось отправить сообщение в чат %s: %s', chat_id, e)
+                    return
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramAPIError as e:
+                outbound_failed.inc(type(e).__name__)
+                logger.error('Не удалось отправить сообщение в чат %s: %s', chat_id, e)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                outbound_failed.inc('unexpected')
+                logger.exception('Ошибка при отправке сообщения в чат %s', chat_id)
+                return
+
+    async def stop(self, timeout: float = 10):
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Не все исходящие сообщения отправлены: %d чатов в очереди', len(self.pending))
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.bot = None
+
+
+outbound = OutboundQueue()
+
+
+def setup_sender(dp, bot: Bot, limiter: Optional[RateLimiter] = None, workers: int = 1):
+    """workers — сколько процессов делят общий лимит бота."""
+    if limiter is None:
+        limiter = RateLimiter(global_rate=SENDER_GLOBAL_RATE / workers)
+    bot.session.middleware(RateLimitMiddleware(limiter))
+    dp.startup.register(outbound.start)
+    dp.shutdown.register(outbound.stop)
@@ -0,0 +1,139 @@
+"""Приём апдейтов через вебхук на aiohttp.
+
+Апдейт кладётся в очередь и сразу подтверждается, обработку ведут фоновые воркеры.
+Апдейты одного пользователя попадают в одну очередь и обрабатываются по порядку.
+Если очередь заполнена дольше WEBHOOK_ENQUEUE_TIMEOUT, отвечаем 503 и Telegram
+повторит доставку позже.
+
+Локальная проверка без setWebhook (WEBHOOK_URL не задан):
+    curl -X POST -H 'Content-Type: application/json' \
+         -H 'X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET>' \
+         -d @update.json http://localhost:8080/webhook
+"""
+import asyncio
+import hmac
+import logging
+import zlib
+from typing import Any, Dict, Optional
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+from config import (WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_WORKERS,
+                    WEBHOOK_QUEUE_SIZE, WEBHOOK_ENQUEUE_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    for key, value in update.items():
+        if key != 'update_id' and isinstance(value, dict):
+            sender = value.get('from') or value.get('user')
+            if isinstance(sender, dict):
+                return sender.get('id')
+            chat = value.get('chat')
+            if isinstance(chat, dict):
+                return chat.get('id')
+    return None
+
+
+def shard_for(user_id: Optional[int], shards: int) -> int:
+    if user_id is None:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+class UpdateQueue:
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = WEBHOOK_WORKERS,
+                 maxsize: int = WEBHOOK_QUEUE_SIZE):
+        self.dp = dp
+        self.bot = bot
+        per_worker = max(1, maxsize // workers)
+        self.queues = [asyncio.Queue(maxsize=per_worker) for _ in range(workers)]
+        self.tasks = []
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._worker(queue)) for queue in self.queues]
+
+    async def put(self, update: Dict[str, Any], timeout: float = WEBHOOK_ENQUEUE_TIMEOUT) -> bool:
+        queue = self.queues[shard_for(update_user_id(update), len(self.queues))]
+        try:
+            await asyncio.wait_for(queue.put(update), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def qsize(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception('Ошибка при обработке апдейта %s', update.get('update_id'))
+            finally:
+                queue.task_done()
+
+    async def stop(self, timeout: float = 10):
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Не дождались обработки %d апдейтов при остановке', self.qsize())
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+async def handle_update(request: web.Request) -> web.Response:
+    if WEBHOOK_SECRET and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), WEBHOOK_SECRET):
+        return web.Response(status=401)
+    try:
+        update = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    if not isinstance(update, dict):
+        return web.Response(status=400)
+
+    if not await request.app['update_queue'].put(update):
+        logger.warning('Очередь апдейтов переполнена, просим Telegram повторить доставку')
+        return web.Response(status=503)
+    return web.Response()
+
+
+def create_app(update_queue, path: str = WEBHOOK_PATH) -> web.Application:
+    app = web.Application()
+    app['update_queue'] = update_queue
+    app.router.add_post(path, handle_update)
+    return app
+
+
+async def serve_webhook(app: web.Application, dp: Dispatcher, bot: Bot):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    try:
+        await site.start()
+        if WEBHOOK_URL:
+            await bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                                  allowed_updates=dp.resolve_used_update_types())
+        logger.info('Принимаю апдейты на %s:%s%s', WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    update_queue = UpdateQueue(dp, bot)
+    update_queue.start()
+    await dp.emit_startup(bot=bot)
+    try:
+        await serve_webhook(create_app(update_queue), dp, bot)
+    finally:
+        await update_queue.stop()
+        await dp.emit_shutdown(bot=bot)
@@ -0,0 +1,212 @@
+"""Режим супервизора: N процессов-воркеров с общим router.
+
+Супервизор получает апдейты (long polling или вебхук) и раскладывает их по
+воркерам по хэшу from_user.id, поэтому апдейты одного пользователя всегда
+обрабатывает один процесс в исходном порядке. Воркеры периодически присылают
+отчёт о состоянии, упавший воркер перезапускается.
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from typing import Any, Dict, List
+from aiogram import Bot, Dispatcher
+from aiogram.methods import GetUpdates
+from aiohttp import web
+from config import METRICS_PORT, WORKER_PROCESSES, WORKER_QUEUE_SIZE, WORKER_HEALTH_INTERVAL, WEBHOOK_ENQUEUE_TIMEOUT
+from .webhook import UpdateQueue, create_app, serve_webhook, shard_for, update_user_id
+
+logger = logging.getLogger(__name__)
+
+POLLING_TIMEOUT = 30
+
+
+def worker_main(index: int, workers: int, updates: multiprocessing.Queue, status: multiprocessing.Queue,
+                interval: float):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_worker(index, workers, updates, status, interval))
+
+
+async def run_worker(index: int, workers: int, updates: multiprocessing.Queue, status: multiprocessing.Queue,
+                     interval: float):
+    from .create_bot import bot, dp, setup_dispatcher
+    from .metrics import start_metrics_server
+    from database.group_commit import group_commit
+
+    # Общий лимит отправки Telegram один на бота: каждый воркер берёт свою долю.
+    setup_dispatcher(workers)
+    metrics_runner = await start_metrics_server(METRICS_PORT + 1 + index) if METRICS_PORT else None
+    update_queue = UpdateQueue(dp, bot)
+    update_queue.start()
+    await dp.emit_startup(bot=bot)
+    loop = asyncio.get_running_loop()
+
+    def report(state: str):
+        status.put({'worker': index, 'state': state, 'processed': update_queue.processed,
+                    'failed': update_queue.failed, 'queued': update_queue.qsize(), 'time': time.time()})
+
+    async def reporter():
+        while True:
+            report('running')
+            await asyncio.sleep(interval)
+
+    reporter_task = asyncio.create_task(reporter())
+    try:
+        while True:
+            try:
+                update = await loop.run_in_executor(None, updates.get, True, 1.0)
+            except queue.Empty:
+                continue
+            if update is None:
+                break
+            await update_queue.put(update, timeout=None)
+    finally:
+        reporter_task.cancel()
+        await update_queue.stop()
+        report('stopped')
+        await dp.emit_shutdown(bot=bot)
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        if group_commit is not None:
+            await group_commit.close()
+        await dp.storage.close()
+        await bot.session.close()
+
+
+class Supervisor:
+    def __init__(self, workers: int = WORKER_PROCESSES, queue_size: int = WORKER_QUEUE_SIZE,
+                 health_interval: float = WORKER_HEALTH_INTERVAL):
+        self.context = multiprocessing.get_context('spawn')
+        self.health_interval = health_interval
+        self.updates = [self.context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.status = self.context.Queue()
+        self.processes: List[multiprocessing.Process] = [None] * workers
+        self.health: Dict[int, Dict[str, Any]] = {}
+        self.stopping = False
+
+    def _spawn(self, index: int):
+        process = self.context.Process(target=worker_main, name=f'bot-worker-{index}',
+                                       args=(index, len(self.processes), self.updates[index], self.status,
+                                             self.health_interval))
+        process.start()
+        self.processes[index] = process
+        logger.info('Запущен воркер %s (pid %s)', index, process.pid)
+
+    def start(self):
+        for index in range(len(self.processes)):
+            self._spawn(index)
+
+    async def put(self, update: Dict[str, Any], timeout: float = WEBHOOK_ENQUEUE_TIMEOUT) -> bool:
+        target = self.updates[shard_for(update_user_id(update), len(self.updates))]
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                target.put_nowait(update)
+                return True
+            except queue.Full:
+                if time.monotonic() >= deadline:
+                    return False
+                await asyncio.sleep(0.01)
+
+    def report(self) -> Dict[int, Dict[str, Any]]:
+        while True:
+            try:
+                message = self.status.get_nowait()
+            except queue.Empty:
+                break
+            self.health[message['worker']] = message
+        now = time.time()
+        for index, process in enumerate(self.processes):
+            entry = self.health.setdefault(index, {'worker': index})
+            entry['pid'] = process.pid
+            entry['alive'] = process.is_alive()
+            entry['healthy'] = entry['alive'] and now - entry.get('time', 0) < self.health_interval * 3
+        return self.health
+
+    async def monitor(self):
+        while not self.stopping:
+            await asyncio.sleep(self.health_interval)
+            for index, entry in self.report().items():
+                if not entry['alive'] and not self.stopping:
+                    logger.error('Воркер %s завершился (код %s), перезапускаю', index, self.processes[index].exitcode)
+                    self._spawn(index)
+                elif not entry['healthy']:
+                    logger.warning('Воркер %s давно не присылал отчёт', index)
+            logger.info('Воркеры: %s', ', '.join(
+                f'{index}: {entry.get("processed", 0)} ok / {entry.get("failed", 0)} err / '
+                f'{entry.get("queued", 0)} в очереди' for index, entry in sorted(self.health.items())))
+
+    async def stop(self, timeout: float = 30):
+        self.stopping = True
+        for updates in self.updates:
+            try:
+                updates.put(None, timeout=1)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            while process.is_alive() and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            if process.is_alive():
+                logger.warning('Воркер %s не завершился вовремя, останавливаю принудительно', process.name)
+                process.terminate()
+            process.join()
+        self.report()
+
+
+async def poll_updates(bot: Bot, supervisor: Supervisor, allowed_updates):
+    offset = None
+    delay = 1
+    while True:
+        try:
+            updates = await bot(GetUpdates(offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates),
+                                request_timeout=POLLING_TIMEOUT + 30)
+            delay = 1
+        except Exception as e:
+            logger.error('Не удалось получить апдейты: %s, повтор через %s с', e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+            continue
+        for update in updates:
+            data = update.model_dump(mode='json', by_alias=True, exclude_none=True)
+            while not await supervisor.put(data):
+                logger.warning('Очереди воркеров переполнены, жду')
+            offset = update.update_id + 1
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    health = request.app['update_queue'].report()
+    status = 200 if all(entry['healthy'] for entry in health.values()) else 503
+    return web.json_response({str(index): entry for index, entry in health.items()}, status=status)
+
+
+async def run_supervisor(dp: Dispatcher, bot: Bot, mode: str, workers: int = WORKER_PROCESSES):
+    supervisor = Supervisor(workers=workers)
+    supervisor.start()
+    monitor_task = asyncio.create_task(supervisor.monitor())
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+    if mode == 'webhook':
+        app = create_app(supervisor)
+        app.router.add_get('/health', handle_health)
+        source = asyncio.create_task(serve_webhook(app, dp, bot))
+    else:
+        await bot.delete_webhook(drop_pending_updates=True)
+        source = asyncio.create_task(poll_updates(bot, supervisor, dp.resolve_used_update_types()))
+
+    stopped = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait([source, stopped], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        logger.info('Останавливаю воркеров...')
+        source.cancel()
+        stopped.cancel()
+        await asyncio.gather(source, stopped, return_exceptions=True)
+        await supervisor.stop()
+        monitor_task.cancel()
+        loop.remove_signal_handler(signal.SIGTERM)
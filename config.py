@@ -4,4 +4,73 @@ from dotenv import load_dotenv
 load_dotenv()
 
 API_TOKEN = os.getenv('TOKEN')
-DATABASE_URL = os.getenv('DATABASE_URL')
\ No newline at end of file
+DATABASE_URL = os.getenv('DATABASE_URL')
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+REPLICA_STICKY_USERS = int(os.getenv('REPLICA_STICKY_USERS', 100_000))
+
+IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', 100_000))
+IDENTITY_CACHE_TTL = float(os.getenv('IDENTITY_CACHE_TTL', 3600))
+PAGE_CACHE_BYTES = int(os.getenv('PAGE_CACHE_BYTES', 64 * 1024 * 1024))
+PAGE_CACHE_TTL = float(os.getenv('PAGE_CACHE_TTL', 3600))
+CATALOG_CACHE_SIZE = int(os.getenv('CATALOG_CACHE_SIZE', 200_000))
+TOP_RATED_MIN_REVIEWS = int(os.getenv('TOP_RATED_MIN_REVIEWS', 3))
+
+DB_ECHO = os.getenv('DB_ECHO', 'false').lower() in ('1', 'true', 'yes')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 500))
+DB_SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('DB_SQLITE_BUSY_TIMEOUT_MS', 30_000))
+DB_GROUP_COMMIT = os.getenv('DB_GROUP_COMMIT', 'false').lower() in ('1', 'true', 'yes')
+DB_GROUP_COMMIT_WINDOW_MS = float(os.getenv('DB_GROUP_COMMIT_WINDOW_MS', 5))
+DB_GROUP_COMMIT_MAX_BATCH = int(os.getenv('DB_GROUP_COMMIT_MAX_BATCH', 500))
+
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 8))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv('WEBHOOK_ENQUEUE_TIMEOUT', 2))
+
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sql')
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', 24 * 3600))
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', 10_000))
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', 0.5))
+FSM_FLUSH_BATCH = int(os.getenv('FSM_FLUSH_BATCH', 100))
+FSM_SWEEP_INTERVAL = float(os.getenv('FSM_SWEEP_INTERVAL', 600))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+SENDER_GLOBAL_RATE = float(os.getenv('SENDER_GLOBAL_RATE', 30))
+SENDER_CHAT_RATE = float(os.getenv('SENDER_CHAT_RATE', 1))
+SENDER_CHAT_BURST = float(os.getenv('SENDER_CHAT_BURST', 3))
+SENDER_WORKERS = int(os.getenv('SENDER_WORKERS', 16))
+SENDER_QUEUE_SIZE = int(os.getenv('SENDER_QUEUE_SIZE', 10_000))
+SENDER_MAX_RETRIES = int(os.getenv('SENDER_MAX_RETRIES', 5))
+SENDER_CHAT_BUCKETS = int(os.getenv('SENDER_CHAT_BUCKETS', 100_000))
+
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 20))
+BROADCAST_MAX_SHARE = float(os.getenv('BROADCAST_MAX_SHARE', 0.67))
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', 500))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 30))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 120))
+DIGEST_INTERVAL_DAYS = float(os.getenv('DIGEST_INTERVAL_DAYS', 0))
+DIGEST_TITLES = int(os.getenv('DIGEST_TITLES', 5))
+
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 1))
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', 1000))
+WORKER_HEALTH_INTERVAL = float(os.getenv('WORKER_HEALTH_INTERVAL', 10))
+
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', 0.1))
+METRICS_SLOW_QUERY_MS = float(os.getenv('METRICS_SLOW_QUERY_MS', 100))
+METRICS_N_PLUS_ONE_THRESHOLD = int(os.getenv('METRICS_N_PLUS_ONE_THRESHOLD', 5))
+
+DB_AUTO_MIGRATE = os.getenv('DB_AUTO_MIGRATE', 'true').lower() in ('1', 'true', 'yes')
+DB_DEDUPLICATE_REVIEWS = os.getenv('DB_DEDUPLICATE_REVIEWS', 'false').lower() in ('1', 'true', 'yes')
@@ -0,0 +1,313 @@
+"""Пакетный импорт и потоковый экспорт библиотеки пользователя.
+
+Импорт читает CSV или JSON (массив объектов или JSON Lines) построчно и
+вставляет фильмы и рецензии пачками по IMPORT_BATCH_SIZE: на PostgreSQL через
+COPY, на остальных СУБД через executemany. Понимает собственный формат
+экспорта, а также выгрузки Letterboxd и IMDb. Фильмы, которые уже есть в
+библиотеке (совпадают фильм каталога и год), пропускаются, поэтому повторная
+загрузка собственного экспорта ничего не дублирует, а одноимённые фильмы
+разных лет, например ремейки, импортируются оба.
+"""
+import codecs
+import csv
+import io
+import json
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+from sqlalchemy import insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .catalog import get_catalog_ids
+from .crud import get_user_id, invalidate_pages
+from .models import CatalogMovie, Movie, Review
+from .routing import use_primary
+from .stats import RatingChange, apply_rating_changes
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = 5000
+MAX_TITLE_LENGTH = 500
+MAX_REPORTED_ERRORS = 5
+EXPORT_FIELDS = ('title', 'description', 'rating', 'comment', 'year')
+JSON_CHUNK_SIZE = 64 * 1024
+
+TITLE_COLUMNS = ('title', 'name', 'название')
+DESCRIPTION_COLUMNS = ('description', 'описание')
+YEAR_COLUMNS = ('year', 'год')
+RATING_COLUMNS = ('rating', 'рейтинг')
+TEN_POINT_RATING_COLUMNS = ('your rating',)
+COMMENT_COLUMNS = ('comment', 'review', 'комментарий')
+
+
+
+class ImportRow(NamedTuple):
+    title: str
+    description: Optional[str]
+    rating: Optional[int]
+    comment: Optional[str]
+    year: Optional[int]
+
+
+@dataclass
+class ImportResult:
+    movies: int = 0
+    reviews: int = 0
+    skipped: int = 0
+    duplicates: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    def add_error(self, line: int, reason: str):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f'строка {line}: {reason}')
+
+
+def pick(record: Dict[str, Any], columns) -> Optional[str]:
+    for column in columns:
+        value = record.get(column)
+        if value is not None and str(value).strip():
+            return str(value).strip()
+    return None
+
+
+def parse_rating(record: Dict[str, Any]) -> Optional[int]:
+    """Рейтинг 1–5. Letterboxd ставит половинки, IMDb — шкалу 1–10."""
+    value = pick(record, RATING_COLUMNS)
+    scale = 5
+    if value is None:
+        value = pick(record, TEN_POINT_RATING_COLUMNS)
+        scale = 10
+    if value is None:
+        return None
+    try:
+        rating = float(value.replace(',', '.'))
+    except ValueError:
+        raise ValueError('рейтинг не число')
+    if not 0 < rating <= scale:
+        raise ValueError(f'рейтинг {value} вне диапазона 1–{scale}')
+    return max(1, math.ceil(rating * 5 / scale - 1e-9))
+
+
+def parse_year(record: Dict[str, Any]) -> Optional[int]:
+    value = pick(record, YEAR_COLUMNS)
+    if value is None:
+        return None
+    try:
+        year = int(float(value))
+    except ValueError:
+        raise ValueError('год не число')
+    if not 1 <= year <= 9999:
+        raise ValueError(f'год {value} вне диапазона')
+    return year
+
+
+def normalize_record(record: Dict[str, Any]) -> ImportRow:
+    record = {str(key).strip().lower(): value for key, value in record.items() if key is not None}
+    title = pick(record, TITLE_COLUMNS)
+    if title is None:
+        raise ValueError('нет названия')
+    if len(title) > MAX_TITLE_LENGTH:
+        raise ValueError('слишком длинное название')
+    rating = parse_rating(record)
+    year = parse_year(record)
+    description = pick(record, DESCRIPTION_COLUMNS)
+    comment = pick(record, COMMENT_COLUMNS)
+    if rating is None:
+        # Рецензия без оценки невозможна, текст отзыва сохраняем в описании.
+        return ImportRow(title, description or comment, None, None, year)
+    return ImportRow(title, description, rating, comment, year)
+
+
+def iter_json_items(stream: TextIO) -> Iterator[Any]:
+    """Объекты JSON-массива или JSON Lines по одному, не читая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    exhausted = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+            position += 1
+        if position >= len(buffer):
+            if exhausted:
+                return
+            buffer, position = stream.read(JSON_CHUNK_SIZE), 0
+            exhausted = not buffer
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if exhausted:
+                raise
+            chunk = stream.read(JSON_CHUNK_SIZE)
+            exhausted = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield item
+        position = end
+
+
+def is_json(file: BinaryIO, filename: str) -> bool:
+    if filename.lower().endswith(('.json', '.jsonl')):
+        return True
+    head = file.peek(64)[:64].lstrip(codecs.BOM_UTF8 + b' \t\r\n')
+    return head[:1] in (b'[', b'{')
+
+
+def iter_records(file: BinaryIO, filename: str = '') -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(номер строки, запись) из CSV или JSON; формат определяется по имени и первым байтам."""
+    if not hasattr(file, 'peek'):
+        file = io.BufferedReader(file)
+    json_input = is_json(file, filename)
+    stream = io.TextIOWrapper(file, encoding='utf-8-sig', errors='replace', newline='')
+
+    if json_input:
+        for number, item in enumerate(iter_json_items(stream), start=1):
+            yield number, item if isinstance(item, dict) else {}
+    else:
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+
+
+async def record_ratings(session: AsyncSession, user_id: int, catalog_ids: List[int], batch: List[ImportRow]):
+    await apply_rating_changes(session, [RatingChange(user_id, catalog_id, None, rating)
+                                         for catalog_id, rating in zip(catalog_ids, (row.rating for row in batch))
+                                         if rating is not None])
+
+
+async def reserve_movie_ids(session: AsyncSession, count: int) -> List[int]:
+    result = await session.scalars(
+        text("SELECT nextval(pg_get_serial_sequence('movies', 'id')) FROM generate_series(1, :count)"),
+        {'count': count})
+    return list(result)
+
+
+async def new_titles(session: AsyncSession, user_id: int,
+                     batch: List[ImportRow]) -> Tuple[List[int], List[ImportRow]]:
+    """Id каталога и строки пачки без фильмов, которые уже есть у пользователя или выше в файле.
+
+    Фильм считается тем же, если совпадают запись каталога и год: год отличает
+    ремейки с одинаковым названием.
+    """
+    catalog_ids = await get_catalog_ids(session, [row.title for row in batch])
+    existing = set((await session.execute(
+        select(Movie.catalog_id, Movie.year)
+        .where(Movie.user_id == user_id, Movie.catalog_id.in_(set(catalog_ids))))).all())
+    new_ids, rows = [], []
+    for catalog_id, row in zip(catalog_ids, batch):
+        if (catalog_id, row.year) not in existing:
+            existing.add((catalog_id, row.year))
+            new_ids.append(catalog_id)
+            rows.append(row)
+    return new_ids, rows
+
+
+async def copy_batch(session: AsyncSession, user_id: int, catalog_ids: List[int], batch: List[ImportRow]) -> int:
+    """PostgreSQL: id фильмов берутся из последовательности, затем две команды COPY."""
+    movie_ids = await reserve_movie_ids(session, len(batch))
+    connection = await session.connection()
+    raw_connection = (await connection.get_raw_connection()).driver_connection
+    await raw_connection.copy_records_to_table(
+        Movie.__tablename__, columns=['id', 'catalog_id', 'description', 'year', 'user_id'],
+        records=[(movie_id, catalog_id, row.description, row.year, user_id)
+                 for movie_id, catalog_id, row in zip(movie_ids, catalog_ids, batch)])
+    reviews = [(user_id, movie_id, row.rating, row.comment)
+               for movie_id, row in zip(movie_ids, batch) if row.rating is not None]
+    if reviews:
+        await raw_connection.copy_records_to_table(
+            Review.__tablename__, columns=['user_id', 'movie_id', 'rating', 'comment'], records=reviews)
+    await record_ratings(session, user_id, catalog_ids, batch)
+    return len(reviews)
+
+
+async def insert_batch(session: AsyncSession, user_id: int, catalog_ids: List[int], batch: List[ImportRow]) -> int:
+    movie_ids = await session.scalars(
+        insert(Movie).returning(Movie.id, sort_by_parameter_order=True),
+        [{'catalog_id': catalog_id, 'description': row.description, 'year': row.year, 'user_id': user_id}
+         for catalog_id, row in zip(catalog_ids, batch)])
+    reviews = [{'user_id': user_id, 'movie_id': movie_id, 'rating': row.rating, 'comment': row.comment}
+               for movie_id, row in zip(movie_ids, batch) if row.rating is not None]
+    if reviews:
+        await session.execute(insert(Review), reviews)
+    await record_ratings(session, user_id, catalog_ids, batch)
+    return len(reviews)
+
+
+async def import_movies(session: AsyncSession, telegram_id: int, records,
+                        progress: Optional[Callable[[ImportResult], Awaitable[None]]] = None,
+                        batch_size: int = IMPORT_BATCH_SIZE) -> Optional[ImportResult]:
+    """Импортирует записи из iter_records. Каждая пачка фиксируется отдельным коммитом."""
+    use_primary(session, telegram_id)
+    user_id = await get_user_id(session, telegram_id)
+    if user_id is None:
+        logger.error('Пользователь с Telegram ID %s не зарегистрирован', telegram_id)
+        return None
+
+    write_batch = copy_batch if session.bind.dialect.name == 'postgresql' else insert_batch
+    result = ImportResult()
+    batch: List[ImportRow] = []
+
+    async def flush():
+        catalog_ids, rows = await new_titles(session, user_id, batch)
+        result.duplicates += len(batch) - len(rows)
+        if rows:
+            result.reviews += await write_batch(session, user_id, catalog_ids, rows)
+        result.movies += len(rows)
+        batch.clear()
+        invalidate_pages(session, telegram_id)
+        await session.commit()
+        if progress is not None:
+            await progress(result)
+
+    for line, record in records:
+        try:
+            batch.append(normalize_record(record))
+        except ValueError as e:
+            result.add_error(line, str(e))
+            continue
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+
+    logger.info('Импорт для Telegram ID %s: %s фильмов, %s рецензий, уже были %s, пропущено %s',
+                telegram_id, result.movies, result.reviews, result.duplicates, result.skipped)
+    return result
+
+
+async def export_movies(session: AsyncSession, telegram_id: int, file: BinaryIO, fmt: str = 'csv') -> int:
+    """Пишет библиотеку пользователя в file порциями, не загружая её в память целиком."""
+    user_id = await get_user_id(session, telegram_id)
+    if user_id is None:
+        return 0
+    query = (
+        select(CatalogMovie.title, Movie.description, Review.rating, Review.comment, Movie.year)
+        .join(Movie.catalog)
+        .outerjoin(Review, Review.movie_id == Movie.id)
+        .where(Movie.user_id == user_id)
+        .order_by(Movie.id)
+        .execution_options(yield_per=IMPORT_BATCH_SIZE)
+    )
+    writer = codecs.getwriter('utf-8')(file)
+    count = 0
+    if fmt == 'json':
+        writer.write('[')
+    else:
+        csv_writer = csv.writer(writer)
+        csv_writer.writerow(EXPORT_FIELDS)
+
+    rows = await session.stream(query)
+    async for partition in rows.partitions():
+        for row in partition:
+            if fmt == 'json':
+                writer.write((',\n' if count else '\n') + json.dumps(dict(zip(EXPORT_FIELDS, row)),
+                                                                     ensure_ascii=False))
+            else:
+                csv_writer.writerow(row)
+            count += 1
+
+    if fmt == 'json':
+        writer.write('\n]\n')
+    writer.flush()
+    return count
@@ -0,0 +1,116 @@
+import sys
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Hashable, Optional
+from config import IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL, PAGE_CACHE_BYTES, PAGE_CACHE_TTL
+
+
+class LRUCache:
+    """Ограниченный по размеру LRU-кэш с TTL и счётчиками попаданий.
+
+    maxsize ограничивает суммарный вес записей, по умолчанию вес каждой записи 1.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.weight = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def weigh(self, key: Hashable, value: Any) -> int:
+        return 1
+
+    def _remove(self, key: Hashable):
+        value, _ = self._data.pop(key)
+        self.weight -= self.weigh(key, value)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """ttl сокращает срок жизни этой записи относительно общего; ttl <= 0 — не кэшировать."""
+        self.invalidate(key)
+        if ttl is not None and ttl <= 0:
+            return
+        if ttl is None or (self.ttl and self.ttl < ttl):
+            ttl = self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._data[key] = (value, expires_at)
+        self.weight += self.weigh(key, value)
+        while self.weight > self.maxsize and self._data:
+            self._remove(next(iter(self._data)))
+
+    def invalidate(self, key: Hashable):
+        if key in self._data:
+            self._remove(key)
+
+    def clear(self):
+        self._data.clear()
+        self.weight = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate}
+
+
+class PageCache(LRUCache):
+    """Кэш отрисованных страниц списка фильмов, ограниченный по памяти.
+
+    Ключ — (telegram_id, курсор). Индекс по пользователю позволяет сбросить все
+    страницы одного пользователя, не трогая остальные.
+    """
+
+    def __init__(self, maxbytes: int, ttl: Optional[float] = None):
+        super().__init__(maxsize=maxbytes, ttl=ttl)
+        self._keys_by_user = defaultdict(set)
+
+    def weigh(self, key: Hashable, value: Any) -> int:
+        return sys.getsizeof(key) + sum(sys.getsizeof(item) for item in value)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        super().set(key, value, ttl)
+        if key in self._data:
+            self._keys_by_user[key[0]].add(key)
+
+    def _remove(self, key: Hashable):
+        super()._remove(key)
+        user_keys = self._keys_by_user.get(key[0])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._keys_by_user[key[0]]
+
+    def invalidate_user(self, telegram_id: int):
+        for key in list(self._keys_by_user.get(telegram_id, ())):
+            self._remove(key)
+
+    def clear(self):
+        super().clear()
+        self._keys_by_user.clear()
+
+    def stats(self) -> dict:
+        return {**super().stats(), 'bytes': self.weight}
+
+
+identity_cache = LRUCache(maxsize=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL)
+page_cache = PageCache(maxbytes=PAGE_CACHE_BYTES, ttl=PAGE_CACHE_TTL)
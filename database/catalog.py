@@ -0,0 +1,103 @@
+"""Общий каталог фильмов.
+
+Названия сводятся к нормализованному ключу (регистр, ё/е, пунктуация, пробелы),
+и одна строка catalog_movies соответствует одному ключу. Библиотеки
+пользователей ссылаются на каталог, а ключ → id кэшируется в памяти, поэтому
+добавление популярного фильма не обращается к каталогу в базе. При групповом
+коммите недостающие записи каталога создаёт хук resolve_titles в транзакции
+пачки.
+"""
+import re
+import unicodedata
+from typing import Any, Dict, List, Sequence
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import CATALOG_CACHE_SIZE
+from .cache import LRUCache
+from .models import CatalogMovie
+from .upsert import conflict_insert
+
+CATALOG_BATCH_SIZE = 500
+
+catalog_index = LRUCache(maxsize=CATALOG_CACHE_SIZE)
+
+NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize_title(title: str) -> str:
+    normalized = unicodedata.normalize('NFKC', title).casefold().replace('ё', 'е')
+    normalized = ' '.join(NON_WORD.sub(' ', normalized).replace('_', ' ').split())
+    return normalized or ' '.join(title.casefold().split())
+
+
+async def insert_missing(session: AsyncSession, rows: List[Dict[str, str]]) -> Dict[str, int]:
+    """Вставляет записи каталога и возвращает {normalized_title: id} для вставленных.
+
+    Строки, которые параллельно успел вставить кто-то другой, пропускаются и в
+    результат не попадают.
+    """
+    stmt = conflict_insert(session, CatalogMovie)
+    if stmt is not None:
+        result = await session.execute(
+            stmt.values(rows)
+            .on_conflict_do_nothing(index_elements=[CatalogMovie.normalized_title])
+            .returning(CatalogMovie.normalized_title, CatalogMovie.id))
+        return dict(result.all())
+    movies = [CatalogMovie(**row) for row in rows]
+    session.add_all(movies)
+    await session.flush()
+    return {movie.normalized_title: movie.id for movie in movies}
+
+
+async def get_catalog_ids(session: AsyncSession, titles: Sequence[str]) -> List[int]:
+    """id записей каталога для titles, недостающие записи создаются в этой сессии."""
+    keys = [normalize_title(title) for title in titles]
+    found: Dict[str, int] = {}
+    missing: Dict[str, str] = {}
+    for key, title in zip(keys, titles):
+        catalog_id = catalog_index.get(key)
+        if catalog_id is not None:
+            found[key] = catalog_id
+        elif key not in missing:
+            missing[key] = title.strip()
+
+    async def load(batch, remember: bool):
+        rows = await session.execute(
+            select(CatalogMovie.normalized_title, CatalogMovie.id).where(CatalogMovie.normalized_title.in_(batch)))
+        for key, catalog_id in rows:
+            found[key] = catalog_id
+            if remember:
+                catalog_index.set(key, catalog_id)
+
+    pending = list(missing)
+    for start in range(0, len(pending), CATALOG_BATCH_SIZE):
+        batch = pending[start:start + CATALOG_BATCH_SIZE]
+        await load(batch, remember=True)
+        absent = [key for key in batch if key not in found]
+        if absent:
+            # Только что вставленные строки не кэшируем: транзакцию ещё могут откатить.
+            found.update(await insert_missing(session, [{'title': missing[key], 'normalized_title': key}
+                                                        for key in absent]))
+            raced = [key for key in absent if key not in found]
+            if raced:
+                await load(raced, remember=True)
+    return [found[key] for key in keys]
+
+
+async def resolve_catalog_id(session: AsyncSession, title: str) -> int:
+    """id записи каталога для одного названия."""
+    catalog_id = catalog_index.get(normalize_title(title))
+    if catalog_id is not None:
+        return catalog_id
+    return (await get_catalog_ids(session, [title]))[0]
+
+
+async def resolve_titles(session: AsyncSession, rows: List[Dict[str, Any]]):
+    """Хук группового коммита: заменяет title в строках movies на catalog_id.
+
+    Недостающие записи каталога вставляются одним запросом в транзакции пачки.
+    """
+    titled = [row for row in rows if 'title' in row]
+    catalog_ids = await get_catalog_ids(session, [row.pop('title') for row in titled])
+    for row, catalog_id in zip(titled, catalog_ids):
+        row['catalog_id'] = catalog_id
@@ -1,82 +1,380 @@
 import logging
 from typing import Optional
+from sqlalchemy import delete, event, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.future import select
+from sqlalchemy.orm import Session
+from config import REPLICA_STICKY_SECONDS, TOP_RATED_MIN_REVIEWS
+from .cache import identity_cache, page_cache
+from .catalog import resolve_catalog_id, resolve_titles
+from .group_commit import group_commit
+from .routing import read_replica, use_primary
 from .models import *
+from .stats import RatingChange, apply_rating_changes, record_new_reviews
 
 logger = logging.getLogger(__name__)
 
 
+def invalidate_pages(session: AsyncSession, telegram_id: int):
+    """Сбрасывает кэш страниц пользователя сейчас и ещё раз после коммита.
+
+    Второй сброс не даёт параллельному просмотру закэшировать данные,
+    прочитанные до коммита изменения.
+    """
+    page_cache.invalidate_user(telegram_id)
+    session.info.setdefault('stale_pages', set()).add(telegram_id)
+
+
+def can_group_commit(session: AsyncSession) -> bool:
+    """Групповой коммит пишет в своей транзакции и не увидит незакоммиченное в этой сессии.
+
+    Поэтому он используется, только если сессия апдейта ещё не открыла транзакцию.
+    """
+    return group_commit is not None and not session.in_transaction()
+
+
+if group_commit is not None:
+    group_commit.before_insert(Movie, resolve_titles)
+    group_commit.after_insert(Review, record_new_reviews)
+
+
+def remember_new_user(session: AsyncSession, telegram_id: int, user_id: int):
+    """Кэширует id созданного пользователя только после коммита.
+
+    При откате в кэше не останется id строки, которой нет в базе.
+    """
+    session.info.setdefault('new_users', {})[telegram_id] = user_id
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed_pages(session):
+    for telegram_id in session.info.pop('stale_pages', ()):
+        page_cache.invalidate_user(telegram_id)
+    for telegram_id, user_id in session.info.pop('new_users', {}).items():
+        identity_cache.set(telegram_id, user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_stale_pages(session):
+    session.info.pop('stale_pages', None)
+    session.info.pop('new_users', None)
+
+
+async def get_user_id(session: AsyncSession, telegram_id: int) -> Optional[int]:
+    user_id = identity_cache.get(telegram_id)
+    if user_id is None:
+        user_id = await session.scalar(select(User.id).filter_by(telegram_id=telegram_id))
+        # Незакоммиченного пользователя этой сессии кэширует remember_new_user.
+        if user_id is not None and telegram_id not in session.info.get('new_users', ()):
+            identity_cache.set(telegram_id, user_id)
+    return user_id
+
+
 async def set_user(session: AsyncSession, tg_id: int, username: str, full_name: str) -> Optional[User]:
     try:
+        if identity_cache.get(tg_id) is not None:
+            return None
+        use_primary(session, tg_id)
         user = await session.scalar(select(User).filter_by(telegram_id=tg_id))
 
         if not user:
             new_user = User(telegram_id=tg_id, username=username, full_name=full_name)
             session.add(new_user)
-            await session.commit()
-            logger.info(f'Зарегистрировал пользователя с ID {tg_id}!')
+            await session.flush()
+            remember_new_user(session, tg_id, new_user.id)
+            logger.info('Зарегистрировал пользователя с ID %s!', tg_id)
             return new_user
         else:
-            logger.info(f'Пользователь с ID {tg_id} найден!')
+            identity_cache.set(tg_id, user.id)
+            logger.debug('Пользователь с ID %s найден!', tg_id)
     except SQLAlchemyError as e:
-        logger.error(f'Ошибка при добавлении пользователя: {e}')
+        logger.error('Ошибка при добавлении пользователя: %s', e)
         await session.rollback()
         return None
 
 
+async def delete_user(session: AsyncSession, telegram_id: int) -> bool:
+    use_primary(session, telegram_id)
+    try:
+        user = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
+        identity_cache.invalidate(telegram_id)
+        invalidate_pages(session, telegram_id)
+        if not user:
+            return False
+        ratings = await session.execute(
+            select(Movie.catalog_id, Review.rating).join(Review, Review.movie_id == Movie.id)
+            .where(Movie.user_id == user.id))
+        await apply_rating_changes(session, [RatingChange(user.id, catalog_id, rating, None)
+                                             for catalog_id, rating in ratings])
+        await session.execute(delete(UserStats).filter_by(user_id=user.id))
+        await session.delete(user)
+        await session.flush()
+        logger.info('Удалил пользователя с Telegram ID %s', telegram_id)
+        return True
+    except SQLAlchemyError as e:
+        logger.error('Ошибка при удалении пользователя: %s', e)
+        await session.rollback()
+        return False
+
+
 async def add_movie(session: AsyncSession, title: str, description: str, telegram_id: int) -> Optional[Movie]:
-    user = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
+    use_primary(session, telegram_id)
+    user_id = await get_user_id(session, telegram_id)
+    if user_id is None:
+        logger.error('Пользователь с Telegram ID %s не зарегистрирован', telegram_id)
+        return None
     try:
-        new_movie = Movie(title=title, description=description, user_id=user.id)
-        session.add(new_movie)
-        await session.commit()
-        logger.info(f'Добавили фильм пользователю с Telegram ID {telegram_id}!')
+        if can_group_commit(session):
+            # Запись каталога создаст resolve_titles в транзакции пачки.
+            new_movie = await group_commit.insert(Movie, {'title': title, 'description': description,
+                                                          'user_id': user_id})
+            page_cache.invalidate_user(telegram_id)
+        else:
+            catalog_id = await resolve_catalog_id(session, title)
+            new_movie = Movie(catalog_id=catalog_id, description=description, user_id=user_id)
+            session.add(new_movie)
+            await session.flush()
+            invalidate_pages(session, telegram_id)
+        logger.debug('Добавили фильм пользователю с Telegram ID %s!', telegram_id)
         return new_movie
     except SQLAlchemyError as e:
-        logger.error(f'Ошибка при добавлении фильма: {e}')
+        logger.error('Ошибка при добавлении фильма: %s', e)
         await session.rollback()
         return None
 
 
 async def add_review(session: AsyncSession, telegram_id: int, movie_id: int, rating: int, comment: str) -> Optional[Review]:
-    user = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
-    movie = await session.get(Movie, movie_id)
+    use_primary(session, telegram_id)
+    user_id = await get_user_id(session, telegram_id)
+    if user_id is None:
+        logger.error('Пользователь с Telegram ID %s не зарегистрирован', telegram_id)
+        return None
     try:
-        new_review = Review(user_id=user.id, movie_id=movie.id, rating=rating, comment=comment)
-        session.add(new_review)
-        await session.commit()
-        logger.info(f'Добавили рецензию пользователю с Telegram ID {telegram_id}!')
+        if can_group_commit(session):
+            new_review = await group_commit.insert(Review, {'user_id': user_id, 'movie_id': movie_id,
+                                                            'rating': rating, 'comment': comment})
+            page_cache.invalidate_user(telegram_id)
+        else:
+            new_review = Review(user_id=user_id, movie_id=movie_id, rating=rating, comment=comment)
+            session.add(new_review)
+            await session.flush()
+            await record_new_reviews(session, [new_review])
+            invalidate_pages(session, telegram_id)
+        logger.debug('Добавили рецензию пользователю с Telegram ID %s!', telegram_id)
         return new_review
     except Exception as e:
-        logger.error(f'Ошибка при добавлении рецензии: {e}')
+        logger.error('Ошибка при добавлении рецензии: %s', e)
         await session.rollback()
         return None
 
-async def format_movies_info(result):
-    if not result:
+MOVIES_PAGE_SIZE = 10
+# Запись страницы — не больше 39 символов разметки и года, названия и
+# комментария: 10 записей (≈3,9 тыс.) укладываются в 4096 символов сообщения Telegram.
+TITLE_PREVIEW_LENGTH = 100
+COMMENT_PREVIEW_LENGTH = 250
+
+
+def preview(text: str, length: int) -> str:
+    return text[:length] + '…' if len(text) > length else text
+
+
+async def format_movies_info(rows):
+    if not rows:
         return 'У вас нет добавленных фильмов.'
 
     movies_info = []
-    for movie, review in result:
-        movie_info = f'Фильм: {movie.title}'
-        if review:
-            movie_info += f'\nРейтинг: {review.rating}'
-            movie_info += f'\nКомментарий: {review.comment}'
+    for movie_id, title, year, rating, comment in rows:
+        movie_info = f'Фильм: {preview(title, TITLE_PREVIEW_LENGTH)}'
+        if year is not None:
+            movie_info += f' ({year})'
+        if rating is not None:
+            if comment:
+                comment = preview(comment, COMMENT_PREVIEW_LENGTH)
+            movie_info += f'\nРейтинг: {rating}'
+            movie_info += f'\nКомментарий: {comment}'
         else:
             movie_info += '\nРецензия отсутствует.'
         movies_info.append(movie_info)
 
     return '\n\n'.join(movies_info)
 
-async def get_movies_and_reviews(session: AsyncSession, telegram_id: int):
-    user = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
-    movies = await session.scalars(select(Movie).filter_by(user_id=user.id))
-    if not movies:
-        return [], user
-    result = []
-    for movie in movies:
-        review = await session.scalar(select(Review).filter_by(movie_id=movie.id))
-        result.append((movie, review))
-    return result, user
\ No newline at end of file
+
+async def keyset_page(session: AsyncSession, query, after_id: Optional[int], before_id: Optional[int], limit: int):
+    """Страница запроса по курсору Movie.id: after_id листает вперёд, before_id — назад.
+
+    Возвращает (rows, has_prev, has_next).
+    """
+    if before_id is not None:
+        query = query.where(Movie.id < before_id).order_by(Movie.id.desc())
+    else:
+        if after_id is not None:
+            query = query.where(Movie.id > after_id)
+        query = query.order_by(Movie.id)
+
+    rows = (await session.execute(query.limit(limit + 1))).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if before_id is not None:
+        rows.reverse()
+        return rows, has_more, True
+    return rows, after_id is not None, has_more
+
+
+async def get_movies_and_reviews(session: AsyncSession, telegram_id: int, after_id: Optional[int] = None,
+                                 before_id: Optional[int] = None, limit: int = MOVIES_PAGE_SIZE):
+    """Одна страница фильмов пользователя с рецензиями.
+
+    Возвращает (rows, has_prev, has_next), где rows — кортежи (id, title, year, rating, comment).
+    """
+    user_id = await get_user_id(session, telegram_id)
+    if user_id is None:
+        return [], False, False
+    query = (
+        select(Movie.id, CatalogMovie.title, Movie.year, Review.rating, Review.comment)
+        .join(Movie.catalog)
+        .outerjoin(Review, Review.movie_id == Movie.id)
+        .where(Movie.user_id == user_id)
+    )
+    return await keyset_page(session, query, after_id, before_id, limit)
+
+
+async def get_movies_page(session: AsyncSession, telegram_id: int, after_id: Optional[int] = None,
+                          before_id: Optional[int] = None):
+    """Отрисованная страница списка фильмов: (text, first_id, last_id, has_prev, has_next).
+
+    Страницы кэшируются в page_cache и сбрасываются при любом изменении фильмов
+    или рецензий пользователя, поэтому повторный просмотр не обращается к базе.
+    Страница, прочитанная с реплики, могла отстать, поэтому живёт в кэше не
+    дольше REPLICA_STICKY_SECONDS — границы отставания, на которую рассчитан
+    роутинг, — а не весь PAGE_CACHE_TTL.
+    """
+    key = (telegram_id, after_id, before_id)
+    page = page_cache.get(key)
+    if page is None:
+        rows, has_prev, has_next = await get_movies_and_reviews(session, telegram_id, after_id=after_id,
+                                                                before_id=before_id)
+        first_id = rows[0].id if rows else None
+        last_id = rows[-1].id if rows else None
+        page = (await format_movies_info(rows), first_id, last_id, has_prev, has_next)
+        page_cache.set(key, page, ttl=REPLICA_STICKY_SECONDS if read_replica(session) else None)
+    return page
+
+
+async def get_movie_titles(session: AsyncSession, telegram_id: int, after_id: Optional[int] = None,
+                           before_id: Optional[int] = None, limit: int = MOVIES_PAGE_SIZE):
+    """Страница (id, title) фильмов пользователя для клавиатуры выбора."""
+    user_id = await get_user_id(session, telegram_id)
+    if user_id is None:
+        return [], False, False
+    query = select(Movie.id, CatalogMovie.title).join(Movie.catalog).where(Movie.user_id == user_id)
+    return await keyset_page(session, query, after_id, before_id, limit)
+
+
+async def get_user_movie(session: AsyncSession, telegram_id: int, movie_id: int) -> Optional[Movie]:
+    """Фильм по первичному ключу, только если он принадлежит пользователю."""
+    user_id = await get_user_id(session, telegram_id)
+    if user_id is None:
+        return None
+    movie = await session.get(Movie, movie_id)
+    if movie is None or movie.user_id != user_id:
+        return None
+    return movie
+
+
+async def get_movie_review(session: AsyncSession, telegram_id: int, movie_id: int) -> Optional[Review]:
+    user_id = await get_user_id(session, telegram_id)
+    if user_id is None:
+        return None
+    return await session.scalar(select(Review).filter_by(movie_id=movie_id, user_id=user_id))
+
+
+async def update_review(session: AsyncSession, telegram_id: int, movie_id: int, rating: int, comment: str) -> bool:
+    use_primary(session, telegram_id)
+    user_id = await get_user_id(session, telegram_id)
+    if user_id is None:
+        return False
+    try:
+        current = (await session.execute(
+            select(Movie.catalog_id, Review.rating).join(Review, Review.movie_id == Movie.id)
+            .where(Review.movie_id == movie_id, Review.user_id == user_id)
+            .with_for_update(of=Review))).first()
+        if current is None:
+            return False
+        await session.execute(
+            update(Review).filter_by(movie_id=movie_id, user_id=user_id).values(rating=rating, comment=comment))
+        await apply_rating_changes(session, [RatingChange(user_id, current.catalog_id, current.rating, rating)])
+        invalidate_pages(session, telegram_id)
+        logger.debug('Обновили рецензию пользователя с Telegram ID %s', telegram_id)
+        return True
+    except SQLAlchemyError as e:
+        logger.error('Ошибка при обновлении рецензии: %s', e)
+        await session.rollback()
+        return False
+
+
+async def delete_movie(session: AsyncSession, telegram_id: int, movie_id: int) -> bool:
+    use_primary(session, telegram_id)
+    user_id = await get_user_id(session, telegram_id)
+    if user_id is None:
+        return False
+    try:
+        movie = (await session.execute(
+            select(Movie.catalog_id, Review.rating).outerjoin(Review, Review.movie_id == Movie.id)
+            .where(Movie.id == movie_id, Movie.user_id == user_id)
+            .with_for_update(of=Movie))).first()
+        if movie is None:
+            return False
+        await session.execute(delete(Movie).filter_by(id=movie_id, user_id=user_id))
+        # На PostgreSQL рецензию удалит ON DELETE CASCADE, в SQLite внешние ключи не проверяются.
+        await session.execute(delete(Review).filter_by(movie_id=movie_id))
+        if movie.rating is not None:
+            await apply_rating_changes(session, [RatingChange(user_id, movie.catalog_id, movie.rating, None)])
+        invalidate_pages(session, telegram_id)
+        logger.debug('Удалили фильм %s пользователя с Telegram ID %s', movie_id, telegram_id)
+        return True
+    except SQLAlchemyError as e:
+        logger.error('Ошибка при удалении фильма: %s', e)
+        await session.rollback()
+        return False
+
+
+TOP_RATED_LIMIT = 10
+
+
+def format_user_stats(stats: Optional[UserStats]) -> str:
+    if stats is None or not stats.review_count:
+        return 'У вас пока нет рецензий.'
+    lines = [f'Рецензий: {stats.review_count}', f'Средняя оценка: {stats.rating_average:.2f}', '']
+    largest = max(getattr(stats, f'rating_{rating}') for rating in range(1, 6))
+    for rating in range(5, 0, -1):
+        count = getattr(stats, f'rating_{rating}')
+        bar = '█' * round(10 * count / largest) if largest else ''
+        lines.append(' '.join(part for part in (f'{rating} ★', bar, str(count)) if part))
+    return '\n'.join(lines)
+
+
+def format_top_rated(rows) -> str:
+    if not rows:
+        return 'Пока недостаточно оценок для рейтинга.'
+    return '\n'.join(f'{place}. {title} — {rating_avg:.2f} ({review_count} оц.)'
+                     for place, (title, rating_avg, review_count) in enumerate(rows, 1))
+
+
+async def get_user_stats(session: AsyncSession, telegram_id: int) -> Optional[UserStats]:
+    user_id = await get_user_id(session, telegram_id)
+    if user_id is None:
+        return None
+    return await session.get(UserStats, user_id)
+
+
+async def get_top_rated(session: AsyncSession, limit: int = TOP_RATED_LIMIT,
+                        min_reviews: int = TOP_RATED_MIN_REVIEWS):
+    """Фильмы каталога с лучшей средней оценкой: кортежи (title, rating_avg, review_count)."""
+    return (await session.execute(
+        select(CatalogMovie.title, CatalogStats.rating_avg, CatalogStats.review_count)
+        .join(CatalogMovie, CatalogMovie.id == CatalogStats.catalog_id)
+        .where(CatalogStats.rating_avg.is_not(None), CatalogStats.review_count >= min_reviews)
+        .order_by(CatalogStats.rating_avg.desc(), CatalogStats.review_count.desc())
+        .limit(limit))).all()
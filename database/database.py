@@ -1,8 +1,105 @@
+import asyncio
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import declarative_base
-from config import DATABASE_URL
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.util import await_only
+from config import (DATABASE_URL, DATABASE_REPLICA_URL, DB_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_PRE_PING,
+                    DB_POOL_RECYCLE, DB_STATEMENT_CACHE_SIZE, DB_SQLITE_BUSY_TIMEOUT_MS, DB_AUTO_MIGRATE)
+
+
+def engine_options(url):
+    options = {'echo': DB_ECHO}
+    if url.get_backend_name() != 'sqlite':
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_pre_ping=DB_POOL_PRE_PING,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return options
+
+
+def build_url(database_url):
+    url = make_url(database_url)
+    if url.get_driver_name() == 'asyncpg' and 'prepared_statement_cache_size' not in url.query:
+        url = url.update_query_dict({'prepared_statement_cache_size': str(DB_STATEMENT_CACHE_SIZE)})
+    return url
+
+
+database_url = build_url(DATABASE_URL)
+engine = create_async_engine(database_url, **engine_options(database_url))
+
+replica_url = build_url(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else None
+replica_engine = create_async_engine(replica_url, **engine_options(replica_url)) if replica_url else None
+
+
+class SQLiteWriters:
+    """Очередь пишущих транзакций процесса к SQLite.
+
+    SQLite пропускает одного писателя, а busy_timeout ждёт блокировку опросом
+    без очереди: при сотне одновременных апдейтов часть писателей проигрывает
+    новичкам дольше таймаута. Поэтому пишущие сессии процесса встают в
+    asyncio.Lock (FIFO) перед BEGIN IMMEDIATE и выходят из него в конце
+    транзакции. Между процессами по-прежнему действует busy_timeout.
+    """
+
+    def __init__(self):
+        self.lock = None
+        self.loop = None
+        self.owner = None
+
+    def acquire(self, session: Session):
+        """Вызывается из синхронного кода сессии внутри AsyncSession."""
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop, self.lock, self.owner = loop, asyncio.Lock(), None
+        task = asyncio.current_task()
+        if self.owner is task:
+            # Вторая пишущая сессия той же задачи: очередь её не спасёт, ждёт busy_timeout.
+            return
+        await_only(self.lock.acquire())
+        self.owner = task
+        session.info['sqlite_writer'] = self.lock
+
+    def release(self, session: Session):
+        lock = session.info.pop('sqlite_writer', None)
+        if lock is not None:
+            self.owner = None
+            lock.release()
+
+
+sqlite_writers = SQLiteWriters()
+
+
+if database_url.get_backend_name() == 'sqlite':
+    @event.listens_for(engine.sync_engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={DB_SQLITE_BUSY_TIMEOUT_MS:d}')
+        cursor.close()
+
+    @event.listens_for(Session, 'after_begin')
+    def begin_sqlite_writes(session, transaction, connection):
+        """Сессия записи (use_primary до первого запроса) начинается с BEGIN IMMEDIATE.
+
+        Иначе драйвер открывает транзакцию только перед первой записью, и
+        прочитанное до неё (старая оценка, счётчики статистики) могло успеть
+        устареть. В процессе писатели ждут очереди sqlite_writers, между
+        процессами — PRAGMA busy_timeout.
+        """
+        if session.info.get('write') and connection.engine is engine.sync_engine:
+            sqlite_writers.acquire(session)
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+    @event.listens_for(Session, 'after_transaction_end')
+    def release_sqlite_writer(session, transaction):
+        if transaction.parent is None:
+            sqlite_writers.release(session)
+
 
-engine = create_async_engine(DATABASE_URL, echo=True)
 AsyncSessionLocal = async_sessionmaker(
     bind=engine,
     class_=AsyncSession,
@@ -11,6 +108,10 @@ AsyncSessionLocal = async_sessionmaker(
 
 Base = declarative_base()
 
-async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+async def init_db(auto_migrate: bool = DB_AUTO_MIGRATE):
+    from .migrations import migrate, verify
+
+    if auto_migrate:
+        await migrate(engine)
+    else:
+        await verify(engine)
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from config import (FSM_STORAGE, FSM_STATE_TTL, FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL, FSM_FLUSH_BATCH,
+                    FSM_SWEEP_INTERVAL, REDIS_URL)
+from .cache import LRUCache
+from .database import AsyncSessionLocal
+from .models import FSMRecord
+from .upsert import conflict_insert
+
+logger = logging.getLogger(__name__)
+
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class SQLStorage(BaseStorage):
+    """FSM-хранилище в таблице fsm_states.
+
+    Записи сначала попадают в локальный кэш и пачкой сбрасываются в базу раз в
+    flush_interval или при накоплении flush_batch ключей. Чтение идёт через кэш.
+    Брошенные сценарии удаляются фоновой задачей по истечении ttl.
+    Кэш локален для процесса, поэтому апдейты одного пользователя должны
+    обрабатываться одним процессом.
+    """
+
+    def __init__(self, session_pool: async_sessionmaker, key_builder: Optional[KeyBuilder] = None,
+                 ttl: int = FSM_STATE_TTL, cache_size: int = FSM_CACHE_SIZE,
+                 flush_interval: float = FSM_FLUSH_INTERVAL, flush_batch: int = FSM_FLUSH_BATCH,
+                 sweep_interval: float = FSM_SWEEP_INTERVAL):
+        self.session_pool = session_pool
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.sweep_interval = sweep_interval
+        self.cache = LRUCache(maxsize=cache_size, ttl=ttl)
+        self._pending: Dict[str, Record] = {}
+        self._flushing: Dict[str, Record] = {}
+        self._flush_lock = asyncio.Lock()
+        self._tasks = []
+
+    def _start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._flusher()), asyncio.create_task(self._sweeper())]
+
+    async def _read(self, key: StorageKey) -> Record:
+        storage_key = self.key_builder.build(key)
+        record = self._pending.get(storage_key) or self._flushing.get(storage_key) or self.cache.get(storage_key)
+        if record is None:
+            async with self.session_pool() as session:
+                row = await session.scalar(select(FSMRecord).where(
+                    FSMRecord.key == storage_key, FSMRecord.expires_at > utcnow()))
+            record = (row.state, row.data) if row else (None, {})
+            self.cache.set(storage_key, record)
+        return record
+
+    async def _write(self, key: StorageKey, record: Record):
+        self._start()
+        storage_key = self.key_builder.build(key)
+        self.cache.set(storage_key, record)
+        self._pending[storage_key] = record
+        if len(self._pending) >= self.flush_batch:
+            await self.flush()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self._read(key)
+        await self._write(key, (state.state if isinstance(state, State) else state, data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._read(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _ = await self._read(key)
+        await self._write(key, (state, data.copy()))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._read(key)
+        return data.copy()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            self._flushing = pending
+            expires_at = utcnow() + timedelta(seconds=self.ttl)
+            upserts = [dict(key=key, state=state, data=data, expires_at=expires_at)
+                       for key, (state, data) in pending.items() if state is not None or data]
+            deletes = [key for key, (state, data) in pending.items() if state is None and not data]
+            try:
+                async with self.session_pool() as session:
+                    async with session.begin():
+                        if deletes:
+                            await session.execute(delete(FSMRecord).where(FSMRecord.key.in_(deletes)))
+                        if upserts:
+                            await self._upsert(session, upserts)
+            except Exception as e:
+                logger.error('Ошибка при сохранении состояний FSM: %s', e)
+                self._pending = {**pending, **self._pending}
+            finally:
+                self._flushing = {}
+
+    async def _upsert(self, session, rows):
+        stmt = conflict_insert(session, FSMRecord)
+        if stmt is not None:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[FSMRecord.key],
+                set_=dict(state=stmt.excluded.state, data=stmt.excluded.data, expires_at=stmt.excluded.expires_at),
+            )
+            await session.execute(stmt, rows)
+        else:
+            for row in rows:
+                await session.merge(FSMRecord(**row))
+
+    async def sweep(self) -> int:
+        async with self.session_pool() as session:
+            async with session.begin():
+                result = await session.execute(delete(FSMRecord).where(FSMRecord.expires_at <= utcnow()))
+        if result.rowcount:
+            logger.info('Удалено %d просроченных состояний FSM', result.rowcount)
+        return result.rowcount
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def _sweeper(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error('Ошибка при очистке состояний FSM: %s', e)
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+
+
+def create_fsm_storage(backend: str = FSM_STORAGE, redis=None) -> BaseStorage:
+    """Хранилище FSM по имени: memory, sql или redis.
+
+    Для redis можно передать готовый клиент, например локальную замену в тестах.
+    """
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'sql':
+        return SQLStorage(AsyncSessionLocal)
+    if backend == 'redis':
+        from aiogram.fsm.storage.redis import RedisStorage
+        if redis is not None:
+            return RedisStorage(redis=redis, state_ttl=FSM_STATE_TTL, data_ttl=FSM_STATE_TTL)
+        return RedisStorage.from_url(REDIS_URL, state_ttl=FSM_STATE_TTL, data_ttl=FSM_STATE_TTL)
+    raise ValueError(f'Неизвестное хранилище FSM: {backend}')
@@ -0,0 +1,122 @@
+"""Групповой коммит вставок.
+
+Вставки из параллельных апдейтов копятся DB_GROUP_COMMIT_WINDOW_MS миллисекунд
+(или до DB_GROUP_COMMIT_MAX_BATCH строк) и записываются одним многострочным
+INSERT … RETURNING в одной транзакции. Каждый вызов insert() получает свою
+сохранённую строку или исключение: если пачка не прошла, строки повторяются
+по одной, чтобы ошибка досталась только виновнику. Хуки before_insert и
+after_insert выполняются в той же транзакции, что и вставка пачки.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from config import DB_GROUP_COMMIT, DB_GROUP_COMMIT_WINDOW_MS, DB_GROUP_COMMIT_MAX_BATCH
+from .database import AsyncSessionLocal
+from .routing import use_primary
+
+logger = logging.getLogger(__name__)
+
+PendingInsert = Tuple[type, Dict[str, Any], asyncio.Future]
+InsertHook = Callable[[AsyncSession, list], Awaitable[None]]
+ValuesHook = Callable[[AsyncSession, List[Dict[str, Any]]], Awaitable[None]]
+
+
+class GroupCommitWriter:
+    def __init__(self, session_pool: async_sessionmaker, window_ms: float = DB_GROUP_COMMIT_WINDOW_MS,
+                 max_batch: int = DB_GROUP_COMMIT_MAX_BATCH):
+        self.session_pool = session_pool
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.pending: List[PendingInsert] = []
+        self.flusher: Optional[asyncio.Task] = None
+        self.batch_full: Optional[asyncio.Event] = None
+        self.hooks: Dict[type, List[InsertHook]] = {}
+        self.before_hooks: Dict[type, List[ValuesHook]] = {}
+        self.commits = 0
+        self.rows = 0
+
+    def before_insert(self, model: type, hook: ValuesHook):
+        """hook(session, values) может дополнить значения строк model перед вставкой пачки.
+
+        Хук получает копии значений: при повторе по одной он увидит исходные.
+        """
+        self.before_hooks.setdefault(model, []).append(hook)
+
+    def after_insert(self, model: type, hook: InsertHook):
+        """hook(session, rows) вызывается с сохранёнными строками model до коммита пачки."""
+        self.hooks.setdefault(model, []).append(hook)
+
+    async def insert(self, model: type, values: Dict[str, Any]):
+        """Ставит строку в ближайшую пачку и возвращает сохранённый объект модели."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((model, values, future))
+        if self.flusher is None or self.flusher.done():
+            self.batch_full = asyncio.Event()
+            self.flusher = asyncio.create_task(self._run())
+        elif len(self.pending) >= self.max_batch:
+            self.batch_full.set()
+        return await future
+
+    async def _run(self):
+        try:
+            await asyncio.wait_for(self.batch_full.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        # Пока пишется одна пачка, копится следующая: её пишем сразу, без ожидания окна.
+        while self.pending:
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            self.batch_full.clear()
+            await self._commit(batch)
+
+    async def _commit(self, batch: List[PendingInsert]):
+        try:
+            rows = await self._write(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                future = batch[0][2]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            logger.warning('Пачка из %d вставок не записана (%s), повторяю по одной', len(batch), e)
+            for item in batch:
+                await self._commit([item])
+            return
+        for (_, _, future), row in zip(batch, rows):
+            if not future.done():
+                future.set_result(row)
+
+    async def _write(self, batch: List[PendingInsert]) -> list:
+        positions: Dict[type, List[int]] = {}
+        for index, (model, _, _) in enumerate(batch):
+            positions.setdefault(model, []).append(index)
+
+        rows = [None] * len(batch)
+        async with self.session_pool() as session:
+            use_primary(session)
+            async with session.begin():
+                for model, indexes in positions.items():
+                    values = [dict(batch[index][1]) for index in indexes]
+                    for hook in self.before_hooks.get(model, ()):
+                        await hook(session, values)
+                    created = (await session.scalars(
+                        insert(model).returning(model, sort_by_parameter_order=True), values)).all()
+                    for index, row in zip(indexes, created):
+                        rows[index] = row
+                    for hook in self.hooks.get(model, ()):
+                        await hook(session, created)
+        self.commits += 1
+        self.rows += len(batch)
+        return rows
+
+    async def close(self):
+        if self.flusher is not None:
+            await self.flusher
+
+    def stats(self) -> dict:
+        return {'commits': self.commits, 'rows': self.rows,
+                'rows_per_commit': self.rows / self.commits if self.commits else 0.0}
+
+
+group_commit = GroupCommitWriter(AsyncSessionLocal) if DB_GROUP_COMMIT else None
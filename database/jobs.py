@@ -0,0 +1,182 @@
+"""Задания массовых рассылок.
+
+Задание — строка jobs с курсором по users.id. Исполнитель берёт задание в
+аренду (lease_owner, lease_until) и проходит пользователей пачками по
+возрастанию id: одна пачка — один запрос к users, а для дайджеста — один
+запрос, собирающий непрорецензированные фильмы сразу всех пользователей пачки.
+
+Курсор сдвигается и фиксируется до того, как сообщения пачки уходят в
+очередь отправки. После падения процесса другой исполнитель дождётся конца
+аренды и продолжит со следующей пачки — уже отправленное не повторяется, но
+сообщения пачки, на которой процесс упал, могут не дойти. При штатной
+остановке курсор возвращается к последнему поставленному в очередь
+пользователю, и остаток пачки достаётся следующему исполнителю.
+
+    python -m database.jobs announce "Текст объявления"
+    python -m database.jobs status
+"""
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import DIGEST_TITLES
+from .database import AsyncSessionLocal, engine
+from .fsm_storage import utcnow
+from .models import CatalogMovie, Job, Movie, Review, User
+from .upsert import conflict_insert
+
+logger = logging.getLogger(__name__)
+
+ANNOUNCEMENT = 'announcement'
+UNREVIEWED_DIGEST = 'unreviewed_digest'
+
+# (users.id, chat_id, текст)
+Message = Tuple[int, int, str]
+
+
+async def create_job(session: AsyncSession, kind: str, key: str, payload: Optional[dict] = None) -> bool:
+    """Создаёт задание, если задания с таким key ещё нет; True — создано."""
+    values = {'kind': kind, 'key': key, 'payload': payload or {}}
+    stmt = conflict_insert(session, Job)
+    if stmt is not None:
+        result = await session.execute(stmt.values(values).on_conflict_do_nothing(index_elements=[Job.key]))
+        return bool(result.rowcount)
+    if await session.scalar(select(Job.id).where(Job.key == key)) is not None:
+        return False
+    session.add(Job(**values))
+    await session.flush()
+    return True
+
+
+def digest_key(interval_days: float, now: Optional[float] = None) -> str:
+    """Ключ дайджеста текущего периода: один дайджест на период, сколько бы процессов ни работало."""
+    period = int((time.time() if now is None else now) // (interval_days * 24 * 3600))
+    return f'{UNREVIEWED_DIGEST}:{period}'
+
+
+def lease_free():
+    return or_(Job.lease_until.is_(None), Job.lease_until < utcnow())
+
+
+async def claim_job(session: AsyncSession, owner: str, lease_seconds: float) -> Optional[Job]:
+    """Берёт в аренду самое старое незавершённое задание без действующей аренды."""
+    job_id = await session.scalar(
+        select(Job.id).where(Job.status != 'done', lease_free()).order_by(Job.id).limit(1))
+    if job_id is None:
+        return None
+    # Условие аренды повторяется в UPDATE: из двух процессов задание достанется одному.
+    result = await session.execute(
+        update(Job).where(Job.id == job_id, Job.status != 'done', lease_free())
+        .values(status='running', lease_owner=owner, lease_until=utcnow() + timedelta(seconds=lease_seconds)))
+    if not result.rowcount:
+        return None
+    return await session.get(Job, job_id, populate_existing=True)
+
+
+async def checkpoint(session: AsyncSession, job_id: int, owner: str, cursor: int, sent: int,
+                     lease_seconds: float) -> bool:
+    """Сдвигает курсор и продлевает аренду; False — аренду перехватил другой процесс."""
+    result = await session.execute(
+        update(Job).where(Job.id == job_id, Job.lease_owner == owner)
+        .values(cursor=cursor, sent=sent, lease_until=utcnow() + timedelta(seconds=lease_seconds)))
+    return bool(result.rowcount)
+
+
+async def finish_job(session: AsyncSession, job_id: int, owner: str, sent: int) -> bool:
+    result = await session.execute(
+        update(Job).where(Job.id == job_id, Job.lease_owner == owner)
+        .values(status='done', sent=sent, lease_owner=None, lease_until=None, finished_at=utcnow()))
+    return bool(result.rowcount)
+
+
+async def release_job(session: AsyncSession, job_id: int, owner: str):
+    """Снимает аренду при штатной остановке, чтобы задание сразу продолжил другой процесс."""
+    await session.execute(
+        update(Job).where(Job.id == job_id, Job.lease_owner == owner, Job.status != 'done')
+        .values(lease_owner=None, lease_until=None))
+
+
+async def user_batch(session: AsyncSession, after: int, limit: int) -> List[Tuple[int, int]]:
+    """(id, telegram_id) следующих limit пользователей с id больше after."""
+    return (await session.execute(
+        select(User.id, User.telegram_id).where(User.id > after).order_by(User.id).limit(limit))).all()
+
+
+def unreviewed_query(after: int, until: int, titles: int):
+    """Фильмы без рецензии у пользователей с id в (after, until]: по titles последних на пользователя и их число."""
+    unreviewed = (
+        select(Movie.user_id, CatalogMovie.title,
+               func.row_number().over(partition_by=Movie.user_id, order_by=Movie.id.desc()).label('position'),
+               func.count().over(partition_by=Movie.user_id).label('total'))
+        .join(CatalogMovie, CatalogMovie.id == Movie.catalog_id)
+        .outerjoin(Review, Review.movie_id == Movie.id)
+        .where(Movie.user_id > after, Movie.user_id <= until, Review.id.is_(None))
+        .subquery())
+    return (select(User.id, User.telegram_id, unreviewed.c.total, unreviewed.c.title)
+            .join(unreviewed, unreviewed.c.user_id == User.id)
+            .where(unreviewed.c.position <= titles)
+            .order_by(User.id, unreviewed.c.position))
+
+
+def format_digest(total: int, titles: List[str]) -> str:
+    lines = [f'Фильмы без рецензии: {total}'] + [f'• {title}' for title in titles]
+    if total > len(titles):
+        lines.append(f'…и ещё {total - len(titles)}')
+    lines.append('Поделитесь впечатлениями — «🗒️ Добавить рецензию».')
+    return '\n'.join(lines)
+
+
+async def unreviewed_digests(session: AsyncSession, after: int, until: int,
+                             titles: int = DIGEST_TITLES) -> List[Message]:
+    digests: Dict[Tuple[int, int], Tuple[int, List[str]]] = {}
+    for user_id, telegram_id, total, title in await session.execute(unreviewed_query(after, until, titles)):
+        digests.setdefault((user_id, telegram_id), (total, []))[1].append(title)
+    return [(user_id, telegram_id, format_digest(total, movie_titles))
+            for (user_id, telegram_id), (total, movie_titles) in digests.items()]
+
+
+async def batch_messages(session: AsyncSession, job: Job, after: int,
+                         limit: int) -> Tuple[List[Message], Optional[int]]:
+    """Сообщения для следующей пачки пользователей и новый курсор; курсор None — пользователи кончились."""
+    users = await user_batch(session, after, limit)
+    if not users:
+        return [], None
+    until = users[-1][0]
+    if job.kind == ANNOUNCEMENT:
+        return [(user_id, telegram_id, job.payload['text']) for user_id, telegram_id in users], until
+    if job.kind == UNREVIEWED_DIGEST:
+        return await unreviewed_digests(session, after, until, job.payload.get('titles', DIGEST_TITLES)), until
+    raise ValueError(f'Неизвестный тип задания: {job.kind}')
+
+
+async def main(args):
+    try:
+        async with AsyncSessionLocal() as session:
+            if args.command == 'announce':
+                key = args.key or f'{ANNOUNCEMENT}:{uuid.uuid4().hex}'
+                created = await create_job(session, ANNOUNCEMENT, key, {'text': args.text})
+                await session.commit()
+                print(f'Задание {key} создано' if created else f'Задание {key} уже есть')
+                return
+            last_user = await session.scalar(select(func.max(User.id))) or 0
+            for job in await session.scalars(select(Job).order_by(Job.id)):
+                print(f'{job.key}: {job.status}, отправлено {job.sent}, '
+                      f'пройдено до id {job.cursor} из {last_user}')
+    finally:
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Массовые рассылки')
+    commands = parser.add_subparsers(dest='command', required=True)
+    announce = commands.add_parser('announce', help='разослать объявление всем пользователям')
+    announce.add_argument('text')
+    announce.add_argument('--key', help='ключ задания: повторный запуск с тем же ключом ничего не создаст')
+    commands.add_parser('status', help='состояние заданий')
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,244 @@
+"""Версионированные миграции схемы.
+
+Каждая миграция применяется в своей транзакции и записывается в
+schema_migrations. Миграции идемпотентны: на новой базе baseline создаёт
+таблицы по текущим моделям, а следующие шаги ничего не меняют.
+
+    python -m database.migrations status
+    python -m database.migrations upgrade
+"""
+import argparse
+import asyncio
+import logging
+from sqlalchemy import (Column, DateTime, Integer, MetaData, String, Table, bindparam, delete, func, insert, inspect,
+                        select, text, update)
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+from config import DB_DEDUPLICATE_REVIEWS
+from .catalog import CATALOG_BATCH_SIZE, insert_missing, normalize_title
+from .stats import COUNTERS, catalog_aggregates, user_aggregates
+from .database import Base, engine
+from . import models  # noqa: F401  регистрирует модели в Base.metadata
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_LOCK_ID = 0x6D6F766965
+BACKFILL_BATCH_SIZE = 5000
+
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('name', String, nullable=False),
+    Column('applied_at', DateTime, server_default=func.now()),
+)
+
+# movies в том виде, в каком она была до movie_catalog: модель Movie уже без title.
+legacy_movies = Table(
+    'movies', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('title', String),
+    Column('catalog_id', Integer),
+)
+
+
+async def execute_all(conn: AsyncConnection, statements):
+    for statement in statements:
+        await conn.execute(text(statement))
+
+
+async def has_column(conn: AsyncConnection, table: str, column: str) -> bool:
+    columns = await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_columns(table))
+    return any(info['name'] == column for info in columns)
+
+
+async def baseline(conn: AsyncConnection):
+    await conn.run_sync(Base.metadata.create_all)
+
+
+async def search_indexes(conn: AsyncConnection):
+    # На базе, созданной после movie_catalog, названий в movies нет: индекс строит шаг 4.
+    if conn.dialect.name == 'postgresql' and await has_column(conn, 'movies', 'title'):
+        await execute_all(conn, [
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            'CREATE EXTENSION IF NOT EXISTS btree_gin',
+            'CREATE INDEX IF NOT EXISTS ix_movies_user_title_trgm ON movies USING gin (user_id, title gin_trgm_ops)',
+        ])
+
+
+async def deduplicate_reviews(conn: AsyncConnection, allowed: bool = DB_DEDUPLICATE_REVIEWS):
+    """Перед уникальным индексом по reviews.movie_id оставляет у фильма только последнюю рецензию.
+
+    Без явного DB_DEDUPLICATE_REVIEWS=true миграция останавливается и ничего не удаляет.
+    """
+    reviews = models.Review.__table__
+    duplicates = (await conn.execute(
+        select(reviews.c.id, reviews.c.movie_id)
+        .where(reviews.c.id.not_in(select(func.max(reviews.c.id)).group_by(reviews.c.movie_id)))
+        .order_by(reviews.c.movie_id, reviews.c.id))).all()
+    if not duplicates:
+        return
+    movie_ids = sorted({movie_id for _, movie_id in duplicates})
+    if not allowed:
+        raise RuntimeError(
+            f'У {len(movie_ids)} фильмов несколько рецензий ({len(duplicates)} лишних), например у movie_id '
+            f'{", ".join(map(str, movie_ids[:20]))}. Уникальный индекс требует одну рецензию на фильм. '
+            f'Проверьте данные или запустите DB_DEDUPLICATE_REVIEWS=true python -m database.migrations upgrade — '
+            f'у каждого фильма останется рецензия с наибольшим id, остальные будут удалены')
+    review_ids = [review_id for review_id, _ in duplicates]
+    for start in range(0, len(review_ids), BACKFILL_BATCH_SIZE):
+        await conn.execute(delete(reviews).where(reviews.c.id.in_(review_ids[start:start + BACKFILL_BATCH_SIZE])))
+    logger.warning('Удалено %d повторных рецензий у %d фильмов; id рецензий: %s; movie_id: %s',
+                   len(review_ids), len(movie_ids), review_ids, movie_ids)
+
+
+async def hot_query_indexes(conn: AsyncConnection):
+    if await has_column(conn, 'movies', 'title'):
+        await execute_all(conn, ['CREATE INDEX IF NOT EXISTS ix_movies_user_id_title ON movies (user_id, title)'])
+    await deduplicate_reviews(conn)
+    await execute_all(conn, [
+        'CREATE INDEX IF NOT EXISTS ix_movies_user_id_id ON movies (user_id, id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_reviews_movie_id ON reviews (movie_id)',
+        'CREATE INDEX IF NOT EXISTS ix_reviews_user_id ON reviews (user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_fsm_states_expires_at ON fsm_states (expires_at)',
+    ])
+
+
+async def backfill_catalog(conn: AsyncConnection):
+    """Заполняет movies.catalog_id по названиям, пачками по id."""
+    catalog = models.CatalogMovie.__table__
+    last_id = 0
+    async with AsyncSession(bind=conn) as session:
+        while True:
+            rows = (await conn.execute(
+                select(legacy_movies.c.id, legacy_movies.c.title).where(legacy_movies.c.id > last_id)
+                .order_by(legacy_movies.c.id).limit(BACKFILL_BATCH_SIZE))).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            keys = {row.id: normalize_title(row.title) for row in rows}
+            titles = {}
+            for row in rows:
+                titles.setdefault(keys[row.id], row.title.strip())
+            catalog_ids = await insert_missing(session, [{'title': title, 'normalized_title': key}
+                                                         for key, title in titles.items()])
+            pending = [key for key in titles if key not in catalog_ids]
+            for start in range(0, len(pending), CATALOG_BATCH_SIZE):
+                catalog_ids.update((await conn.execute(
+                    select(catalog.c.normalized_title, catalog.c.id)
+                    .where(catalog.c.normalized_title.in_(pending[start:start + CATALOG_BATCH_SIZE])))).all())
+            await conn.execute(
+                update(legacy_movies).where(legacy_movies.c.id == bindparam('movie_id'))
+                .values(catalog_id=bindparam('new_catalog_id')),
+                [{'movie_id': movie_id, 'new_catalog_id': catalog_ids[key]} for movie_id, key in keys.items()])
+
+
+async def movie_catalog(conn: AsyncConnection):
+    await conn.run_sync(models.CatalogMovie.__table__.create, checkfirst=True)
+    if await has_column(conn, 'movies', 'title'):
+        if not await has_column(conn, 'movies', 'catalog_id'):
+            await execute_all(conn, ['ALTER TABLE movies ADD COLUMN catalog_id INTEGER REFERENCES catalog_movies (id)'])
+        await backfill_catalog(conn)
+        await execute_all(conn, [
+            'DROP INDEX IF EXISTS ix_movies_user_id_title',
+            'DROP INDEX IF EXISTS ix_movies_user_title_trgm',
+            'ALTER TABLE movies DROP COLUMN title',
+        ])
+        # SQLite не умеет добавлять NOT NULL к существующему столбцу; там ограничение остаётся за моделью.
+        if conn.dialect.name == 'postgresql':
+            await execute_all(conn, ['ALTER TABLE movies ALTER COLUMN catalog_id SET NOT NULL'])
+    await execute_all(conn, ['CREATE INDEX IF NOT EXISTS ix_movies_user_id_catalog_id ON movies (user_id, catalog_id)'])
+    if conn.dialect.name == 'postgresql':
+        await execute_all(conn, [
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            'CREATE INDEX IF NOT EXISTS ix_catalog_movies_normalized_title_trgm '
+            'ON catalog_movies USING gin (normalized_title gin_trgm_ops)',
+        ])
+
+
+async def rating_stats(conn: AsyncConnection):
+    for model in (models.UserStats, models.CatalogStats):
+        await conn.run_sync(model.__table__.create, checkfirst=True)
+    await execute_all(conn, ['CREATE INDEX IF NOT EXISTS ix_movies_catalog_id ON movies (catalog_id)'])
+
+    user_stats, catalog_stats = models.UserStats.__table__, models.CatalogStats.__table__
+    if await conn.scalar(select(func.count()).select_from(user_stats)) == 0:
+        await conn.execute(insert(user_stats).from_select(['user_id', *COUNTERS], user_aggregates()))
+    if await conn.scalar(select(func.count()).select_from(catalog_stats)) == 0:
+        rating_avg = func.sum(models.Review.rating) * 1.0 / func.count(models.Review.id)
+        await conn.execute(insert(catalog_stats).from_select(
+            ['catalog_id', *COUNTERS, 'rating_avg'], catalog_aggregates().add_columns(rating_avg)))
+
+
+async def jobs(conn: AsyncConnection):
+    await conn.run_sync(models.Job.__table__.create, checkfirst=True)
+
+
+async def movie_year(conn: AsyncConnection):
+    if not await has_column(conn, 'movies', 'year'):
+        await execute_all(conn, ['ALTER TABLE movies ADD COLUMN year INTEGER'])
+
+
+MIGRATIONS = [
+    (1, 'baseline', baseline),
+    (2, 'search_indexes', search_indexes),
+    (3, 'hot_query_indexes', hot_query_indexes),
+    (4, 'movie_catalog', movie_catalog),
+    (5, 'rating_stats', rating_stats),
+    (6, 'jobs', jobs),
+    (7, 'movie_year', movie_year),
+]
+
+
+async def applied_versions(conn: AsyncConnection) -> set:
+    await conn.run_sync(schema_migrations.create, checkfirst=True)
+    return set(await conn.scalars(select(schema_migrations.c.version)))
+
+
+async def pending_migrations(db_engine: AsyncEngine = engine):
+    async with db_engine.begin() as conn:
+        applied = await applied_versions(conn)
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in applied]
+
+
+async def migrate(db_engine: AsyncEngine = engine):
+    applied_now = []
+    for version, name, upgrade in MIGRATIONS:
+        async with db_engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                await conn.execute(text('SELECT pg_advisory_xact_lock(:lock_id)'), {'lock_id': MIGRATION_LOCK_ID})
+            if version in await applied_versions(conn):
+                continue
+            logger.info('Применяю миграцию %s_%s', version, name)
+            await upgrade(conn)
+            await conn.execute(insert(schema_migrations).values(version=version, name=name))
+            applied_now.append((version, name))
+    return applied_now
+
+
+async def verify(db_engine: AsyncEngine = engine):
+    pending = await pending_migrations(db_engine)
+    if pending:
+        names = ', '.join(f'{version}_{name}' for version, name in pending)
+        raise RuntimeError(f'Схема базы устарела, не применены миграции: {names}. '
+                           f'Запустите python -m database.migrations upgrade')
+
+
+async def main(command: str):
+    try:
+        if command == 'upgrade':
+            applied = await migrate()
+            print('Применены: ' + ', '.join(f'{version}_{name}' for version, name in applied) if applied
+                  else 'Схема актуальна')
+        else:
+            pending = await pending_migrations()
+            for version, name, _ in MIGRATIONS:
+                mark = ' ' if (version, name) in pending else 'x'
+                print(f'[{mark}] {version}_{name}')
+    finally:
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Миграции схемы базы')
+    parser.add_argument('command', choices=['status', 'upgrade'])
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args().command))
@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import String, Integer, DateTime, Text, func, ForeignKey
+from sqlalchemy import String, Integer, DateTime, Float, Text, JSON, func, ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .database import Base
 
@@ -24,19 +24,38 @@ class User(BaseModel):
     reviews: Mapped[list['Review']] = relationship('Review', back_populates='user', cascade='all, delete-orphan')
 
 
+class CatalogMovie(BaseModel):
+    """Общий каталог фильмов: одна строка на нормализованное название."""
+    __tablename__ = 'catalog_movies'
+
+    title: Mapped[str] = mapped_column(String, nullable=False)
+    normalized_title: Mapped[str] = mapped_column(String, unique=True, nullable=False)
+
+
 class Movie(BaseModel):
     __tablename__ = 'movies'
+    __table_args__ = (
+        Index('ix_movies_user_id_catalog_id', 'user_id', 'catalog_id'),
+        Index('ix_movies_user_id_id', 'user_id', 'id'),
+        Index('ix_movies_catalog_id', 'catalog_id'),
+    )
 
-    title: Mapped[str] = mapped_column(String, nullable=False)
+    catalog_id: Mapped[int] = mapped_column(Integer, ForeignKey('catalog_movies.id'), nullable=False)
     description: Mapped[Optional[str]] = mapped_column(Text)
+    year: Mapped[Optional[int]] = mapped_column(Integer)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), nullable=False)
 
+    catalog: Mapped['CatalogMovie'] = relationship('CatalogMovie', lazy='joined')
     user: Mapped['User'] = relationship('User', back_populates='movies')
     review: Mapped[Optional['Review']] = relationship('Review', back_populates='movie', cascade='all, delete-orphan')
 
 
 class Review(BaseModel):
     __tablename__ = 'reviews'
+    __table_args__ = (
+        Index('ux_reviews_movie_id', 'movie_id', unique=True),
+        Index('ix_reviews_user_id', 'user_id'),
+    )
 
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), nullable=False)
     movie_id: Mapped[int] = mapped_column(Integer, ForeignKey('movies.id', ondelete='CASCADE'), nullable=False)
@@ -45,3 +64,62 @@ class Review(BaseModel):
 
     user: Mapped['User'] = relationship('User', back_populates='reviews')
     movie: Mapped['Movie'] = relationship('Movie', back_populates='review')
+
+
+class RatingStats:
+    """Счётчики оценок: число рецензий, сумма и распределение по 1–5."""
+
+    review_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    rating_sum: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    rating_1: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    rating_2: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    rating_3: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    rating_4: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    rating_5: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+
+    @property
+    def rating_average(self) -> Optional[float]:
+        return self.rating_sum / self.review_count if self.review_count else None
+
+
+class UserStats(RatingStats, Base):
+    __tablename__ = 'user_stats'
+
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+
+
+class CatalogStats(RatingStats, Base):
+    __tablename__ = 'catalog_stats'
+    __table_args__ = (
+        Index('ix_catalog_stats_rating_avg', 'rating_avg', 'review_count'),
+    )
+
+    catalog_id: Mapped[int] = mapped_column(Integer, ForeignKey('catalog_movies.id'), primary_key=True)
+    rating_avg: Mapped[Optional[float]] = mapped_column(Float)
+
+
+class Job(BaseModel):
+    """Массовая рассылка: курсор по users.id и аренда, чтобы после сбоя продолжить с места."""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_status', 'status'),
+    )
+
+    key: Mapped[str] = mapped_column(String, unique=True, nullable=False)
+    kind: Mapped[str] = mapped_column(String, nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
+    status: Mapped[str] = mapped_column(String, nullable=False, default='pending', server_default='pending')
+    cursor: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    sent: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    lease_owner: Mapped[Optional[str]] = mapped_column(String)
+    lease_until: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+
+class FSMRecord(Base):
+    __tablename__ = 'fsm_states'
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    state: Mapped[Optional[str]] = mapped_column(String)
+    data: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
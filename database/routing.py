@@ -0,0 +1,70 @@
+"""Чтение с реплики.
+
+Сессии из RoutedSessionLocal отправляют простые SELECT на реплику
+(DATABASE_REPLICA_URL), а записи, SELECT … FOR UPDATE и текстовые запросы —
+на основную базу. После первого такого запроса сессия до конца читает с
+основной базы, чтобы транзакция видела собственные изменения.
+
+Функции записи в crud вызывают use_primary() до первого чтения: решения,
+принятые по данным реплики (старая оценка, id из каталога), могли бы
+опираться на отставшие данные. Пользователь, который только что что-то
+записал, ещё REPLICA_STICKY_SECONDS читает с основной базы — так он сразу
+видит свои изменения, даже если реплика отстаёт.
+"""
+from typing import Optional
+from sqlalchemy import Select, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+from config import REPLICA_STICKY_SECONDS, REPLICA_STICKY_USERS
+from .cache import LRUCache
+from .database import AsyncSessionLocal, engine, replica_engine
+
+recent_writers = LRUCache(maxsize=REPLICA_STICKY_USERS, ttl=REPLICA_STICKY_SECONDS)
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if replica_engine is None or self.info.get('primary'):
+            return engine.sync_engine
+        if isinstance(clause, Select) and clause._for_update_arg is None:
+            return replica_engine.sync_engine
+        self.info['primary'] = True
+        return engine.sync_engine
+
+
+def use_primary(session: AsyncSession, telegram_id: Optional[int] = None):
+    """Дальше сессия работает только с основной базой; telegram_id — автор записи.
+
+    Вызванная до первого запроса, помечает сессию как пишущую: на SQLite её
+    транзакция начнётся с BEGIN IMMEDIATE.
+    """
+    session.info['primary'] = True
+    session.info['write'] = True
+    if telegram_id is not None and REPLICA_STICKY_SECONDS > 0:
+        recent_writers.set(telegram_id, True)
+        session.info.setdefault('writers', set()).add(telegram_id)
+
+
+def read_replica(session: AsyncSession) -> bool:
+    """Могли ли простые SELECT этой сессии уйти на реплику."""
+    return replica_engine is not None and not session.info.get('primary')
+
+
+def pin_recent_writer(session: AsyncSession, telegram_id: int):
+    if recent_writers.get(telegram_id) is not None:
+        session.info['primary'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def extend_sticky_window(session):
+    # Окно отсчитывается от коммита: до него реплика не могла получить запись.
+    for telegram_id in session.info.pop('writers', ()):
+        recent_writers.set(telegram_id, True)
+
+
+RoutedSessionLocal = async_sessionmaker(
+    bind=engine,
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    expire_on_commit=False,
+) if replica_engine is not None else AsyncSessionLocal
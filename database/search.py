@@ -0,0 +1,52 @@
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .catalog import normalize_title
+from .crud import get_user_id
+from .models import CatalogMovie, Movie
+
+SEARCH_LIMIT = 10
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+async def search_movies(session: AsyncSession, telegram_id: int, query: str, limit: int = SEARCH_LIMIT):
+    """Поиск фильмов пользователя по части названия, самые похожие — первыми.
+
+    Сравнение идёт по нормализованному названию из каталога, поэтому регистр,
+    ё/е и пунктуация не мешают найти фильм. Возвращает до limit кортежей (id, title).
+    """
+    query = normalize_title(query) if query.strip() else ''
+    if not query:
+        return []
+
+    user_id = await get_user_id(session, telegram_id)
+    if user_id is None:
+        return []
+    key = CatalogMovie.normalized_title
+    substring = key.like(f'%{escape_like(query)}%', escape='\\')
+    user_movies = select(Movie.id, CatalogMovie.title).join(Movie.catalog).where(Movie.user_id == user_id)
+
+    if session.bind.dialect.name == 'postgresql':
+        # Библиотека пользователя материализуется первой (индекс (user_id, catalog_id)
+        # и поиск по первичному ключу каталога), и триграммы сравниваются только с ней.
+        # Иначе планировщик может начать с триграммного индекса по всему каталогу,
+        # и короткий запрос переберёт названия всех пользователей.
+        library = user_movies.add_columns(key).cte('library').prefix_with('MATERIALIZED')
+        stmt = (
+            select(library.c.id, library.c.title)
+            .where(library.c.normalized_title.like(f'%{escape_like(query)}%', escape='\\')
+                   | library.c.normalized_title.op('%>')(query))
+            .order_by(func.word_similarity(query, library.c.normalized_title).desc(), library.c.id)
+        )
+    else:
+        # Без pg_trgm ищем подстроку среди фильмов пользователя: индекс (user_id, catalog_id)
+        # ограничивает просмотр его библиотекой, а не всем каталогом.
+        stmt = (
+            user_movies
+            .where(substring)
+            .order_by(func.instr(key, query), func.length(key), Movie.id)
+        )
+
+    return (await session.execute(stmt.limit(limit))).all()
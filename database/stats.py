@@ -0,0 +1,201 @@
+"""Сводная статистика оценок.
+
+user_stats и catalog_stats хранят число рецензий, сумму и распределение
+оценок по пользователю и по фильму каталога. Их меняет та же транзакция, что
+добавляет, редактирует или удаляет рецензию, поэтому /stats читает одну
+строку, а /top — начало индекса по средней оценке, не агрегируя reviews.
+
+Пересчёт с нуля идёт пачками по диапазонам id и сообщает о расхождениях:
+
+    python -m database.stats check
+    python -m database.stats rebuild
+"""
+import argparse
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, NamedTuple, Optional, Sequence
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from .database import AsyncSessionLocal, engine
+from .models import CatalogMovie, CatalogStats, Movie, Review, User, UserStats
+from .routing import use_primary
+from .upsert import conflict_insert
+
+logger = logging.getLogger(__name__)
+
+RATINGS = range(1, 6)
+COUNTERS = ('review_count', 'rating_sum') + tuple(f'rating_{rating}' for rating in RATINGS)
+STATS_BATCH_SIZE = 1000
+
+
+class RatingChange(NamedTuple):
+    """Оценка рецензии до и после изменения; None — рецензии нет."""
+    user_id: int
+    catalog_id: int
+    old: Optional[int]
+    new: Optional[int]
+
+
+def add_rating(delta: Dict[str, int], rating: Optional[int], sign: int):
+    if rating is None:
+        return
+    delta['review_count'] += sign
+    delta['rating_sum'] += sign * rating
+    if rating in RATINGS:
+        delta[f'rating_{rating}'] += sign
+
+
+def average(row: Dict[str, int]) -> Optional[float]:
+    return row['rating_sum'] / row['review_count'] if row['review_count'] > 0 else None
+
+
+async def upsert_deltas(session: AsyncSession, model, key: str, deltas: Dict[int, Dict[str, int]]):
+    """Прибавляет deltas к строкам статистики, создавая недостающие."""
+    table = model.__table__
+    rows = [{key: key_value, **delta} for key_value, delta in deltas.items() if any(delta.values())]
+    if not rows:
+        return
+    with_average = 'rating_avg' in table.c
+    stmt = conflict_insert(session, table)
+    if stmt is not None:
+        values = {name: table.c[name] + stmt.excluded[name] for name in COUNTERS}
+        if with_average:
+            values['rating_avg'] = ((table.c.rating_sum + stmt.excluded.rating_sum) * 1.0
+                                    / func.nullif(table.c.review_count + stmt.excluded.review_count, 0))
+            for row in rows:
+                row['rating_avg'] = average(row)
+        await session.execute(stmt.on_conflict_do_update(index_elements=[table.c[key]], set_=values), rows)
+        return
+    for row in rows:
+        values = {name: table.c[name] + row[name] for name in COUNTERS}
+        if with_average:
+            values['rating_avg'] = ((table.c.rating_sum + row['rating_sum']) * 1.0
+                                    / func.nullif(table.c.review_count + row['review_count'], 0))
+        result = await session.execute(update(table).where(table.c[key] == row[key]).values(values))
+        if not result.rowcount:
+            if with_average:
+                row['rating_avg'] = average(row)
+            await session.execute(insert(table).values(row))
+
+
+async def apply_rating_changes(session: AsyncSession, changes: Iterable[RatingChange]):
+    """Обновляет статистику пользователей и фильмов в текущей транзакции сессии."""
+    by_user = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    by_catalog = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for change in changes:
+        for delta in (by_user[change.user_id], by_catalog[change.catalog_id]):
+            add_rating(delta, change.old, -1)
+            add_rating(delta, change.new, 1)
+    await upsert_deltas(session, UserStats, 'user_id', by_user)
+    await upsert_deltas(session, CatalogStats, 'catalog_id', by_catalog)
+
+
+async def record_new_reviews(session: AsyncSession, reviews: Sequence[Review]):
+    """Учитывает только что вставленные рецензии; годится и как хук группового коммита."""
+    catalog_ids = dict((await session.execute(
+        select(Movie.id, Movie.catalog_id).where(Movie.id.in_({review.movie_id for review in reviews})))).all())
+    await apply_rating_changes(session, [
+        RatingChange(review.user_id, catalog_ids[review.movie_id], None, review.rating)
+        for review in reviews if review.movie_id in catalog_ids])
+
+
+def rating_aggregates():
+    return [func.count(Review.id), func.coalesce(func.sum(Review.rating), 0)] + [
+        func.coalesce(func.sum(case((Review.rating == rating, 1), else_=0)), 0) for rating in RATINGS]
+
+
+def user_aggregates():
+    return select(Review.user_id, *rating_aggregates()).group_by(Review.user_id)
+
+
+def catalog_aggregates():
+    return (select(Movie.catalog_id, *rating_aggregates())
+            .join(Review, Review.movie_id == Movie.id)
+            .group_by(Movie.catalog_id))
+
+
+TARGETS = (
+    # (таблица статистики, ключ, таблица с id, агрегат, столбец агрегата для диапазона)
+    (UserStats, 'user_id', User.id, user_aggregates, Review.user_id),
+    (CatalogStats, 'catalog_id', CatalogMovie.id, catalog_aggregates, Movie.catalog_id),
+)
+
+
+def key_range(column, after: int, until: Optional[int]):
+    condition = column > after
+    return condition if until is None else condition & (column <= until)
+
+
+async def rebuild_batch(session: AsyncSession, model, key: str, aggregates, source_key, after: int,
+                        until: Optional[int], fix: bool) -> int:
+    """Пересчитывает строки с ключом в (after, until]; until = None — до конца."""
+    table = model.__table__
+    columns = [table.c[key]] + [table.c[name] for name in COUNTERS]
+    in_range = key_range(table.c[key], after, until)
+    if fix:
+        # DELETE … RETURNING сразу берёт блокировку на запись: параллельное
+        # обновление статистики дождётся коммита пачки и прибавится к новым значениям.
+        stored_query = delete(table).where(in_range).returning(*columns)
+    else:
+        stored_query = select(*columns).where(in_range)
+    stored = {row[0]: dict(zip(COUNTERS, row[1:])) for row in await session.execute(stored_query)}
+    expected = {row[0]: dict(zip(COUNTERS, row[1:]))
+                for row in await session.execute(aggregates().where(key_range(source_key, after, until)))}
+
+    zero = dict.fromkeys(COUNTERS, 0)
+    mismatched = [key_value for key_value in stored.keys() | expected.keys()
+                  if stored.get(key_value, zero) != expected.get(key_value, zero)]
+    if fix and expected:
+        rows = [{key: key_value, **counters} for key_value, counters in expected.items()]
+        if 'rating_avg' in table.c:
+            for row in rows:
+                row['rating_avg'] = average(row)
+        await session.execute(insert(table), rows)
+    return len(mismatched)
+
+
+async def rebuild(session_pool: async_sessionmaker = AsyncSessionLocal, fix: bool = True,
+                  batch_size: int = STATS_BATCH_SIZE) -> Dict[str, int]:
+    """Пересчитывает статистику пачками по batch_size id и возвращает число расхождений по таблицам.
+
+    С fix=False только сравнивает. Каждая пачка — отдельная транзакция;
+    последняя захватывает и строки с ключами больше последнего id.
+    """
+    report = {}
+    for model, key, id_column, aggregates, source_key in TARGETS:
+        mismatches = 0
+        last_id = 0
+        done = False
+        while not done:
+            async with session_pool() as session:
+                if fix:
+                    use_primary(session)
+                async with session.begin():
+                    ids = (await session.scalars(
+                        select(id_column).where(id_column > last_id).order_by(id_column).limit(batch_size))).all()
+                    done = len(ids) < batch_size
+                    mismatches += await rebuild_batch(session, model, key, aggregates, source_key, last_id,
+                                                      None if done else ids[-1], fix)
+            if ids:
+                last_id = ids[-1]
+        report[model.__tablename__] = mismatches
+        logger.info('%s: расхождений %s%s', model.__tablename__, mismatches,
+                    ', исправлено' if fix and mismatches else '')
+    return report
+
+
+async def main(command: str):
+    try:
+        report = await rebuild(fix=command == 'rebuild')
+        for table, mismatches in report.items():
+            print(f'{table}: расхождений {mismatches}')
+    finally:
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Проверка и пересчёт статистики оценок')
+    parser.add_argument('command', choices=['check', 'rebuild'])
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args().command))
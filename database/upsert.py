@@ -0,0 +1,18 @@
+"""INSERT … ON CONFLICT для PostgreSQL и SQLite.
+
+Обе СУБД понимают on_conflict_do_nothing и on_conflict_do_update, но через
+разные конструкции insert. Для остальных диалектов вызывающий код пишет свой
+запасной вариант через ORM.
+"""
+from typing import Optional
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+CONFLICT_INSERTS = {'postgresql': pg_insert, 'sqlite': sqlite_insert}
+
+
+def conflict_insert(session: AsyncSession, target) -> Optional[object]:
+    """insert(target) диалекта сессии с поддержкой ON CONFLICT; None — диалект её не поддерживает."""
+    insert = CONFLICT_INSERTS.get(session.bind.dialect.name)
+    return insert(target) if insert is not None else None
@@ -1,10 +1,16 @@
+import argparse
 import asyncio
 from bot.create_bot import main as start_bot
+from config import BOT_MODE, WORKER_PROCESSES
 from database.database import init_db
 
-async def main():
+async def main(mode: str, workers: int):
     await init_db()
-    await start_bot()
+    await start_bot(mode, workers)
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default=BOT_MODE)
+    parser.add_argument('--workers', type=int, default=WORKER_PROCESSES)
+    args = parser.parse_args()
+    asyncio.run(main(args.mode, args.workers))
\ No newline at end of file